@@ -1,38 +1,62 @@
+import time
+_IMPORT_START = time.perf_counter()
+
 import uvicorn
-from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, Form, Request
 from pydantic import BaseModel
 from typing import List
 import os
 import uuid
+import re
 import json
-import requests
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from diffusers import StableDiffusionPipeline
-import torch
 import asyncio
 from queue import Queue
 import threading
 from io import BytesIO
 import base64
-import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
-from sklearn.metrics import accuracy_score, mean_squared_error
-import matplotlib.pyplot as plt
-from sqlalchemy import create_engine, text
-from RestrictedPython import compile_restricted, safe_globals, limited_builtins
 import sqlite3
-import numpy as np
-import cv2
-from PIL import Image
 import io
+from lazy_imports import LazyModule, import_report
+from image_engine import ImageBatchScheduler, QueueFullError
+from model_manager import PipelinePool
+from image_cache import ImageCache, cache_key
+from ws_protocol import wants_binary, send_bytes_payload, send_file_payload, send_stream_start, send_stream_end
+from elevenlabs_client import ElevenLabsClient, ElevenLabsError
+from tts_cache import TTSCache, tts_cache_key
+from voice_cache import VoiceCache, etag_matches
+from file_store import save_upload, RequestSizeLimitMiddleware, UploadTooLargeError
+from file_catalog import FileCatalog
+from train_jobs import JobQueue, FINISHED, SUCCEEDED
+from chat_engine import ChatEngine, AdapterNotFoundError, BaseModelMismatchError, RequestTooLargeError
+from chat_sessions import SessionStore, SessionNotFoundError
+from tool_executor import ToolExecutor, ToolTimeoutError, ToolBusyError
+from tools import execute_code, run_automl, generate_chart
+from automl_store import ModelStore, ModelCache, ModelNotFoundError, predict_csv
+from model_registry import resolve_base_model
+
+# Heavy dependencies are imported on first use by the capability that needs them,
+# so workers that only serve /health, /models or /upload start in milliseconds.
+torch = LazyModule("torch", "image_gen")
+diffusers = LazyModule("diffusers", "image_gen")
+pd = LazyModule("pandas", "data")
+np = LazyModule("numpy", "data")
+sqlalchemy = LazyModule("sqlalchemy", "db_query")
+cv2 = LazyModule("cv2", "ar_filter")
+PIL_Image = LazyModule("PIL.Image", "3d_gen")
 
 app = FastAPI()
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 app.mount("/exports", StaticFiles(directory="exports"), name="exports")
 
+# Oversized uploads are refused from their Content-Length, before the body is read.
+# Added before CORS so the 413 still carries CORS headers.
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "200")) * 1024 * 1024
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_MB", "1024")) * 1024 * 1024
+app.add_middleware(RequestSizeLimitMiddleware, max_bytes=MAX_REQUEST_BYTES)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -43,34 +67,105 @@ app.add_middleware(
 )
 print("CORS middleware loaded")
 
-# Initialize global model variable
-model = None
+IMAGE_MODEL_ID = "runwayml/stable-diffusion-v1-5"
+# "default" keeps the pipeline's own scheduler; otherwise a diffusers scheduler class name,
+# e.g. DPMSolverMultistepScheduler (part of the image cache key)
+IMAGE_SCHEDULER = os.getenv("IMAGE_SCHEDULER", "default")
+IMAGE_REPLICAS = int(os.getenv("IMAGE_REPLICAS", "1"))
+
+def _build_pipeline():
+    print("Loading Stable Diffusion model...")
+    if IMAGE_REPLICAS > 1 and not torch.cuda.is_available() and os.cpu_count():
+        # Replicas share the process-wide torch thread pool; split cores between them
+        torch.set_num_threads(max(1, os.cpu_count() // IMAGE_REPLICAS))
+    pipeline = diffusers.StableDiffusionPipeline.from_pretrained(
+        IMAGE_MODEL_ID,
+        torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32
+    )
+    if IMAGE_SCHEDULER != "default":
+        scheduler_cls = getattr(diffusers, IMAGE_SCHEDULER, None)
+        if scheduler_cls is None or not hasattr(scheduler_cls, "from_config"):
+            raise ValueError(f"Unknown IMAGE_SCHEDULER {IMAGE_SCHEDULER}")
+        pipeline.scheduler = scheduler_cls.from_config(pipeline.scheduler.config)
+        print(f"Image scheduler: {IMAGE_SCHEDULER}")
+    if torch.cuda.is_available():
+        pipeline = pipeline.to("cuda")
+    else:
+        pipeline = pipeline.to("cpu")
+    print("Stable Diffusion model loaded.")
+    return pipeline
+
+def _warm_up_pipeline(pipeline):
+    # One tiny dummy inference so kernels/allocations are ready before real traffic
+    pipeline(prompt=["warm-up"], num_inference_steps=1, width=64, height=64)
+
+# Stable Diffusion pipelines (loaded once, on demand or at startup)
+image_pool = PipelinePool(
+    _build_pipeline,
+    replicas=IMAGE_REPLICAS,
+    warmup=_warm_up_pipeline if os.getenv("IMAGE_WARMUP", "1") == "1" else None,
+)
+
+def _make_generator(seed):
+    generator = torch.Generator("cuda" if torch.cuda.is_available() else "cpu")
+    if seed is None:
+        generator.seed()
+    else:
+        generator.manual_seed(seed)
+    return generator
 
-# Stable Diffusion model (loaded on demand)
 def load_model():
-    global model
-    if model is None:
-        try:
-            print("Loading Stable Diffusion model...")
-            model = StableDiffusionPipeline.from_pretrained(
-                "runwayml/stable-diffusion-v1-5",
-                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32
-            )
-            if torch.cuda.is_available():
-                model = model.to("cuda")
-            else:
-                model = model.to("cpu")
-            print("Stable Diffusion model loaded.")
-        except Exception as e:
-            print(f"Failed to load Stable Diffusion model: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Model loading failed: {str(e)}")
-    return model
+    try:
+        return image_pool.load()
+    except Exception as e:
+        print(f"Failed to load Stable Diffusion model: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Model loading failed: {str(e)}")
+
+# Batched image generation across all /ws/image-gen sockets
+image_scheduler = None
+_image_scheduler_lock = threading.Lock()
+
+def get_image_scheduler():
+    global image_scheduler
+    with _image_scheduler_lock:
+        if image_scheduler is None:
+            image_scheduler = ImageBatchScheduler(
+                image_pool,
+                max_batch_size=int(os.getenv("IMAGE_MAX_BATCH", "4")),
+                max_queue=int(os.getenv("IMAGE_MAX_QUEUE", "32")),
+                generator_factory=_make_generator,
+            ).start()
+    return image_scheduler
+
+@app.on_event("startup")
+def preload_image_model():
+    if os.getenv("IMAGE_PRELOAD", "0") == "1":
+        # Load in the background so /health answers while the weights come in
+        threading.Thread(target=load_model, name="image-preload", daemon=True).start()
 
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY", "sk_d94c86a5d0aca5ad33d4720ea9292b183b5aa9d91ac256dd")
+# Pooled async client; ELEVENLABS_BASE_URL can point at a local stand-in server
+elevenlabs = ElevenLabsClient(
+    ELEVENLABS_API_KEY,
+    base_url=os.getenv("ELEVENLABS_BASE_URL", "https://api.elevenlabs.io"),
+    max_concurrency=int(os.getenv("ELEVENLABS_CONCURRENCY", "4")),
+)
+
+@app.on_event("shutdown")
+async def close_elevenlabs():
+    await elevenlabs.aclose()
 
 # SQLite database setup
 DATABASE_URL = "sqlite:///uploads/forgebot.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    global engine
+    with _engine_lock:
+        if engine is None:
+            engine = sqlalchemy.create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    return engine
 
 # Initialize database
 def init_db():
@@ -232,6 +327,160 @@ os.makedirs(EXPORT_DIR, exist_ok=True)
 os.makedirs(FINE_TUNE_DIR, exist_ok=True)
 os.makedirs(VOICE_DIR, exist_ok=True)
 
+# Content-addressed storage for uploads; per-upload paths are hard links into it
+BLOB_DIR = os.path.join(UPLOAD_DIR, "blobs")
+
+# File catalog (uploads/forgebot.db) and garbage collection of expired/orphaned files
+file_catalog = FileCatalog(get_engine)
+EXPORT_TTL = float(os.getenv("EXPORT_TTL_HOURS", "168")) * 3600
+AUTOML_MODEL_TTL = float(os.getenv("AUTOML_MODEL_TTL_HOURS", "720")) * 3600
+FILE_GC_INTERVAL = float(os.getenv("FILE_GC_INTERVAL", "3600"))
+
+# Training jobs are queued here and run by train_worker.py processes
+train_queue = JobQueue("uploads/forgebot.db")
+
+# Chat: one resident base model, fine-tuned bots served as hot-swapped LoRA adapters
+CHAT_BASE_MODEL = os.getenv("CHAT_BASE_MODEL", resolve_base_model("2"))
+TRAIN_RUNS_DIR = os.path.join(FINE_TUNE_DIR, "runs")
+chat_engine = ChatEngine(CHAT_BASE_MODEL, max_adapters=int(os.getenv("CHAT_MAX_ADAPTERS", "8")))
+if os.getenv("CHAT_BATCHING", "1") == "1":
+    # Continuous batching: concurrent chats share decode steps on the resident model
+    chat_engine.enable_batching(
+        max_batch_size=int(os.getenv("CHAT_MAX_BATCH", "8")),
+        kv_budget_bytes=int(float(os.getenv("CHAT_KV_BUDGET_MB", "2048")) * 1024 * 1024),
+        max_queue=int(os.getenv("CHAT_MAX_QUEUE", "64")),
+    )
+    # KV state of each bot's system prompt, reused by every request to that bot
+    chat_engine.enable_prefix_cache(
+        max_bytes=int(float(os.getenv("CHAT_PREFIX_CACHE_MB", "512")) * 1024 * 1024),
+        cache_full_prompts=os.getenv("CHAT_PREFIX_CACHE_PROMPTS", "0") == "1",
+    )
+
+def resolve_chat_route(model_id: str):
+    """model_id -> base model and LoRA adapter (None for a plain registry model)."""
+    base_model = resolve_base_model(model_id)
+    if base_model is not None:
+        route = {"base_model": base_model, "adapter_id": None, "adapter_path": None, "customization": {}}
+    else:
+        job = train_queue.get(model_id)
+        if job is None or job["status"] != SUCCEEDED:
+            return None
+        route = {
+            "base_model": job["params"]["base_model"],
+            "adapter_id": model_id,
+            "adapter_path": os.path.join(TRAIN_RUNS_DIR, model_id, "lora_adapter"),
+            "customization": job["params"].get("customization") or {},
+        }
+    # Checked before anything loads the resident model or touches a session
+    if route["base_model"] != chat_engine.base_model:
+        raise HTTPException(status_code=409,
+                            detail=f"Model {model_id} needs base model {route['base_model']}; "
+                                   f"this server serves {chat_engine.base_model}")
+    return route
+
+# Server-side conversation history, trimmed to each bot's context_window
+chat_sessions = SessionStore(
+    chat_engine.encode_message,
+    idle_ttl=float(os.getenv("CHAT_SESSION_TTL_MINUTES", "60")) * 60,
+    max_bytes=int(float(os.getenv("CHAT_SESSION_MB", "64")) * 1024 * 1024),
+    policy=os.getenv("CHAT_SESSION_POLICY", "sliding"),
+)
+
+@app.delete("/chat/sessions/{session_id}")
+async def delete_chat_session(session_id: str):
+    if not chat_sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"message": "Session deleted"}
+
+@app.on_event("startup")
+def preload_chat_model():
+    if os.getenv("CHAT_PRELOAD", "0") == "1":
+        threading.Thread(target=chat_engine.load, name="chat-preload", daemon=True).start()
+
+UPLOAD_NAME_RE = re.compile(r"^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})_(.+)$")
+
+def _parse_upload_name(name: str):
+    # "<file_id>_<filename>", as save_upload (and /upload before the catalog) names files
+    match = UPLOAD_NAME_RE.match(name)
+    return (match.group(1), match.group(2)) if match else None
+
+def _parse_export_name(name: str):
+    # "<trained_model_id>.zip" from training; other exports are only served as static files
+    return (name[:-len(".zip")], "trained_bot.zip") if name.endswith(".zip") else None
+
+@app.on_event("startup")
+def backfill_file_catalog():
+    # Files stored before the catalog existed would otherwise 404 on /files/{id} and /export/{id}
+    started = time.perf_counter()
+    added = {kind: file_catalog.backfill(kind, directory, parse)
+             for kind, directory, parse in (("upload", UPLOAD_DIR, _parse_upload_name),
+                                            ("voice", VOICE_DIR, _parse_upload_name),
+                                            ("export", EXPORT_DIR, _parse_export_name))}
+    if any(added.values()):
+        print(f"Backfilled file catalog in {time.perf_counter() - started:.2f}s: {added}")
+
+@app.on_event("startup")
+def start_file_gc():
+    file_catalog.start_gc(FILE_GC_INTERVAL, BLOB_DIR)
+
+# CPU-heavy tools (AutoML, charts, code) run in worker processes, DB queries in threads,
+# so a model fit never blocks other requests on the event loop
+tool_executor = ToolExecutor(
+    process_workers=int(os.getenv("TOOL_PROCESS_WORKERS", str(max(1, (os.cpu_count() or 2) // 2)))),
+    thread_workers=int(os.getenv("TOOL_THREAD_WORKERS", "8")),
+    limits={"automl": int(os.getenv("AUTOML_CONCURRENCY", "1")), "chart": 2, "code_exec": 2, "db_query": 4,
+            "automl_predict": int(os.getenv("AUTOML_PREDICT_CONCURRENCY", "4"))},
+)
+TOOL_TIMEOUTS = {"automl": float(os.getenv("AUTOML_TIMEOUT", "600")), "chart": 60.0, "code_exec": 30.0,
+                 "db_query": 30.0, "automl_predict": float(os.getenv("AUTOML_PREDICT_TIMEOUT", "600"))}
+
+async def run_tool(tool: str, fn, *args, cpu: bool = True, **kwargs):
+    try:
+        return await tool_executor.run(tool, fn, *args, cpu=cpu, timeout=TOOL_TIMEOUTS[tool], **kwargs)
+    except (ToolTimeoutError, ToolBusyError, RuntimeError) as e:
+        return f"Error: {e}"
+
+@app.on_event("shutdown")
+def stop_tool_executor():
+    tool_executor.shutdown()
+
+# Trained AutoML models are registered here and kept loaded (memory-mapped) for prediction
+automl_store = ModelStore("uploads/forgebot.db")
+automl_models = ModelCache(
+    automl_store,
+    max_models=int(os.getenv("AUTOML_CACHE_MODELS", "8")),
+    max_bytes=int(os.getenv("AUTOML_CACHE_MB", "2048")) * 1024 * 1024,
+)
+AUTOML_PREDICT_CHUNK_ROWS = int(os.getenv("AUTOML_PREDICT_CHUNK_ROWS", "50000"))
+
+def expire_automl_model(record: dict):
+    # The catalog already deleted the joblib file; drop the registry entry that points at it
+    automl_store.remove(record["file_id"])
+    automl_models.invalidate(record["file_id"])
+
+file_catalog.on_expire("automl_model", expire_automl_model)
+
+async def train_automl(dataset_path: str, task: str, target_column: str):
+    result = await run_tool("automl", run_automl, dataset_path, task, target_column)
+    if isinstance(result, str):
+        return result
+    automl_store.add(result, dataset_path=dataset_path)
+    file_catalog.add("automl_model", result["model_path"], file_id=result["model_id"], ttl=AUTOML_MODEL_TTL)
+    return {"model_id": result["model_id"], "score": result["score"], "model_path": result["model_path"],
+            "metrics": result["metrics"]}
+
+def score_csv(model_id: str, in_path: str, out_path: str) -> int:
+    model, record = automl_models.get(model_id)
+    return predict_csv(model, record, in_path, out_path, AUTOML_PREDICT_CHUNK_ROWS)
+
+# Synthesized speech, keyed by text hash, voice, language, model and voice settings
+TTS_CACHE_DIR = os.path.join(UPLOAD_DIR, "tts_cache").replace("\\", "/")
+tts_cache = TTSCache(TTS_CACHE_DIR, max_bytes=int(os.getenv("TTS_CACHE_MB", "512")) * 1024 * 1024)
+
+# Generated images, content-addressed by request parameters
+IMAGE_CACHE_DIR = os.path.join(EXPORT_DIR, "image_cache")
+image_cache = ImageCache(IMAGE_CACHE_DIR, max_bytes=int(os.getenv("IMAGE_CACHE_MB", "1024")) * 1024 * 1024)
+
 # Pydantic Models
 class FileResponseModel(BaseModel):
     file_id: str
@@ -258,6 +507,7 @@ class ChatRequest(BaseModel):
     message: str
     voice_id: str = ""
     language: str = "en"
+    session_id: str = ""  # continue a server-side conversation; omitted -> a new session
 
 class CodeExecRequest(BaseModel):
     code: str
@@ -286,113 +536,32 @@ class ARFilterRequest(BaseModel):
     input_path: str = ""
 
 # ElevenLabs TTS
-def generate_tts(text: str, voice_id: str = "", language: str = "en"):
-    print(f"Generating TTS: text={text[:50]}..., voice_id={voice_id}, language={language}")
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
-    headers = {
-        "Accept": "audio/mpeg",
-        "Content-Type": "application/json",
-        "xi-api-key": ELEVENLABS_API_KEY
-    }
-    data = {
-        "text": text,
-        "model_id": "eleven_multilingual_v2",
-        "voice_settings": {"stability": 0.5, "similarity_boost": 0.75}
-    }
-    response = requests.post(url, json=data, headers=headers)
-    if response.status_code != 200:
-        error_detail = response.json().get("detail", "Unknown error")
-        raise HTTPException(status_code=response.status_code, detail=f"TTS generation failed: {error_detail}")
-    audio_path = os.path.join(UPLOAD_DIR, f"tts_{uuid.uuid4()}.mp3")
-    with open(audio_path, "wb") as f:
-        f.write(response.content)
-    print(f"TTS generated: {audio_path}")
-    return audio_path
+TTS_MODEL_ID = "eleven_multilingual_v2"
+TTS_VOICE_SETTINGS = {"stability": 0.5, "similarity_boost": 0.75}
 
-# Code Interpreter
-def execute_code(code: str):
-    try:
-        restricted_globals = safe_globals.copy()
-        restricted_globals.update(limited_builtins)
-        restricted_globals["pd"] = pd
-        restricted_globals["plt"] = plt
-        compiled_code = compile_restricted(code, "<string>", "exec")
-        local_vars = {}
-        exec(compiled_code, restricted_globals, local_vars)
-        result = local_vars.get("result", "Code executed successfully")
-        if isinstance(result, pd.DataFrame):
-            return result.to_string()
-        return str(result)
-    except NameError as e:
-        if "__import__" in str(e):
-            return "Error: Imports are restricted. Use 'pd' for pandas and 'plt' for matplotlib, which are pre-imported."
-        return f"Error: {str(e)}"
-    except Exception as e:
-        return f"Error: {str(e)}"
+async def generate_tts(text: str, voice_id: str = "", language: str = "en", on_chunk=None):
+    """Cached ElevenLabs TTS; returns the MP3 path under uploads/tts_cache.
 
-# AutoML
-def run_automl(dataset_path: str, task: str, target_column: str):
-    try:
-        df = pd.read_csv(dataset_path)
-        if target_column not in df.columns:
-            raise ValueError(f"Target column '{target_column}' not found")
-        categorical_cols = df.select_dtypes(include=['object', 'category']).columns
-        df_encoded = pd.get_dummies(df, columns=[col for col in categorical_cols if col != target_column], drop_first=True)
-        X = df_encoded.drop(columns=[target_column])
-        y = df[target_column]
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-        
-        if task == "classification":
-            model = RandomForestClassifier(n_estimators=100, random_state=42)
-            model.fit(X_train, y_train)
-            y_pred = model.predict(X_test)
-            score = accuracy_score(y_test, y_pred)
-        elif task == "regression":
-            model = RandomForestRegressor(n_estimators=100, random_state=42)
-            model.fit(X_train, y_train)
-            y_pred = model.predict(X_test)
-            score = mean_squared_error(y_test, y_pred, squared=False)
-        else:
-            raise ValueError("Task must be 'classification' or 'regression'")
-        
-        model_path = os.path.join(EXPORT_DIR, f"model_{uuid.uuid4()}.joblib")
-        import joblib
-        joblib.dump(model, model_path)
-        return {"score": score, "model_path": model_path}
-    except Exception as e:
-        return f"Error: {str(e)}"
+    `on_chunk` (async) sees the audio chunk by chunk: live from ElevenLabs on a miss,
+    read back from disk on a hit."""
+    print(f"Generating TTS: text={text[:50]}..., voice_id={voice_id}, language={language}")
+    key = tts_cache_key(text, voice_id, language, TTS_MODEL_ID, TTS_VOICE_SETTINGS)
+
+    def synthesize():
+        return elevenlabs.stream_tts(text, voice_id, model_id=TTS_MODEL_ID, voice_settings=TTS_VOICE_SETTINGS)
 
-# Chart Generation
-def generate_chart(data_path: str, chart_type: str, x_column: str, y_column: str, title: str):
     try:
-        df = pd.read_csv(data_path)
-        if x_column not in df.columns or y_column not in df.columns:
-            raise ValueError(f"Columns '{x_column}' or '{y_column}' not found")
-        
-        plt.figure(figsize=(8, 6))
-        if chart_type == "bar":
-            df.groupby(x_column)[y_column].sum().plot(kind="bar")
-        elif chart_type == "line":
-            df.plot(x=x_column, y=y_column, kind="line")
-        elif chart_type == "pie":
-            df.groupby(x_column)[y_column].sum().plot(kind="pie")
-        else:
-            raise ValueError("Unsupported chart type")
-        
-        plt.title(title or f"{y_column} by {x_column}")
-        chart_path = os.path.join(EXPORT_DIR, f"chart_{uuid.uuid4()}.png").replace("\\", "/")
-        plt.savefig(chart_path)
-        plt.close()
-        with open(chart_path, "rb") as f:
-            chart_data = base64.b64encode(f.read()).decode()
-        return chart_path, chart_data
-    except Exception as e:
-        return f"Error: {str(e)}"
+        audio_path, cached = await tts_cache.get_or_create(key, synthesize, on_chunk=on_chunk)
+    except ElevenLabsError as e:
+        raise HTTPException(status_code=e.status_code, detail=f"TTS generation failed: {e.detail}")
+    print(f"TTS {'cache hit' if cached else 'generated'}: {audio_path}")
+    return audio_path
 
 # Database Query
 def execute_query(query: str):
     try:
-        with engine.connect() as connection:
+        text = sqlalchemy.text
+        with get_engine().connect() as connection:
             if query.lower().startswith("select"):
                 table_name = query.lower().split("from")[1].split("where")[0].strip()
                 result = connection.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name=:table"), {"table": table_name})
@@ -438,12 +607,14 @@ def generate_3d_model(prompt: str, art_style: str):
         
         # Save texture as PNG
         texture_path = os.path.join(EXPORT_DIR, f"texture_{uuid.uuid4()}.png").replace("\\", "/")
-        Image.fromarray(texture).save(texture_path)
+        PIL_Image.fromarray(texture).save(texture_path)
+        file_catalog.add("texture", texture_path, ttl=EXPORT_TTL)
         
         # Save simple GLB (placeholder, not actual 3D generation)
         glb_path = os.path.join(EXPORT_DIR, f"model_{uuid.uuid4()}.glb").replace("\\", "/")
         with open(glb_path, "wb") as f:
             f.write(b"Placeholder GLB content")  # Simulate GLB file
+        file_catalog.add("model_3d", glb_path, ttl=EXPORT_TTL)
         return glb_path, texture_path
     except Exception as e:
         return f"Error: {str(e)}"
@@ -492,6 +663,7 @@ def generate_ar_filter(effect: str, input_path: str):
         out = cv2.VideoWriter(output_path, fourcc, 30.0, (frame.shape[1], frame.shape[0]))
         out.write(frame)
         out.release()
+        file_catalog.add("ar_filter", output_path, ttl=EXPORT_TTL)
         
         return output_path
     except Exception as e:
@@ -502,10 +674,38 @@ def generate_ar_filter(effect: str, input_path: str):
 def health():
     return {"status": "ok"}
 
+@app.get("/startup-report")
+def startup_report():
+    return import_report(STARTUP_SECONDS)
+
+@app.get("/metrics/image-gen")
+def image_gen_metrics():
+    return get_image_scheduler().metrics()
+
+@app.get("/metrics/chat")
+def chat_metrics():
+    return {**chat_engine.metrics(), "sessions": chat_sessions.metrics()}
+
+@app.get("/metrics/tools")
+def tool_metrics():
+    return tool_executor.metrics()
+
+@app.get("/metrics/tts-cache")
+def tts_cache_metrics():
+    return tts_cache.metrics()
+
+@app.get("/metrics/image-cache")
+def image_cache_metrics():
+    return image_cache.metrics()
+
 @app.get("/models")
 def get_models():
     return {"models": list_models()}
 
+@app.get("/metrics/automl")
+def automl_metrics():
+    return automl_models.metrics()
+
 @app.get("/models/{model_id}")
 def get_model_details(model_id: str):
     model = get_model(model_id)
@@ -513,38 +713,116 @@ def get_model_details(model_id: str):
         raise HTTPException(status_code=404, detail="Model not found")
     return model
 
+# Voice list served from memory; refreshed ahead of expiry, stale copy kept if ElevenLabs is down
+voice_cache = VoiceCache(
+    elevenlabs.get_voices,
+    ttl=float(os.getenv("VOICES_TTL_SECONDS", "600")),
+    refresh_ahead=float(os.getenv("VOICES_REFRESH_AHEAD_SECONDS", "60")),
+    max_stale=float(os.getenv("VOICES_MAX_STALE_HOURS", "24")) * 3600,
+)
+
 @app.get("/voices")
-async def get_voices():
-    print("Fetching ElevenLabs voices")
-    url = "https://api.elevenlabs.io/v1/voices"
-    headers = {"xi-api-key": ELEVENLABS_API_KEY}
-    response = requests.get(url, headers=headers)
-    if response.status_code != 200:
-        error_detail = response.json().get("detail", "Unknown error")
-        raise HTTPException(status_code=response.status_code, detail=f"Failed to fetch voices: {error_detail}")
-    print(f"Voices fetched: {len(response.json()['voices'])} voices")
-    return response.json()
+async def get_voices(request: Request):
+    try:
+        body, etag, age = await voice_cache.get()
+    except ElevenLabsError as e:
+        raise HTTPException(status_code=e.status_code, detail=f"Failed to fetch voices: {e.detail}")
+    headers = {"ETag": etag, "Age": str(int(age)),
+               "Cache-Control": f"private, max-age={max(0, int(voice_cache.ttl - age))}"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        voice_cache.stats["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/metrics/voices")
+def voices_metrics():
+    return {"cache": voice_cache.metrics(), "upstream": elevenlabs.metrics()}
 
 @app.post("/upload")
-async def upload_files(files: List[UploadFile] = File(...)):
+async def upload_files(files: List[UploadFile] = File(...), owner: str = Form("")):
     uploaded = []
-    for file in files:
-        print(f"Received file: {file.filename}, size: {file.size} bytes")
-        file_id = str(uuid.uuid4())
-        file_path = os.path.join(UPLOAD_DIR, f"{file_id}_{file.filename}").replace("\\", "/")
-        with open(file_path, "wb") as buffer:
-            buffer.write(await file.read())
-        uploaded.append({"file_id": file_id, "filename": file.filename, "path": file_path})
+    remaining = MAX_REQUEST_BYTES
+    try:
+        for file in files:
+            print(f"Received file: {file.filename}, size: {file.size} bytes")
+            saved = await save_upload(file, UPLOAD_DIR, BLOB_DIR, min(MAX_UPLOAD_BYTES, remaining))
+            remaining -= saved["size"]
+            uploaded.append(saved)
+    except BaseException as e:
+        # Keep none of the request's files, whatever stopped it: size limit, disk error, client gone
+        for saved in uploaded:
+            try:
+                os.remove(saved["path"])
+            except OSError:
+                pass
+        if isinstance(e, UploadTooLargeError):
+            raise HTTPException(status_code=413, detail=str(e))
+        raise
+    for u in uploaded:
+        file_catalog.add("upload", u["path"], file_id=u["file_id"], filename=u["filename"],
+                         size=u["size"], sha256=u["sha256"], owner=owner or None)
     print(f"Uploaded files: {uploaded}")
-    return {"uploaded_files": uploaded}
+    return {"uploaded_files": [
+        {"file_id": u["file_id"], "filename": u["filename"], "path": u["path"],
+         "size": u["size"], "sha256": u["sha256"]}
+        for u in uploaded
+    ]}
 
 @app.delete("/files/{file_id}")
 async def delete_file(file_id: str):
-    for file in os.listdir(UPLOAD_DIR):
-        if file.startswith(file_id):
-            os.remove(os.path.join(UPLOAD_DIR, file))
-            return {"message": "File deleted"}
-    raise HTTPException(status_code=404, detail="File not found")
+    # Uploads only; exports, voices and other artifacts have their own lifecycles
+    if file_catalog.remove(file_id, kind="upload") is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return {"message": "File deleted"}
+
+@app.get("/automl/models")
+def list_automl_models(limit: int = 100):
+    return {"models": automl_store.list(limit)}
+
+@app.get("/automl/models/{model_id}")
+def get_automl_model(model_id: str):
+    record = automl_store.get(model_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Model not found")
+    return record
+
+@app.delete("/automl/models/{model_id}")
+def delete_automl_model(model_id: str):
+    record = automl_store.remove(model_id)
+    automl_models.invalidate(model_id)
+    file_catalog.remove(model_id, kind="automl_model")
+    if record is None:
+        raise HTTPException(status_code=404, detail="Model not found")
+    return {"message": "Model deleted"}
+
+@app.post("/automl/models/{model_id}/predict")
+async def automl_predict(model_id: str, file: UploadFile = File(...)):
+    """Score an uploaded CSV; returns it as CSV with a predicted_<target> column added."""
+    if automl_store.get(model_id) is None:
+        raise HTTPException(status_code=404, detail="Model not found")
+    try:
+        saved = await save_upload(file, UPLOAD_DIR, BLOB_DIR, MAX_UPLOAD_BYTES)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    file_catalog.add("upload", saved["path"], file_id=saved["file_id"], filename=saved["filename"],
+                     size=saved["size"], sha256=saved["sha256"], ttl=EXPORT_TTL)
+    out_path = os.path.join(EXPORT_DIR, f"predictions_{uuid.uuid4()}.csv").replace("\\", "/")
+    started = time.perf_counter()
+    try:
+        rows = await tool_executor.run("automl_predict", score_csv, model_id, saved["path"], out_path,
+                                       cpu=False, timeout=TOOL_TIMEOUTS["automl_predict"])
+    except ModelNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ToolBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ToolTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except (ValueError, KeyError) as e:
+        raise HTTPException(status_code=400, detail=f"Cannot score {saved['filename']}: {e}")
+    record = file_catalog.add("export", out_path, ttl=EXPORT_TTL)
+    print(f"AutoML {model_id} scored {rows} rows in {time.perf_counter() - started:.2f}s")
+    return FileResponse(out_path, media_type="text/csv", filename=f"predictions_{model_id}.csv",
+                        headers={"X-Rows": str(rows), "X-File-Id": record["file_id"]})
 
 @app.post("/customize")
 async def save_customization(custom: Customization):
@@ -553,25 +831,105 @@ async def save_customization(custom: Customization):
 @app.post("/train")
 async def train_bot(request: TrainRequest):
     print("Received /train request with:", request.dict())
-    data_path = os.path.join(FINE_TUNE_DIR, f"data_{uuid.uuid4()}.jsonl").replace("\\", "/")
-    with open(data_path, "w") as f:
-        for file_path in request.files:
-            with open(file_path, "r") as data_file:
-                content = data_file.read()
-                f.write(json.dumps({"instruction": content[:100], "response": "Sample response"}) + "\n")
-    fine_tuned_model_id = str(uuid.uuid4())
-    print(f"Simulating training for model {request.model_id} with data {data_path}")
-    export_path = os.path.join(EXPORT_DIR, f"{fine_tuned_model_id}.zip").replace("\\", "/")
-    with open(export_path, "wb") as f:
-        f.write(b"Fine-tuned model content")
-    return {"message": "Training complete", "trained_model_id": fine_tuned_model_id}
+    base_model = resolve_base_model(request.model_id)
+    if base_model is None:
+        raise HTTPException(status_code=400, detail=f"Model {request.model_id} cannot be fine-tuned")
+    files = [file_catalog.resolve_path(file_ref) for file_ref in request.files]
+    missing = [f for f in files if not os.path.exists(f)]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Files not found: {missing}")
+    job_id = train_queue.enqueue({
+        "base_model": base_model,
+        "files": files,
+        "customization": request.customization.dict(),
+    }, model_id=request.model_id)
+    print(f"Queued training job {job_id} for model {request.model_id}")
+    return {"message": "Training queued", "trained_model_id": job_id, "job_id": job_id, "status": "queued"}
+
+@app.get("/train/{job_id}")
+async def train_status(job_id: str):
+    job = train_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/train/{job_id}/cancel")
+async def cancel_training(job_id: str):
+    if not train_queue.request_cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job is not queued or running")
+    return {"message": "Cancellation requested", "job": train_queue.get(job_id)}
+
+@app.post("/train/{job_id}/resume")
+async def resume_training(job_id: str):
+    if not train_queue.resume(job_id):
+        raise HTTPException(status_code=409, detail="Only failed or cancelled jobs can be resumed")
+    return {"message": "Training re-queued", "job": train_queue.get(job_id)}
+
+@app.websocket("/ws/train/{job_id}")
+async def train_progress_ws(websocket: WebSocket, job_id: str):
+    await websocket.accept()
+    print(f"WebSocket /ws/train/{job_id} connected")
+    loop = asyncio.get_running_loop()
+    last = None
+    try:
+        while True:
+            job = await loop.run_in_executor(None, train_queue.get, job_id)
+            if job is None:
+                await websocket.send_text("Error: Job not found")
+                break
+            update = {k: job[k] for k in ("status", "progress", "error")}
+            if update != last:
+                await websocket.send_json(update)
+                last = update
+            if job["status"] in FINISHED:
+                break
+            await asyncio.sleep(1)
+    except Exception as e:
+        print(f"WebSocket /ws/train error: {e}")
+    finally:
+        await websocket.close()
 
 @app.get("/export/{trained_model_id}")
 async def export_bot(trained_model_id: str):
-    export_path = os.path.join(EXPORT_DIR, f"{trained_model_id}.zip").replace("\\", "/")
-    if not os.path.exists(export_path):
+    record = file_catalog.get(trained_model_id, kind="export")
+    if record is None or not os.path.exists(record["path"]):
         raise HTTPException(status_code=404, detail="Model not found")
-    return FileResponse(export_path, filename="trained_bot.zip")
+    return FileResponse(record["path"], filename="trained_bot.zip")
+
+def prepare_chat(model_id: str, message: str, session_id: str = ""):
+    """Resolve the bot and build generation kwargs from its session plus `message`.
+
+    Returns (session, user_turn, kwargs); the turn is only recorded, with the reply,
+    by finish_chat() once generation succeeds. Blocking (tokenizes); run it in an executor."""
+    route = resolve_chat_route(model_id)
+    if route is None:
+        raise HTTPException(status_code=404, detail=f"Model {model_id} is not trained or does not exist")
+    try:
+        session = chat_sessions.get(session_id, model_id) if session_id else chat_sessions.create(model_id)
+    except SessionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    custom = route["customization"]
+    max_new_tokens = custom.get("max_tokens", 256)
+    system_prompt = custom.get("system_prompt") or None
+    user_turn = chat_sessions.turn("user", message)
+    budget = custom.get("context_window", 4096) - max_new_tokens
+    if system_prompt:
+        budget -= chat_engine.count_tokens(system_prompt)
+    messages, message_ids = chat_sessions.window(session, max(budget, 1), system_prompt, pending=user_turn)
+    kwargs = {
+        "messages": messages,
+        "message_ids": message_ids,
+        "adapter_id": route["adapter_id"],
+        "adapter_path": route["adapter_path"],
+        "base_model": route["base_model"],
+        "max_new_tokens": max_new_tokens,
+        "temperature": custom.get("temperature", 0.7),
+    }
+    return session, user_turn, kwargs
+
+def finish_chat(session, user_turn: dict, reply: str):
+    """Record a completed exchange in its session. Blocking (tokenizes the reply)."""
+    chat_sessions.append(session, user_turn, chat_sessions.turn("assistant", reply))
 
 @app.post("/chat")
 async def chat(request: ChatRequest):
@@ -583,25 +941,137 @@ async def chat(request: ChatRequest):
         raise HTTPException(status_code=400, detail="model_id and message are required")
     
     print(f"Chat request: model_id={model_id}, message={message[:50]}..., voice_id={voice_id}")
-    response_text = f"Response from {model_id} to: {message}"
     audio_url = None
-    if model_id == "elevenlabs-tts":
+    if model_id != "elevenlabs-tts":
+        loop = asyncio.get_running_loop()
+        session, user_turn, kwargs = await loop.run_in_executor(
+            None, prepare_chat, model_id, message, request.session_id)
         try:
-            audio_path = generate_tts(message, voice_id, language)
-            audio_url = f"/uploads/{os.path.basename(audio_path)}"
-            print(f"Chat audio generated: {audio_url}")
-        except Exception as e:
-            print(f"Chat TTS error: {e}")
-    
+            response_text = await loop.run_in_executor(None, lambda: chat_engine.generate(**kwargs))
+        except BaseModelMismatchError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except AdapterNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except RequestTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except QueueFullError as e:
+            raise HTTPException(status_code=503, detail=f"Server busy, try again later. ({e})")
+        await loop.run_in_executor(None, finish_chat, session, user_turn, response_text)
+        return {"response": response_text, "audio_url": audio_url, "session_id": session.id}
+
+    # elevenlabs-tts: speak the message back
+    response_text = f"Response from {model_id} to: {message}"
+    try:
+        audio_path = await generate_tts(message, voice_id, language)
+        audio_url = f"/{audio_path}"
+        print(f"Chat audio generated: {audio_url}")
+    except Exception as e:
+        print(f"Chat TTS error: {e}")
+
     return {"response": response_text, "audio_url": audio_url}
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Server-sent events: `token` events as text is generated, then `done` with latency stats."""
+    if not request.model_id or not request.message:
+        raise HTTPException(status_code=400, detail="model_id and message are required")
+    loop = asyncio.get_running_loop()
+    session, user_turn, kwargs = await loop.run_in_executor(
+        None, prepare_chat, request.model_id, request.message, request.session_id)
+    try:
+        stream = chat_engine.stream(**kwargs)
+    except BaseModelMismatchError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=f"Server busy, try again later. ({e})")
+
+    async def events():
+        parts = []
+        try:
+            while True:
+                kind, value = await stream.events.get_async()
+                if kind == "token":
+                    parts.append(value)
+                elif kind == "done":
+                    value = {**value, "session_id": session.id}
+                    await loop.run_in_executor(None, finish_chat, session, user_turn, "".join(parts))
+                elif kind == "error":
+                    value = f"{type(value).__name__}: {value}"
+                yield f"event: {kind}\ndata: {json.dumps(value)}\n\n"
+                if kind in ("done", "error"):
+                    break
+        finally:
+            # Client disconnects cancel this generator; stop generating for it
+            stream.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/ws/chat")
+async def chat_ws(websocket: WebSocket):
+    """Send {"model_id", "message", "session_id"?}; receive {"type": "token"} frames then {"type": "done"}.
+
+    Send {"type": "cancel"} (or disconnect) to stop generation."""
+    await websocket.accept()
+    print("WebSocket /ws/chat connected")
+    data = await websocket.receive_json()
+    loop = asyncio.get_running_loop()
+    try:
+        session, user_turn, kwargs = await loop.run_in_executor(
+            None, prepare_chat, data.get("model_id", ""), data.get("message", ""), data.get("session_id", ""))
+        stream = chat_engine.stream(**kwargs)
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "error": e.detail})
+        await websocket.close()
+        return
+    except (BaseModelMismatchError, QueueFullError) as e:
+        await websocket.send_json({"type": "error", "error": str(e)})
+        await websocket.close()
+        return
+
+    async def watch_cancel():
+        try:
+            while True:
+                msg = await websocket.receive_json()
+                if msg.get("type") == "cancel":
+                    break
+        except Exception:
+            pass  # disconnected
+        stream.cancel()
+
+    watcher = asyncio.create_task(watch_cancel())
+    parts = []
+    try:
+        while True:
+            kind, value = await stream.events.get_async()
+            if kind == "token":
+                parts.append(value)
+                await websocket.send_json({"type": "token", "text": value})
+            elif kind == "done":
+                await loop.run_in_executor(None, finish_chat, session, user_turn, "".join(parts))
+                await websocket.send_json({"type": "done", "session_id": session.id, **value})
+                break
+            else:
+                await websocket.send_json({"type": "error", "error": f"{type(value).__name__}: {value}"})
+                break
+    except Exception as e:
+        print(f"WebSocket /ws/chat error: {e}")
+    finally:
+        stream.cancel()
+        watcher.cancel()
+        await websocket.close()
+    print("WebSocket /ws/chat closed")
+
 @app.post("/upload-voice")
 async def upload_voice(file: UploadFile = File(...)):
-    file_id = str(uuid.uuid4())
-    file_path = os.path.join(VOICE_DIR, f"{file_id}_{file.filename}").replace("\\", "/")
-    with open(file_path, "wb") as buffer:
-        buffer.write(await file.read())
-    voice_id = f"cloned_{file_id}"
+    try:
+        saved = await save_upload(file, VOICE_DIR, BLOB_DIR, MAX_UPLOAD_BYTES)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    file_path = saved["path"]
+    file_catalog.add("voice", file_path, file_id=saved["file_id"], filename=saved["filename"],
+                     size=saved["size"], sha256=saved["sha256"])
+    voice_id = f"cloned_{saved['file_id']}"
     print(f"Voice uploaded: {file_path} (simulated cloning)")
     return {"voice_id": voice_id, "message": "Voice uploaded (simulated cloning)"}
 
@@ -610,6 +1080,7 @@ async def music_gen(prompt: str = Form(...)):
     audio_path = os.path.join(UPLOAD_DIR, f"music_{uuid.uuid4()}.mp3").replace("\\", "/")
     with open(audio_path, "wb") as f:
         f.write(b"Simulated music content")
+    file_catalog.add("music", audio_path, ttl=EXPORT_TTL)
     print(f"Simulated music generated: {audio_path}")
     return {"audio_url": f"/uploads/{os.path.basename(audio_path)}"}
 
@@ -625,52 +1096,83 @@ async def image_gen_ws(websocket: WebSocket):
         await websocket.close()
         return
 
-    progress_queue = Queue()
-    num_steps = 50
+    try:
+        num_steps = int(data.get("num_steps", 50))
+        width = int(data.get("width", 512))
+        height = int(data.get("height", 512))
+        seed = int(data["seed"]) if data.get("seed") is not None else None
+    except (TypeError, ValueError) as e:
+        await websocket.send_text(f"Error: {e}")
+        await websocket.close()
+        return
 
-    def generation_callback(step: int, timestep, latents):
-        progress = int((step / num_steps) * 100)
-        print(f"Image generation step {step}/{num_steps}, progress: {progress}%")
-        progress_queue.put(progress)
+    binary = wants_binary(data)
+    loop = asyncio.get_running_loop()
+    # Only seeded requests are reproducible; an unseeded one should get a fresh image each time
+    key = None
+    if seed is not None:
+        key = cache_key(model=IMAGE_MODEL_ID, prompt=prompt, steps=num_steps, seed=seed,
+                        size=[width, height], scheduler=IMAGE_SCHEDULER)
+    png = await loop.run_in_executor(None, image_cache.get, key) if key is not None else None
+    if png is not None:
+        print(f"Image cache hit: {key}")
+        await websocket.send_text("Progress: cached")
+        await send_bytes_payload(websocket, binary, "Image", "image", "image/png", png, {"cached": True})
+        await websocket.close()
+        return
 
-    def generate_image():
-        try:
-            loaded_model = load_model()  # Load the model
-            if loaded_model is None:
-                raise ValueError("Failed to load the model")
-            print("Starting image generation")
-            image = loaded_model(
-                prompt,
-                num_inference_steps=num_steps,
-                callback=generation_callback,
-                callback_steps=1
-            ).images[0]
-            # Send the image as base64 to the frontend
-            buffered = BytesIO()
-            image.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            progress_queue.put(("done", img_str))
-        except Exception as e:
-            progress_queue.put(("error", str(e)))
-
-    thread = threading.Thread(target=generate_image)
-    thread.start()
-    print("Image generation thread started")
-
-    while True:
-        item = await asyncio.get_running_loop().run_in_executor(None, progress_queue.get)
-        print(f"Sending to frontend: {item}")
-        if isinstance(item, tuple) and item[0] == "done":
-            await websocket.send_text(f"Image: {item[1]}")
-            break
-        elif isinstance(item, tuple) and item[0] == "error":
-            await websocket.send_text(f"Error: {item[1]}")
-            break
-        else:
-            await websocket.send_text(f"Progress: {item}")
+    scheduler = get_image_scheduler()
+    try:
+        job = scheduler.submit(prompt, num_steps, width, height, seed)
+    except QueueFullError as e:
+        await websocket.send_text(f"Error: Server busy, try again later. ({e})")
+        await websocket.close()
+        return
 
-    thread.join()
-    await websocket.close()
+    async def watch_disconnect():
+        try:
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+        except Exception:
+            pass
+
+    def store_image(image):
+        buffered = BytesIO()
+        image.save(buffered, format="PNG")
+        png = buffered.getvalue()
+        if key is not None:
+            image_cache.put(key, png)
+        return png
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        while True:
+            next_event = asyncio.ensure_future(job.events.get_async())
+            await asyncio.wait({next_event, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_event.done():
+                # Socket closed: drop the job from the queue instead of rendering it for nobody
+                next_event.cancel()
+                print(f"WebSocket /ws/image-gen disconnected, cancelled job {job.id}")
+                break
+            kind, value = next_event.result()
+            if kind == "done":
+                # Send the image as base64 to the frontend
+                png = await loop.run_in_executor(None, store_image, value)
+                await send_bytes_payload(websocket, binary, "Image", "image", "image/png", png)
+                break
+            elif kind == "error":
+                await websocket.send_text(f"Error: {value}")
+                break
+            elif kind == "queue":
+                await websocket.send_text(f"Queue: {value}")
+            else:
+                await websocket.send_text(f"Progress: {value}")
+    except Exception as e:
+        print(f"WebSocket /ws/image-gen error: {e}")
+    finally:
+        scheduler.cancel(job)
+        watcher.cancel()
+        await websocket.close()
     print("WebSocket /ws/image-gen closed")
 
 @app.websocket("/ws/audio-gen")
@@ -693,12 +1195,22 @@ async def audio_gen_ws(websocket: WebSocket):
 
     try:
         await websocket.send_text("Generating audio...")
-        audio_path = generate_tts(text, voice_id, language)
+        if wants_binary(data):
+            # Forward audio as it is synthesized so playback can start right away
+            sent = {"bytes": 0}
+
+            async def forward(chunk):
+                if not sent["bytes"]:
+                    await send_stream_start(websocket, "audio", "audio/mpeg")
+                sent["bytes"] += len(chunk)
+                await websocket.send_bytes(chunk)
+
+            audio_path = await generate_tts(text, voice_id, language, on_chunk=forward)
+            await send_stream_end(websocket, "audio", sent["bytes"], {"audio_url": f"/{audio_path}"})
+        else:
+            audio_path = await generate_tts(text, voice_id, language)
+            await send_file_payload(websocket, False, "Audio", "audio", "audio/mpeg", audio_path)
         print(f"Audio generated at {audio_path}")
-        with open(audio_path, "rb") as f:
-            audio_data = f.read()
-        audio_base64 = base64.b64encode(audio_data).decode()
-        await websocket.send_text(f"Audio: {audio_base64}")
     except Exception as e:
         print(f"WebSocket error: {e}")
         await websocket.send_text(f"Error: {e}")
@@ -720,7 +1232,7 @@ async def code_exec_ws(websocket: WebSocket):
 
     try:
         await websocket.send_text("Executing code...")
-        result = execute_code(code)
+        result = await run_tool("code_exec", execute_code, code)
         await websocket.send_text(f"Result: {result}")
     except Exception as e:
         await websocket.send_text(f"Error: {str(e)}")
@@ -744,7 +1256,7 @@ async def automl_ws(websocket: WebSocket):
 
     try:
         await websocket.send_text("Running AutoML...")
-        result = run_automl(dataset_path, task, target_column)
+        result = await train_automl(dataset_path, task, target_column)
         await websocket.send_text(f"Result: {json.dumps(result)}")
     except Exception as e:
         await websocket.send_text(f"Error: {str(e)}")
@@ -770,10 +1282,17 @@ async def chart_gen_ws(websocket: WebSocket):
 
     try:
         await websocket.send_text("Generating chart...")
-        result = generate_chart(data_path, chart_type, x_column, y_column, title)
+        binary = wants_binary(data)
+        result = await run_tool("chart", generate_chart, data_path, chart_type, x_column, y_column, title,
+                                encode=not binary)
         if isinstance(result, tuple):
             chart_path, chart_data = result
-            await websocket.send_text(f"Chart: {chart_data}")
+            file_catalog.add("chart", chart_path, ttl=EXPORT_TTL)
+            if binary:
+                await send_file_payload(websocket, True, "Chart", "chart", "image/png", chart_path,
+                                        {"chart_path": chart_path})
+            else:
+                await websocket.send_text(f"Chart: {chart_data}")
         else:
             await websocket.send_text(f"Error: {result}")
     except Exception as e:
@@ -796,7 +1315,7 @@ async def db_query_ws(websocket: WebSocket):
 
     try:
         await websocket.send_text("Executing query...")
-        result = execute_query(query)
+        result = await run_tool("db_query", execute_query, query, cpu=False)
         await websocket.send_text(f"Result: {json.dumps(result)}")
     except Exception as e:
         await websocket.send_text(f"Error: {str(e)}")
@@ -821,12 +1340,16 @@ async def three_d_gen_ws(websocket: WebSocket):
     try:
         await websocket.send_text("Generating 3D model...")
         progress_queue = Queue()
+        binary = wants_binary(data)
         
         def generate_3d():
             try:
                 result = generate_3d_model(prompt, art_style)
                 if isinstance(result, tuple):
                     glb_path, texture_path = result
+                    if binary:
+                        progress_queue.put(("done", {"glb_path": glb_path, "texture_path": texture_path}))
+                        return
                     with open(texture_path, "rb") as f:
                         texture_data = base64.b64encode(f.read()).decode()
                     progress_queue.put(("done", {"glb_path": glb_path, "texture_data": texture_data}))
@@ -843,7 +1366,11 @@ async def three_d_gen_ws(websocket: WebSocket):
             item = await asyncio.get_running_loop().run_in_executor(None, progress_queue.get)
             print(f"Sending to frontend: {item}")
             if isinstance(item, tuple) and item[0] == "done":
-                await websocket.send_text(f"Result: {json.dumps(item[1])}")
+                if binary:
+                    await send_file_payload(websocket, True, "Result", "3d", "image/png",
+                                            item[1]["texture_path"], {"glb_path": item[1]["glb_path"]})
+                else:
+                    await websocket.send_text(f"Result: {json.dumps(item[1])}")
                 break
             elif isinstance(item, tuple) and item[0] == "error":
                 await websocket.send_text(f"Error: {item[1]}")
@@ -909,5 +1436,8 @@ async def ar_filter_ws(websocket: WebSocket):
         await websocket.close()
         print("WebSocket /ws/ar-filter closed")
 
+STARTUP_SECONDS = round(time.perf_counter() - _IMPORT_START, 4)
+print(f"App module loaded in {STARTUP_SECONDS}s")
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
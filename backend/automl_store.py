@@ -0,0 +1,235 @@
+# backend/automl_store.py
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from lazy_imports import LazyModule
+
+pd = LazyModule("pandas", "data")
+joblib = LazyModule("joblib", "automl")
+
+DB_PATH = "uploads/forgebot.db"
+JSON_FIELDS = ("input_columns", "categorical_columns", "feature_columns", "metrics")
+
+CREATE_MODELS_TABLE = """
+CREATE TABLE IF NOT EXISTS automl_models (
+    model_id TEXT PRIMARY KEY,
+    task TEXT NOT NULL,
+    target_column TEXT NOT NULL,
+    path TEXT NOT NULL,
+    input_columns TEXT NOT NULL,
+    categorical_columns TEXT NOT NULL,
+    feature_columns TEXT NOT NULL,
+    metrics TEXT,
+    dataset_path TEXT,
+    size INTEGER,
+    created_at REAL NOT NULL
+)
+"""
+
+
+class ModelNotFoundError(Exception):
+    pass
+
+
+class ModelStore:
+    """SQLite registry of trained AutoML models: where the joblib file is, and the
+    input columns and one-hot encoding needed to score new data the same way."""
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(CREATE_MODELS_TABLE)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def add(self, result: dict, dataset_path: str = None) -> dict:
+        """Register a run_automl result."""
+        record = {
+            "model_id": result["model_id"],
+            "task": result["task"],
+            "target_column": result["target_column"],
+            "path": result["model_path"],
+            "input_columns": result["input_columns"],
+            "categorical_columns": result["categorical_columns"],
+            "feature_columns": result["feature_columns"],
+            "metrics": result["metrics"],
+            "dataset_path": dataset_path,
+            "size": os.path.getsize(result["model_path"]),
+            "created_at": time.time(),
+        }
+        row = {k: json.dumps(v) if k in JSON_FIELDS else v for k, v in record.items()}
+        with self._connect() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO automl_models ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                tuple(row.values()),
+            )
+        return record
+
+    def get(self, model_id: str):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM automl_models WHERE model_id = ?", (model_id,)).fetchone()
+        if row is None:
+            return None
+        record = dict(row)
+        for k in JSON_FIELDS:
+            record[k] = json.loads(record[k]) if record[k] else None
+        return record
+
+    def list(self, limit: int = 100):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT model_id FROM automl_models ORDER BY created_at DESC LIMIT ?",
+                                (limit,)).fetchall()
+        return [self.get(row["model_id"]) for row in rows]
+
+    def remove(self, model_id: str):
+        record = self.get(model_id)
+        if record is None:
+            return None
+        with self._connect() as conn:
+            conn.execute("DELETE FROM automl_models WHERE model_id = ?", (model_id,))
+        try:
+            os.remove(record["path"])
+        except FileNotFoundError:
+            pass
+        return record
+
+
+class ModelCache:
+    """LRU of loaded models, bounded by count and by joblib file size.
+
+    Models are loaded with mmap_mode="r", so their arrays are mapped from the
+    joblib file rather than read through the pickle stream (scikit-learn trees
+    still copy their node arrays when unpickled; the byte budget counts file size).
+    Concurrent requests for a model that is not resident wait for a single load."""
+
+    def __init__(self, store: ModelStore, max_models: int = 8, max_bytes: int = 2 * 1024 ** 3):
+        self.store = store
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # model_id -> (model, record)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._loading = {}  # model_id -> lock held while that model loads
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "load_seconds": 0.0}
+
+    def get(self, model_id: str):
+        """Return (model, record); raises ModelNotFoundError."""
+        with self._lock:
+            entry = self._entries.get(model_id)
+            if entry is not None:
+                self._entries.move_to_end(model_id)
+                self.stats["hits"] += 1
+                return entry
+            load_lock = self._loading.setdefault(model_id, threading.Lock())
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(model_id)
+                if entry is not None:
+                    self.stats["hits"] += 1
+                    return entry
+                self.stats["misses"] += 1
+            try:
+                entry = self._load(model_id)
+            finally:
+                with self._lock:
+                    self._loading.pop(model_id, None)
+        return entry
+
+    def _load(self, model_id: str):
+        record = self.store.get(model_id)
+        if record is None or not os.path.exists(record["path"]):
+            raise ModelNotFoundError(f"AutoML model {model_id} not found")
+        started = time.perf_counter()
+        try:
+            model = joblib.load(record["path"], mmap_mode="r")
+        except FileNotFoundError:
+            raise ModelNotFoundError(f"AutoML model {model_id} not found")
+        elapsed = time.perf_counter() - started
+        print(f"Loaded AutoML model {model_id} in {elapsed:.3f}s")
+        with self._lock:
+            self.stats["load_seconds"] += elapsed
+            # Rechecked under the lock so a model removed (and invalidated) while it loaded is not cached
+            current = self.store.get(model_id)
+            if current is None:
+                raise ModelNotFoundError(f"AutoML model {model_id} not found")
+            if (current["path"], current["created_at"]) != (record["path"], record["created_at"]):
+                return model, record  # replaced while loading; the next get() loads the new one
+            self._entries[model_id] = (model, record)
+            self._bytes += record["size"]
+            while len(self._entries) > 1 and (len(self._entries) > self.max_models or self._bytes > self.max_bytes):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted["size"]
+                self.stats["evictions"] += 1
+        return model, record
+
+    def invalidate(self, model_id: str):
+        """Drop a cached model; call it after removing the model from the store."""
+        with self._lock:
+            entry = self._entries.pop(model_id, None)
+            if entry is not None:
+                self._bytes -= entry[1]["size"]
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "load_seconds": round(self.stats["load_seconds"], 4),
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else None,
+                "models": list(self._entries),
+                "bytes": self._bytes,
+                "max_models": self.max_models,
+                "max_bytes": self.max_bytes,
+            }
+
+
+def encode_features(df, record: dict):
+    """Encode raw input columns exactly as run_automl did for training.
+
+    Categories unseen in training encode as all zeros (the dropped reference level)."""
+    missing = [c for c in record["input_columns"] if c not in df.columns]
+    if missing:
+        raise ValueError(f"Missing input columns: {', '.join(missing)}")
+    categorical = record["categorical_columns"]
+    X = df[record["input_columns"]].copy()
+    for col in X.columns:
+        if col not in categorical:
+            X[col] = pd.to_numeric(X[col], errors="coerce")
+    X = pd.get_dummies(X, columns=categorical)
+    return X.reindex(columns=record["feature_columns"], fill_value=0)
+
+
+def predict_csv(model, record: dict, in_path: str, out_path: str, chunk_size: int = 50000) -> int:
+    """Score a CSV in chunks of `chunk_size` rows; writes the input rows plus a
+    `predicted_<target>` column to `out_path`. Returns the number of rows scored.
+
+    Memory stays bounded by one chunk, and each chunk is one vectorized predict call."""
+    output_column = f"predicted_{record['target_column']}"
+    # Categorical columns are read as strings, as they were when training saw them as object dtype
+    dtype = {c: str for c in record["categorical_columns"]}
+    partial = out_path + ".part"
+    rows = 0
+    try:
+        with open(partial, "w", newline="") as out:
+            for chunk in pd.read_csv(in_path, chunksize=chunk_size, dtype=dtype):
+                chunk[output_column] = model.predict(encode_features(chunk, record))
+                chunk.to_csv(out, header=rows == 0, index=False)
+                rows += len(chunk)
+    except BaseException:
+        os.remove(partial)
+        raise
+    os.replace(partial, out_path)
+    return rows
@@ -0,0 +1,453 @@
+# backend/chat_engine.py
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import nullcontext
+
+from event_queue import EventQueue
+from model_manager import PipelinePool
+from prefix_cache import shared_prefix_length
+
+
+class AdapterNotFoundError(Exception):
+    pass
+
+
+class BaseModelMismatchError(Exception):
+    pass
+
+
+class RequestTooLargeError(Exception):
+    pass
+
+
+class _Resident:
+    """The resident base model; `model` becomes a PeftModel once an adapter is attached."""
+
+    def __init__(self, model, tokenizer):
+        self.model = model
+        self.tokenizer = tokenizer
+
+
+def load_causal_lm(base_model: str) -> _Resident:
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    print(f"Loading chat base model {base_model}...")
+    tokenizer = AutoTokenizer.from_pretrained(base_model, use_fast=True)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    cuda = torch.cuda.is_available()
+    model = AutoModelForCausalLM.from_pretrained(
+        base_model,
+        torch_dtype=torch.bfloat16 if cuda else torch.float32,
+    )
+    model = model.to("cuda" if cuda else "cpu").eval()
+    print("Chat base model loaded.")
+    return _Resident(model, tokenizer)
+
+
+def build_prompt(tokenizer, messages) -> str:
+    if getattr(tokenizer, "chat_template", None):
+        return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    lines = [f"{m['role']}: {m['content']}" for m in messages]
+    return "\n".join(lines) + "\nassistant:"
+
+
+def build_system_prefix(tokenizer, messages):
+    """Rendered system prompt alone: the part of build_prompt() shared by every turn of a bot."""
+    if not messages or messages[0]["role"] != "system":
+        return None
+    if getattr(tokenizer, "chat_template", None):
+        return tokenizer.apply_chat_template(messages[:1], tokenize=False, add_generation_prompt=False)
+    return f"system: {messages[0]['content']}"
+
+
+_PROBE_SYSTEM = {"role": "system", "content": "You are a helpful assistant."}
+_PROBE_USER = {"role": "user", "content": "Hello! How are you today?"}
+_PROBE_ASSISTANT = {"role": "assistant", "content": "I'm fine, thanks. How can I help?"}
+# Conversation each role's piece is rendered after, so the piece is the text the message adds
+_PIECE_CONTEXT = {"system": [], "user": [_PROBE_USER, _PROBE_ASSISTANT], "assistant": [_PROBE_USER]}
+_PROBES = [
+    [_PROBE_SYSTEM, _PROBE_USER],
+    [_PROBE_SYSTEM, _PROBE_USER, _PROBE_ASSISTANT, {"role": "user", "content": "Tell me a joke about cats."}],
+    [_PROBE_USER, _PROBE_ASSISTANT, {"role": "user", "content": "And one about dogs?"}],
+]
+
+
+class PromptEncoder:
+    """Prompt token ids joined from per-message pieces instead of tokenizing the whole prompt.
+
+    A message's piece is the text the chat template adds for it, tokenized on its
+    own; sessions keep each message's ids, so a turn only tokenizes its new message
+    (and the system note when it changes). On creation the encoder checks on probe
+    conversations that joined pieces equal tokenizing build_prompt(); templates that
+    do not split per message (e.g. one folding the system prompt into the first user
+    turn) or tokenizers that change tokens at piece boundaries set `exact` to False,
+    and prompt_ids() then tokenizes the rendered prompt as before."""
+
+    def __init__(self, tokenizer, system_cache_size: int = 64):
+        self.tokenizer = tokenizer
+        self.templated = bool(getattr(tokenizer, "chat_template", None))
+        self.specials = tokenizer("").input_ids  # what tokenizer(prompt) adds, e.g. BOS
+        self.system_cache_size = system_cache_size
+        self._systems = OrderedDict()  # system content -> ids; it changes only with the summary
+        self._lock = threading.Lock()
+        self.exact = False
+        try:
+            self.head_ids = self._ids(self._head())
+            self.generation_ids = self._ids(self._generation_piece())
+            self.exact = all(self._joined_ids(probe) == self._full_ids(probe) for probe in _PROBES)
+        except ValueError:
+            pass
+        if not self.exact:
+            print("Chat template does not split per message; tokenizing whole prompts")
+
+    def _ids(self, text: str) -> list:
+        return self.tokenizer(text, add_special_tokens=False).input_ids
+
+    def _full_ids(self, messages) -> list:
+        return self.tokenizer(build_prompt(self.tokenizer, messages)).input_ids
+
+    def _render(self, messages, generation: bool = False) -> str:
+        return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=generation)
+
+    def _after(self, context, messages, generation: bool = False) -> str:
+        before = self._render(context) if context else ""
+        after = self._render(context + messages, generation)
+        if not after.startswith(before):
+            raise ValueError("chat template output is not prefix-stable")
+        return after[len(before):]
+
+    def _piece(self, message) -> str:
+        if not self.templated:
+            # build_prompt(): "role: content" lines joined by newlines, then "\nassistant:"
+            return f"{message['role']}: {message['content']}\n"
+        return self._after(_PIECE_CONTEXT[message["role"]], [message])
+
+    def _head(self) -> str:
+        """Text the template puts before a first message that is not a system prompt (e.g. BOS)."""
+        if not self.templated:
+            return ""
+        first = self._render([_PROBE_USER])
+        piece = self._piece(_PROBE_USER)
+        if not first.endswith(piece):
+            raise ValueError("chat template renders a first user turn differently")
+        return first[:len(first) - len(piece)]
+
+    def _generation_piece(self) -> str:
+        if not self.templated:
+            return "assistant:"
+        return self._after([_PROBE_USER, _PROBE_ASSISTANT, _PROBE_USER], [], generation=True)
+
+    def message_ids(self, message) -> list:
+        if message["role"] != "system":
+            return self._ids(self._piece(message))
+        content = message["content"]
+        with self._lock:
+            ids = self._systems.get(content)
+            if ids is not None:
+                self._systems.move_to_end(content)
+                return ids
+        ids = self._ids(self._piece(message))
+        with self._lock:
+            self._systems[content] = ids
+            while len(self._systems) > self.system_cache_size:
+                self._systems.popitem(last=False)
+        return ids
+
+    def prompt_ids(self, messages, message_ids=None) -> list:
+        """Token ids of build_prompt(messages); `message_ids[i]` (if not None) are message i's ids."""
+        if not self.exact:
+            return self._full_ids(messages)
+        return self._joined_ids(messages, message_ids)
+
+    def _joined_ids(self, messages, message_ids=None) -> list:
+        ids = list(self.specials)
+        if not messages or messages[0]["role"] != "system":
+            ids.extend(self.head_ids)
+        for i, message in enumerate(messages):
+            known = message_ids[i] if message_ids is not None else None
+            ids.extend(known if known is not None else self.message_ids(message))
+        ids.extend(self.generation_ids)
+        return ids
+
+    def system_prefix_length(self, messages, prompt_ids) -> int:
+        """Leading tokens of `prompt_ids` that only depend on the system prompt (0 without one)."""
+        if not messages or messages[0]["role"] != "system":
+            return 0
+        if self.exact:
+            return len(self.specials) + len(self.message_ids(messages[0]))
+        system = self.tokenizer(build_system_prefix(self.tokenizer, messages)).input_ids
+        return shared_prefix_length(system, prompt_ids)
+
+
+class ChatStream:
+    """Handle for one streamed generation.
+
+    `events` receives ("token", text) as text is decoded, then ("done", stats) or
+    ("error", exception). `cancel()` stops generation at the next decoding step."""
+
+    def __init__(self):
+        self.id = str(uuid.uuid4())
+        self.cancelled = False
+        self.events = EventQueue()
+        self.submitted_at = time.perf_counter()
+        self.token_times = []  # perf_counter() of every generated token
+
+    def cancel(self):
+        self.cancelled = True
+
+    def stats(self) -> dict:
+        times = self.token_times
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        return {
+            "tokens": len(times),
+            "cancelled": self.cancelled,
+            "ttft_seconds": round(times[0] - self.submitted_at, 4) if times else None,
+            "inter_token_seconds": round(sum(gaps) / len(gaps), 4) if gaps else None,
+            "max_inter_token_seconds": round(max(gaps), 4) if gaps else None,
+            "total_seconds": round(time.perf_counter() - self.submitted_at, 4),
+        }
+
+
+def _stream_hooks(stream: ChatStream, tokenizer):
+    """transformers streamer + stopping criteria feeding `stream`."""
+    import torch
+    from transformers import StoppingCriteria, TextStreamer
+
+    class _Streamer(TextStreamer):
+        def put(self, value):
+            if not self.next_tokens_are_prompt:
+                now = time.perf_counter()
+                stream.token_times.extend([now] * value.numel())
+            super().put(value)
+
+        def on_finalized_text(self, text, stream_end=False):
+            if text:
+                stream.events.put(("token", text))
+
+    class _Cancelled(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.full((input_ids.shape[0],), stream.cancelled, dtype=torch.bool, device=input_ids.device)
+
+    return _Streamer(tokenizer, skip_prompt=True, skip_special_tokens=True), _Cancelled()
+
+
+class ChatEngine:
+    """One resident base model serving many LoRA adapters.
+
+    Adapters are attached to the base with peft on first use and kept in an LRU of
+    `max_adapters`; the least recently used one is deleted when the cache is full.
+    Each request activates its adapter (or disables adapters for the plain base
+    model) while it holds the model, so the base weights are loaded once for
+    every fine-tuned bot."""
+
+    def __init__(self, base_model: str, loader=load_causal_lm, max_adapters: int = 8):
+        self.base_model = base_model
+        self.max_adapters = max(1, max_adapters)
+        self.pool = PipelinePool(lambda: loader(base_model))
+        self.scheduler = None  # ContinuousBatchScheduler once enable_batching() is called
+        self.prefix_cache = None  # PrefixCache once enable_prefix_cache() is called
+        self.cache_full_prompts = False
+        self._encoder = None  # PromptEncoder for the base model's tokenizer
+        self._adapters = OrderedDict()  # adapter_id -> peft adapter name
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "adapter_hits": 0, "adapter_loads": 0, "adapter_evictions": 0,
+                       "adapter_load_seconds": 0.0, "streams": 0, "streams_cancelled": 0, "streamed_tokens": 0}
+        self._latency = {"ttft_sum": 0.0, "ttft_count": 0, "gap_sum": 0.0, "gap_count": 0}
+
+    def load(self):
+        return self.pool.load()
+
+    def enable_batching(self, **kwargs):
+        """Route generate()/stream() through a continuous batching scheduler."""
+        from chat_scheduler import ContinuousBatchScheduler
+        self.scheduler = ContinuousBatchScheduler(self, **kwargs).start()
+        return self.scheduler
+
+    def enable_prefix_cache(self, max_bytes: int, min_tokens: int = 16, cache_full_prompts: bool = False):
+        """Reuse the KV state of system prompts (and, optionally, whole prompts) across requests.
+
+        Used by the batching scheduler's prefill; `cache_full_prompts` also keeps each
+        prompt so the next turn of a conversation only prefills what is new."""
+        from prefix_cache import PrefixCache
+        self.prefix_cache = PrefixCache(max_bytes, min_tokens)
+        self.cache_full_prompts = cache_full_prompts
+        return self.prefix_cache
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.pool.load().tokenizer(text, add_special_tokens=False).input_ids)
+
+    def encoder(self) -> PromptEncoder:
+        if self._encoder is None:
+            tokenizer = self.pool.load().tokenizer
+            with self._lock:
+                if self._encoder is None:
+                    self._encoder = PromptEncoder(tokenizer)
+        return self._encoder
+
+    def encode_message(self, role: str, content: str) -> list:
+        """Token ids one message adds to a prompt, for sessions to keep with the message."""
+        return self.encoder().message_ids({"role": role, "content": content})
+
+    def has_adapters(self) -> bool:
+        with self._lock:
+            return bool(self._adapters)
+
+    @staticmethod
+    def _adapter_name(adapter_id: str) -> str:
+        # peft adapter names become module attribute keys
+        return "a_" + re.sub(r"\W", "_", adapter_id)
+
+    def activate_adapter(self, resident: _Resident, adapter_id: str, adapter_path: str):
+        """Make `adapter_id` the active adapter, loading (and evicting) as needed.
+
+        Called with the model checked out, so no request is generating meanwhile."""
+        with self._lock:
+            name = self._adapters.get(adapter_id)
+            if name is not None:
+                self._adapters.move_to_end(adapter_id)
+                self._stats["adapter_hits"] += 1
+        if name is None:
+            from peft import PeftModel
+
+            start = time.perf_counter()
+            name = self._adapter_name(adapter_id)
+            try:
+                if isinstance(resident.model, PeftModel):
+                    resident.model.load_adapter(adapter_path, adapter_name=name)
+                else:
+                    resident.model = PeftModel.from_pretrained(resident.model, adapter_path, adapter_name=name)
+            except (OSError, ValueError) as e:
+                raise AdapterNotFoundError(f"Cannot load adapter {adapter_id}: {e}") from e
+            resident.model.eval()
+            elapsed = time.perf_counter() - start
+            print(f"Loaded LoRA adapter {adapter_id} in {elapsed:.2f}s")
+            with self._lock:
+                self._adapters[adapter_id] = name
+                self._stats["adapter_loads"] += 1
+                self._stats["adapter_load_seconds"] += elapsed
+                evicted = []
+                while len(self._adapters) > self.max_adapters:
+                    evicted.append(self._adapters.popitem(last=False))
+                    self._stats["adapter_evictions"] += 1
+            for evicted_id, evicted_name in evicted:
+                resident.model.delete_adapter(evicted_name)
+                print(f"Evicted LoRA adapter {evicted_id}")
+        resident.model.set_adapter(name)
+
+    def _adapter_context(self, resident: _Resident, adapter_id: str, adapter_path: str):
+        if adapter_id is not None:
+            self.activate_adapter(resident, adapter_id, adapter_path)
+            return nullcontext()
+        if self.has_adapters():
+            return resident.model.disable_adapter()  # plain base model
+        return nullcontext()
+
+    def _run(self, messages, adapter_id, adapter_path, base_model, max_new_tokens, temperature, stream=None,
+             message_ids=None):
+        import torch
+        from transformers import StoppingCriteriaList
+
+        if base_model is not None and base_model != self.base_model:
+            raise BaseModelMismatchError(f"Served base model is {self.base_model}, not {base_model}")
+        with self._lock:
+            self._stats["requests"] += 1
+        with self.pool.acquire() as resident:
+            if stream is not None and stream.cancelled:
+                return ""  # client left while waiting for the model
+            tokenizer = resident.tokenizer
+            input_ids = torch.tensor([self.encoder().prompt_ids(messages, message_ids)], device=resident.model.device)
+            hooks = {}
+            if stream is not None:
+                streamer, cancelled = _stream_hooks(stream, tokenizer)
+                hooks = {"streamer": streamer, "stopping_criteria": StoppingCriteriaList([cancelled])}
+            with self._adapter_context(resident, adapter_id, adapter_path), torch.no_grad():
+                output = resident.model.generate(
+                    input_ids=input_ids,
+                    attention_mask=torch.ones_like(input_ids),
+                    max_new_tokens=max_new_tokens,
+                    do_sample=temperature > 0,
+                    temperature=temperature if temperature > 0 else None,
+                    pad_token_id=tokenizer.pad_token_id,
+                    **hooks,
+                )
+        return tokenizer.decode(output[0, input_ids.shape[1]:], skip_special_tokens=True)
+
+    def generate(self, messages, adapter_id: str = None, adapter_path: str = None, base_model: str = None,
+                 max_new_tokens: int = 256, temperature: float = 0.7, message_ids=None) -> str:
+        """Blocking generation; run it in an executor from async handlers.
+
+        `message_ids` optionally holds each message's token ids (from encode_message(),
+        None where unknown), so the prompt is not tokenized again."""
+        if self.scheduler is not None:
+            stream = self.scheduler.submit(messages, adapter_id, adapter_path, base_model, max_new_tokens, temperature,
+                                           message_ids)
+            parts = []
+            while True:
+                kind, value = stream.events.get()
+                if kind == "token":
+                    parts.append(value)
+                elif kind == "error":
+                    raise value
+                else:
+                    return "".join(parts)
+        return self._run(messages, adapter_id, adapter_path, base_model, max_new_tokens, temperature,
+                         message_ids=message_ids)
+
+    def stream(self, messages, adapter_id: str = None, adapter_path: str = None, base_model: str = None,
+               max_new_tokens: int = 256, temperature: float = 0.7, message_ids=None) -> ChatStream:
+        """Start generation on a background thread and return its ChatStream."""
+        if self.scheduler is not None:
+            return self.scheduler.submit(messages, adapter_id, adapter_path, base_model, max_new_tokens, temperature,
+                                         message_ids)
+        stream = ChatStream()
+
+        def run():
+            try:
+                self._run(messages, adapter_id, adapter_path, base_model, max_new_tokens, temperature, stream,
+                          message_ids)
+            except Exception as e:
+                stream.events.put(("error", e))
+                return
+            stats = stream.stats()
+            self.record_stream(stats)
+            stream.events.put(("done", stats))
+
+        threading.Thread(target=run, name=f"chat-{stream.id[:8]}", daemon=True).start()
+        return stream
+
+    def record_stream(self, stats: dict):
+        with self._lock:
+            self._stats["streams"] += 1
+            self._stats["streams_cancelled"] += int(stats["cancelled"])
+            self._stats["streamed_tokens"] += stats["tokens"]
+            lat = self._latency
+            if stats["ttft_seconds"] is not None:
+                lat["ttft_sum"] += stats["ttft_seconds"]
+                lat["ttft_count"] += 1
+            if stats["inter_token_seconds"] is not None:
+                lat["gap_sum"] += stats["inter_token_seconds"] * (stats["tokens"] - 1)
+                lat["gap_count"] += stats["tokens"] - 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["resident_adapters"] = list(self._adapters)
+            lat = dict(self._latency)
+        stats["mean_ttft_seconds"] = round(lat["ttft_sum"] / lat["ttft_count"], 4) if lat["ttft_count"] else None
+        stats["mean_inter_token_seconds"] = round(lat["gap_sum"] / lat["gap_count"], 4) if lat["gap_count"] else None
+        stats["adapter_load_seconds"] = round(stats["adapter_load_seconds"], 3)
+        stats.update({
+            "base_model": self.base_model,
+            "max_adapters": self.max_adapters,
+            "pool": self.pool.metrics(),
+        })
+        if self.scheduler is not None:
+            stats["scheduler"] = self.scheduler.metrics()
+        if self.prefix_cache is not None:
+            stats["prefix_cache"] = self.prefix_cache.metrics()
+        return stats
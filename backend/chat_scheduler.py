@@ -0,0 +1,584 @@
+# backend/chat_scheduler.py
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+from chat_engine import ChatStream, BaseModelMismatchError, RequestTooLargeError
+from image_engine import QueueFullError
+
+
+def _cache_layers(past):
+    """[(keys, values)] per layer of a model's returned cache, whatever its transformers version."""
+    if hasattr(past, "layers"):  # Cache made of layer objects (transformers >= 4.56)
+        return [(layer.keys, layer.values) for layer in past.layers]
+    if hasattr(past, "key_cache"):  # older DynamicCache
+        return list(zip(past.key_cache, past.value_cache))
+    return [(layer[0], layer[1]) for layer in past]  # legacy tuple
+
+
+def _uses_cache_class(model) -> bool:
+    # transformers 5 dropped the flag: every model takes Cache objects there
+    return getattr(model, "_supports_cache_class", True)
+
+
+def _dynamic_cache(layers):
+    """DynamicCache holding `layers` ([(keys, values)]), through the update() every version has."""
+    from transformers import DynamicCache
+
+    cache = DynamicCache()
+    for layer, (k, v) in enumerate(layers):
+        cache.update(k, v, layer)
+    return cache
+
+
+def kv_bytes_per_token(model) -> int:
+    """Keys + values for one token across all layers, from the model config."""
+    config = model.config
+    layers = getattr(config, "num_hidden_layers", None) or config.n_layer
+    heads = getattr(config, "num_attention_heads", None) or config.n_head
+    kv_heads = getattr(config, "num_key_value_heads", None) or heads
+    hidden = getattr(config, "hidden_size", None) or config.n_embd
+    head_dim = getattr(config, "head_dim", None) or hidden // heads
+    element_size = next(model.parameters()).element_size()
+    return 2 * layers * kv_heads * head_dim * element_size
+
+
+_BufferCache = None
+
+
+def _define_buffer_cache():
+    try:
+        from transformers.cache_utils import Cache, CacheLayerMixin
+    except ImportError:
+        CacheLayerMixin = None
+    if CacheLayerMixin is None:
+        from transformers import DynamicCache
+
+        class _LegacyBufferCache(DynamicCache):
+            def __init__(self, batch):
+                super().__init__()
+                self.batch = batch
+
+            def update(self, key_states, value_states, layer_idx, cache_kwargs=None):
+                return self.batch.write(layer_idx, key_states, value_states)
+
+            def get_seq_length(self, layer_idx=0):
+                return self.batch.head
+
+            def get_max_length(self):
+                return None
+
+            def __len__(self):
+                return len(self.batch.keys)
+
+        return _LegacyBufferCache
+
+    class _BufferLayer(CacheLayerMixin):
+        is_sliding = False
+
+        def __init__(self, batch, layer):
+            super().__init__()
+            self.batch, self.layer = batch, layer
+            self.is_initialized = True
+
+        def lazy_initialization(self, key_states, value_states):
+            pass
+
+        def update(self, key_states, value_states, *args, **kwargs):
+            self.keys, self.values = self.batch.write(self.layer, key_states, value_states)
+            return self.keys, self.values
+
+        def get_seq_length(self):
+            return self.batch.head
+
+        def get_mask_sizes(self, query_length):
+            return self.batch.head + query_length, 0
+
+        def get_max_length(self):
+            return -1
+
+    class _LayeredBufferCache(Cache):
+        def __init__(self, batch):
+            super().__init__(layers=[_BufferLayer(batch, layer) for layer in range(len(batch.keys))])
+
+    return _LayeredBufferCache
+
+
+def _buffer_cache(batch):
+    """transformers Cache view of a _BatchKV: each layer's update() writes the new column in place."""
+    global _BufferCache
+    if _BufferCache is None:
+        _BufferCache = _define_buffer_cache()
+    return _BufferCache(batch)
+
+
+class _BatchKV:
+    """KV buffers of the running batch, kept across decode steps.
+
+    Row r holds one sequence, whose tokens sit in columns [starts[r], head): prompts
+    are left-padded to the write head when they join, and a prompt longer than the
+    head moves the head forward, leaving masked gaps in the other rows. A decode step
+    writes one column for every row, so it never copies the sequences' history.
+    Buffers are reallocated only when a joining sequence needs more rows or columns
+    (sized for every row to reach its token limit), and columns no row uses any more
+    are reclaimed by shifting left when the head reaches the end."""
+
+    def __init__(self):
+        self.keys = None  # per layer: [rows, kv_heads, columns, head_dim]
+        self.values = None
+        self.mask = None  # [rows, columns]; 1 where the row has a token
+        self.seqs = []  # row -> _Sequence
+        self.starts = []  # row -> first column of its sequence
+        self.head = 0
+
+    @property
+    def rows_allocated(self) -> int:
+        return self.mask.shape[0] if self.mask is not None else 0
+
+    @property
+    def columns(self) -> int:
+        return self.mask.shape[1] if self.mask is not None else 0
+
+    def nbytes(self) -> int:
+        if self.keys is None:
+            return 0
+        return sum(k.numel() * k.element_size() + v.numel() * v.element_size()
+                   for k, v in zip(self.keys, self.values))
+
+    def release(self):
+        self.keys = self.values = self.mask = None
+        self.seqs, self.starts, self.head = [], [], 0
+
+    def shape_with(self, prompt_len: int, max_new_tokens: int):
+        """(rows, columns) the buffers need once a sequence with this prompt joins."""
+        head = max(self.head, prompt_len)
+        first = min(self.starts + [head - prompt_len])
+        remaining = max([s.max_new_tokens - len(s.generated) for s in self.seqs] + [max_new_tokens])
+        return max(self.rows_allocated, len(self.seqs) + 1), max(self.columns, head - first + remaining)
+
+    def add(self, seq, past):
+        """Copy a prefilled sequence's cache ([(keys, values)] per layer, batch of one) into a new row."""
+        rows, columns = self.shape_with(seq.length, seq.max_new_tokens)
+        if rows > self.rows_allocated or columns > self.columns:
+            self._reallocate(rows, columns, past)
+        if max(self.head, seq.length) > self.columns:
+            self._compact()
+        head = max(self.head, seq.length)
+        row, start = len(self.seqs), head - seq.length
+        for layer, (k, v) in enumerate(past):
+            self.keys[layer][row, :, start:head] = k[0]
+            self.values[layer][row, :, start:head] = v[0]
+        self.mask[row] = 0
+        self.mask[row, start:head] = 1
+        self.seqs.append(seq)
+        self.starts.append(start)
+        self.head = head
+
+    def remove(self, seq):
+        row, last = self.seqs.index(seq), len(self.seqs) - 1
+        if row != last:
+            # Move the last row into the hole so live rows stay packed at the front
+            start = self.starts[last]
+            for k, v in zip(self.keys, self.values):
+                k[row, :, start:self.head] = k[last, :, start:self.head]
+                v[row, :, start:self.head] = v[last, :, start:self.head]
+            self.mask[row] = self.mask[last]
+            self.seqs[row], self.starts[row] = self.seqs[last], start
+        self.mask[last] = 0
+        self.seqs.pop()
+        self.starts.pop()
+        if not self.seqs:
+            self.head = 0
+
+    def begin_step(self):
+        """Open the column for this step's tokens; returns the step's attention mask."""
+        if self.head >= self.columns:
+            self._compact()
+        if self.head >= self.columns:
+            self._reallocate(self.rows_allocated, self.columns + 64)
+        rows = len(self.seqs)
+        self.mask[:rows, self.head] = 1
+        return self.mask[:rows, :self.head + 1]
+
+    def write(self, layer: int, key, value):
+        """Store this step's key/value for every row; returns the layer's cache including them."""
+        rows, head = len(self.seqs), self.head
+        self.keys[layer][:rows, :, head:head + 1] = key
+        self.values[layer][:rows, :, head:head + 1] = value
+        return self.keys[layer][:rows, :, :head + 1], self.values[layer][:rows, :, :head + 1]
+
+    def views(self):
+        """Legacy past_key_values, for models without Cache support."""
+        rows = len(self.seqs)
+        return tuple((k[:rows, :, :self.head], v[:rows, :, :self.head]) for k, v in zip(self.keys, self.values))
+
+    def end_step(self):
+        self.head += 1
+
+    def _compact(self):
+        first = min(self.starts) if self.seqs else self.head
+        if not first:
+            return
+        rows, width = len(self.seqs), self.head - first
+        for k, v in zip(self.keys, self.values):
+            k[:rows, :, :width] = k[:rows, :, first:self.head].clone()
+            v[:rows, :, :width] = v[:rows, :, first:self.head].clone()
+        self.mask[:rows, :width] = self.mask[:rows, first:self.head].clone()
+        self.mask[:, width:] = 0
+        self.starts = [start - first for start in self.starts]
+        self.head = width
+
+    def _reallocate(self, rows: int, columns: int, like=None):
+        import torch
+
+        first = min(self.starts) if self.seqs else self.head
+        width, live = self.head - first, len(self.seqs)
+        ref_keys = self.keys if self.keys is not None else [k for k, _ in like]
+        ref_values = self.values if self.values is not None else [v for _, v in like]
+
+        def buffer(ref):
+            # Zeroed: masked columns still enter the attention matmul
+            return torch.zeros((rows, ref.shape[1], columns, ref.shape[3]), dtype=ref.dtype, device=ref.device)
+
+        keys, values = [buffer(k) for k in ref_keys], [buffer(v) for v in ref_values]
+        mask = torch.zeros((rows, columns), dtype=torch.long, device=ref_keys[0].device)
+        if live:
+            for new, old in zip(keys + values, self.keys + self.values):
+                new[:live, :, :width] = old[:live, :, first:self.head]
+            mask[:live, :width] = self.mask[:live, first:self.head]
+        self.keys, self.values, self.mask = keys, values, mask
+        self.starts = [start - first for start in self.starts]
+        self.head = width
+
+
+class _Sequence:
+    def __init__(self, stream: ChatStream, messages, adapter_id, adapter_path, max_new_tokens, temperature,
+                 message_ids=None):
+        self.stream = stream
+        self.messages = messages
+        self.message_ids = message_ids  # per-message token ids kept by the session, None where unknown
+        self.adapter_id = adapter_id
+        self.adapter_path = adapter_path
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.length = 0  # tokens in the KV cache (prompt + generated)
+        self.next_token = None
+        self.generated = []
+        self.text = ""
+        self.input_ids = None
+        self.prefix_len = 0  # prompt tokens shared with the bot's system prompt
+        self.finished = False
+
+
+class ContinuousBatchScheduler:
+    """Iteration-level batching for chat generation.
+
+    One worker thread keeps a running batch of up to `max_batch_size` sequences.
+    Before every decode step it admits queued requests (prefilling their prompts),
+    then runs one forward pass for the whole batch and drops sequences that hit EOS,
+    their token limit or were cancelled, so new requests never wait for the longest
+    one in flight. The batch's KV cache lives in persistent buffers (_BatchKV) that
+    each step appends one column to. A request is admitted only if the buffers, sized
+    for every sequence to reach its token limit, stay within `kv_budget_bytes`, so
+    the running batch cannot outgrow memory mid-generation. All sequences in a batch
+    share one LoRA adapter; requests for another adapter wait until the batch drains.
+    Works with any causal LM (a tiny GPT-2 on CPU is enough to benchmark it)."""
+
+    def __init__(self, engine, max_batch_size: int = 8, kv_budget_bytes: int = 2 * 1024 ** 3,
+                 max_queue: int = 64):
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.kv_budget_bytes = kv_budget_bytes
+        self.max_queue = max_queue
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self._batch = None
+        self._kv_allocated = 0
+        self._active = 0
+        self.stats = {"steps": 0, "prefills": 0, "prefill_tokens": 0, "tokens": 0, "rejected": 0, "finished": 0,
+                      "occupancy_sum": 0.0, "busy_seconds": 0.0}
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name="chat-batch-worker", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, messages, adapter_id: str = None, adapter_path: str = None, base_model: str = None,
+               max_new_tokens: int = 256, temperature: float = 0.7, message_ids=None) -> ChatStream:
+        if base_model is not None and base_model != self.engine.base_model:
+            raise BaseModelMismatchError(f"Served base model is {self.engine.base_model}, not {base_model}")
+        stream = ChatStream()
+        seq = _Sequence(stream, messages, adapter_id, adapter_path, max_new_tokens, temperature, message_ids)
+        with self._cond:
+            if len(self._pending) >= self.max_queue:
+                self.stats["rejected"] += 1
+                raise QueueFullError(f"Chat queue is full ({self.max_queue} pending)")
+            self._pending.append(seq)
+            self._cond.notify_all()
+        return stream
+
+    def metrics(self) -> dict:
+        with self._cond:
+            stats = dict(self.stats)
+            occupied = stats.pop("occupancy_sum")
+            stats.update({
+                "queue_depth": len(self._pending),
+                "active_sequences": self._active,
+                "max_batch_size": self.max_batch_size,
+                "batch_occupancy": round(occupied / (stats["steps"] * self.max_batch_size), 4)
+                if stats["steps"] else None,
+                "kv_allocated_bytes": self._kv_allocated,
+                "kv_budget_bytes": self.kv_budget_bytes,
+                "kv_utilization": round(self._kv_allocated / self.kv_budget_bytes, 4),
+                "tokens_per_sec": round(stats["tokens"] / stats["busy_seconds"], 1) if stats["busy_seconds"] else None,
+            })
+        stats["busy_seconds"] = round(stats["busy_seconds"], 3)
+        return stats
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+            # Hold the resident model while there is work; release it when the batch drains
+            with self.engine.pool.acquire() as resident:
+                self._run_batches(resident)
+
+    def _run_batches(self, resident):
+        import torch
+
+        batch = self._batch = _BatchKV()
+        bytes_per_token = kv_bytes_per_token(resident.model)
+        try:
+            with torch.no_grad():
+                while True:
+                    start = time.perf_counter()
+                    self._admit(resident, batch, bytes_per_token)
+                    if not batch.seqs:
+                        return
+                    try:
+                        with self._adapter_scope(resident, batch.seqs[0].adapter_id):
+                            self._decode_step(resident, batch)
+                    except Exception as e:
+                        for seq in list(batch.seqs):
+                            self._finish(seq, error=e)
+                    with self._cond:
+                        self._active = len(batch.seqs)
+                        self._kv_allocated = batch.nbytes()
+                        self.stats["busy_seconds"] += time.perf_counter() - start
+        finally:
+            batch.release()
+            self._batch = None
+            with self._cond:
+                self._active = 0
+                self._kv_allocated = 0
+
+    def _adapter_scope(self, resident, adapter_id):
+        if adapter_id is None and self.engine.has_adapters():
+            return resident.model.disable_adapter()
+        return nullcontext()
+
+    def _admit(self, resident, batch, bytes_per_token):
+        import torch
+
+        if not batch.seqs:
+            batch.release()  # size the buffers for the new batch from scratch
+        while len(batch.seqs) < self.max_batch_size:
+            with self._cond:
+                while self._pending and self._pending[0].stream.cancelled:
+                    cancelled = self._pending.popleft().stream
+                    cancelled.events.put(("done", cancelled.stats()))
+                if not self._pending:
+                    return
+                seq = self._pending[0]
+                if batch.seqs and seq.adapter_id != batch.seqs[0].adapter_id:
+                    return  # wait for this batch to drain before switching adapters
+                if seq.input_ids is None:
+                    # Joined from the session's per-message ids; only messages without ids are tokenized
+                    encoder = self.engine.encoder()
+                    prompt_ids = encoder.prompt_ids(seq.messages, seq.message_ids)
+                    seq.input_ids = torch.tensor([prompt_ids])
+                    if self.engine.prefix_cache is not None:
+                        seq.prefix_len = encoder.system_prefix_length(seq.messages, prompt_ids)
+                prompt_len = seq.input_ids.shape[1]
+                if (prompt_len + seq.max_new_tokens) * bytes_per_token > self.kv_budget_bytes:
+                    self._pending.popleft()
+                    seq.stream.events.put(("error", RequestTooLargeError(
+                        f"Prompt of {prompt_len} tokens plus {seq.max_new_tokens} new tokens "
+                        f"does not fit in the KV cache budget")))
+                    continue
+                rows, columns = batch.shape_with(prompt_len, seq.max_new_tokens)
+                if batch.seqs and rows * columns * bytes_per_token > self.kv_budget_bytes:
+                    return  # admitted once running sequences finish and free rows
+                self._pending.popleft()
+                self._active = len(batch.seqs) + 1
+            try:
+                if not batch.seqs and seq.adapter_id is not None:
+                    self.engine.activate_adapter(resident, seq.adapter_id, seq.adapter_path)
+                with self._adapter_scope(resident, seq.adapter_id):
+                    past = self._prefill(resident, seq)
+                if not seq.finished:
+                    batch.add(seq, past)
+            except Exception as e:
+                self._finish(seq, error=e)
+                continue
+            with self._cond:
+                self._kv_allocated = batch.nbytes()
+
+    def _prefill(self, resident, seq):
+        """Run the prompt through the model; returns its KV cache as [(keys, values)] per layer."""
+        import torch
+
+        model = resident.model
+        input_ids = seq.input_ids.to(model.device)
+        total = input_ids.shape[1]
+        cache = self.engine.prefix_cache
+        token_ids = seq.input_ids[0].tolist()
+        cached, prefix_past = cache.lookup(seq.adapter_id, token_ids) if cache is not None else (0, None)
+        if cached:
+            # Only the tokens after the cached prefix go through the model
+            out = model(
+                input_ids=input_ids[:, cached:],
+                attention_mask=torch.ones((1, total), dtype=torch.long, device=model.device),
+                position_ids=torch.arange(cached, total, device=model.device).unsqueeze(0),
+                past_key_values=_dynamic_cache(prefix_past) if _uses_cache_class(model) else prefix_past,
+                use_cache=True,
+            )
+        else:
+            out = model(input_ids=input_ids, use_cache=True)
+        past = _cache_layers(out.past_key_values)
+        seq.length = total
+        if cache is not None:
+            ends = [seq.prefix_len] + ([total] if self.engine.cache_full_prompts else [])
+            for end in ends:
+                if end > cached:
+                    cache.put(seq.adapter_id, token_ids[:end],
+                              tuple((k[:, :, :end].clone(), v[:, :, :end].clone()) for k, v in past))
+        with self._cond:
+            self.stats["prefills"] += 1
+            self.stats["prefill_tokens"] += total - cached
+        self._accept(resident.tokenizer, seq, out.logits[0, -1])
+        return past
+
+    def _decode_step(self, resident, batch):
+        import torch
+
+        model = resident.model
+        seqs = list(batch.seqs)
+        attention_mask = batch.begin_step()
+        if _uses_cache_class(model):
+            past = _buffer_cache(batch)  # the model writes the new column through update()
+        else:
+            past = batch.views()
+        out = model(
+            input_ids=torch.tensor([[seq.next_token] for seq in seqs], device=model.device),
+            attention_mask=attention_mask,
+            position_ids=torch.tensor([[seq.length] for seq in seqs], device=model.device),
+            past_key_values=past,
+            use_cache=True,
+        )
+        if isinstance(past, tuple):
+            # Legacy models return the concatenated cache; keep only the new column
+            for layer, (k, v) in enumerate(_cache_layers(out.past_key_values)):
+                batch.write(layer, k[:, :, -1:], v[:, :, -1:])
+        batch.end_step()
+        for row, seq in enumerate(seqs):
+            seq.length += 1
+            self._accept(resident.tokenizer, seq, out.logits[row, -1])
+        with self._cond:
+            self.stats["steps"] += 1
+            self.stats["occupancy_sum"] += len(seqs)
+
+    def _accept(self, tokenizer, seq, logits):
+        """Sample the next token from `logits`, stream new text and finish the sequence if done."""
+        import torch
+
+        if seq.temperature > 0:
+            probs = torch.softmax(logits.float() / seq.temperature, dim=-1)
+            token = int(torch.multinomial(probs, 1))
+        else:
+            token = int(logits.argmax())
+        seq.generated.append(token)
+        seq.next_token = token
+        seq.stream.token_times.append(time.perf_counter())
+        with self._cond:
+            self.stats["tokens"] += 1
+
+        text = tokenizer.decode(seq.generated, skip_special_tokens=True)
+        if not text.endswith("\ufffd"):  # wait for the rest of a multi-byte character
+            delta = text[len(seq.text):]
+            seq.text = text
+            if delta:
+                seq.stream.events.put(("token", delta))
+        if (token == tokenizer.eos_token_id or len(seq.generated) >= seq.max_new_tokens
+                or seq.stream.cancelled):
+            self._finish(seq)
+
+    def _finish(self, seq, error: Exception = None):
+        if seq.finished:
+            return
+        seq.finished = True
+        if self._batch is not None and seq in self._batch.seqs:
+            self._batch.remove(seq)
+        with self._cond:
+            self.stats["finished"] += 1
+        if error is not None:
+            seq.stream.events.put(("error", error))
+            return
+        stats = seq.stream.stats()
+        self.engine.record_stream(stats)
+        seq.stream.events.put(("done", stats))
+
+
+if __name__ == "__main__":
+    # CPU benchmark: python chat_scheduler.py --model sshleifer/tiny-gpt2 --requests 32
+    import argparse
+    import json
+
+    from chat_engine import ChatEngine
+
+    p = argparse.ArgumentParser()
+    p.add_argument("--model", default="sshleifer/tiny-gpt2")
+    p.add_argument("--requests", type=int, default=32)
+    p.add_argument("--max-new-tokens", type=int, default=64)
+    p.add_argument("--max-batch", type=int, default=8)
+    p.add_argument("--kv-budget-mb", type=float, default=256)
+    p.add_argument("--sequential", action="store_true", help="one generate() at a time, for comparison")
+    a = p.parse_args()
+
+    engine = ChatEngine(a.model)
+    engine.load()
+    if not a.sequential:
+        engine.enable_batching(max_batch_size=a.max_batch, kv_budget_bytes=int(a.kv_budget_mb * 1024 ** 2),
+                               max_queue=a.requests)
+    start = time.perf_counter()
+    streams = [engine.stream([{"role": "user", "content": f"Tell me fact number {i}."}],
+                             max_new_tokens=a.max_new_tokens, temperature=0)
+               for i in range(a.requests)]
+    results = []
+    for stream in streams:
+        while True:
+            kind, value = stream.events.get()
+            if kind in ("done", "error"):
+                results.append(value)
+                break
+    elapsed = time.perf_counter() - start
+    tokens = sum(r["tokens"] for r in results if isinstance(r, dict))
+    print(json.dumps({"seconds": round(elapsed, 2), "tokens_per_sec": round(tokens / elapsed, 1),
+                      "engine": engine.metrics()}, indent=2))
@@ -0,0 +1,170 @@
+# backend/chat_sessions.py
+import re
+import threading
+import time
+import uuid
+from array import array
+from collections import OrderedDict
+
+SLIDING, SUMMARY = "sliding", "summary"
+
+
+class SessionNotFoundError(Exception):
+    pass
+
+
+class ChatSession:
+    def __init__(self, session_id: str, model_id: str):
+        self.id = session_id
+        self.model_id = model_id
+        self.turns = []  # {"role", "content", "ids", "tokens"}; each message is tokenized once
+        self.summary = []  # one line per trimmed turn (summary policy)
+        self.summary_tokens = 0
+        self.tokens = 0
+        self.bytes = 0
+        self.created_at = self.last_used = time.time()
+
+
+def _gist(content: str, limit: int = 160) -> str:
+    sentence = re.split(r"(?<=[.!?])\s", content.strip(), maxsplit=1)[0]
+    return sentence if len(sentence) <= limit else sentence[:limit].rstrip() + "..."
+
+
+def _size(turn: dict) -> int:
+    return len(turn["content"].encode("utf-8")) + turn["ids"].itemsize * len(turn["ids"])
+
+
+class SessionStore:
+    """Server-side chat history, so clients send only the new message each turn.
+
+    Each message is tokenized once, by `turn()`, and its token ids are kept with it so
+    prompts are joined from them instead of tokenized again. `window()` trims a session to its
+    token budget in place: once the history exceeds the budget, the oldest turns are
+    dropped until it is back under `low_water` of it. Trimming in larger steps keeps the
+    prompt prefix stable for several turns, which lets the prefix KV cache reuse it.
+    The summary policy keeps a one-line gist of every dropped turn in a system note.
+    Sessions idle for `idle_ttl` seconds expire, and the least recently used ones are
+    evicted beyond `max_bytes` of stored text and token ids."""
+
+    def __init__(self, encode, idle_ttl: float = 3600, max_bytes: int = 64 * 1024 * 1024,
+                 policy: str = SLIDING, low_water: float = 0.75):
+        if policy not in (SLIDING, SUMMARY):
+            raise ValueError(f"Unknown session policy: {policy}")
+        self.encode = encode  # callable(role, content) -> token ids of that message in a prompt
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.low_water = low_water
+        self._sessions = OrderedDict()  # least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"created": 0, "expired": 0, "evicted": 0, "trimmed_turns": 0}
+
+    def create(self, model_id: str) -> ChatSession:
+        session = ChatSession(str(uuid.uuid4()), model_id)
+        with self._lock:
+            self._sessions[session.id] = session
+            self.stats["created"] += 1
+            self._expire()
+        return session
+
+    def get(self, session_id: str, model_id: str = None) -> ChatSession:
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is None or (model_id is not None and session.model_id != model_id):
+                raise SessionNotFoundError(f"Session {session_id} not found or expired")
+            session.last_used = time.time()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._bytes -= session.bytes
+            return session is not None
+
+    def turn(self, role: str, content: str) -> dict:
+        """A message tokenized once, to pass to window() and append()."""
+        ids = array("i", self.encode(role, content))
+        return {"role": role, "content": content, "ids": ids, "tokens": len(ids)}
+
+    def append(self, session: ChatSession, *turns):
+        """Record turns once they have been answered, so a failed request leaves no trace."""
+        with self._lock:
+            for turn in turns:
+                size = _size(turn)
+                session.turns.append(turn)
+                session.tokens += turn["tokens"]
+                if session.id in self._sessions:
+                    session.bytes += size
+                    self._bytes += size
+            session.last_used = time.time()
+            if session.id in self._sessions:
+                self._sessions.move_to_end(session.id)
+                self._evict()
+
+    def window(self, session: ChatSession, budget_tokens: int, system_prompt: str = None, pending: dict = None):
+        """Messages for the next prompt: system prompt, summary note, the turns that fit and `pending`.
+
+        Returns (messages, message_ids); the system message has no stored ids (None)."""
+        extra = pending["tokens"] if pending else 0
+        with self._lock:
+            if session.tokens + session.summary_tokens + extra > budget_tokens:
+                self._trim(session, budget_tokens, extra)
+            summary = list(session.summary)
+            turns = list(session.turns)
+        if pending:
+            turns.append(pending)
+        messages = [{"role": t["role"], "content": t["content"]} for t in turns]
+        message_ids = [t["ids"] for t in turns]
+        system = [system_prompt] if system_prompt else []
+        if summary:
+            system.append("Earlier in this conversation:\n" + "\n".join(summary))
+        if system:
+            messages.insert(0, {"role": "system", "content": "\n\n".join(system)})
+            message_ids.insert(0, None)
+        return messages, message_ids
+
+    def _trim(self, session: ChatSession, budget_tokens: int, extra: int = 0):
+        # `extra`: tokens of the pending message, which is always kept
+        target = int(budget_tokens * self.low_water)
+        while session.turns and session.tokens + session.summary_tokens + extra > target:
+            turn = session.turns.pop(0)
+            session.tokens -= turn["tokens"]
+            if session.id in self._sessions:
+                # An evicted or expired session's bytes already left the total
+                size = _size(turn)
+                session.bytes -= size
+                self._bytes -= size
+            self.stats["trimmed_turns"] += 1
+            if self.policy == SUMMARY:
+                line = f"{turn['role']}: {_gist(turn['content'])}"
+                session.summary.append(line)
+                # Rough count (~4 chars per token) to avoid calling the tokenizer under the lock
+                session.summary_tokens += len(line) // 4 + 1
+                while session.summary and session.summary_tokens > budget_tokens // 4:
+                    session.summary_tokens -= len(session.summary.pop(0)) // 4 + 1
+
+    def _expire(self):
+        cutoff = time.time() - self.idle_ttl
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.last_used >= cutoff:
+                break
+            self._sessions.popitem(last=False)
+            self._bytes -= session.bytes
+            self.stats["expired"] += 1
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._sessions) > 1:
+            _, session = self._sessions.popitem(last=False)
+            self._bytes -= session.bytes
+            self.stats["evicted"] += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            self._expire()
+            return {**self.stats, "sessions": len(self._sessions), "bytes": self._bytes,
+                    "max_bytes": self.max_bytes, "policy": self.policy}
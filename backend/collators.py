@@ -0,0 +1,70 @@
+# backend/collators.py
+import torch
+from datasets import Dataset
+
+
+def token_utilization(lengths, padded_to: int) -> float:
+    """Share of real tokens if every sample were padded to `padded_to`."""
+    return sum(lengths) / (len(lengths) * padded_to) if lengths else 0.0
+
+
+def pack_dataset(ds: Dataset, max_length: int, column: str = "input_ids") -> Dataset:
+    """First-fit-decreasing pack of tokenized samples into sequences of <= max_length tokens.
+
+    Each packed row keeps `seq_lens` so PackedCausalCollator can stop attention and
+    loss from crossing sample boundaries."""
+    samples = [ids[:max_length] for ids in ds[column]]
+    order = sorted(range(len(samples)), key=lambda i: len(samples[i]), reverse=True)
+    bins, space = [], []
+    for i in order:
+        n = len(samples[i])
+        for b, free in enumerate(space):
+            if n <= free:
+                bins[b].append(i)
+                space[b] -= n
+                break
+        else:
+            bins.append([i])
+            space.append(max_length - n)
+    return Dataset.from_dict({
+        column: [[t for i in b for t in samples[i]] for b in bins],
+        "seq_lens": [[len(samples[i]) for i in b] for b in bins],
+    })
+
+
+class PackedCausalCollator:
+    """Pads packed rows to the batch max and builds a block-diagonal causal mask.
+
+    Produces input_ids, labels (-100 on padding and on each sample's first token),
+    position_ids restarting at every sample, and a 4D additive attention mask
+    (0 = attend, dtype min = blocked) as accepted by Llama-style models."""
+
+    def __init__(self, pad_token_id: int, dtype=torch.float32, pad_to_multiple_of: int = 8):
+        self.pad_token_id = pad_token_id
+        self.dtype = dtype
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features):
+        longest = max(len(f["input_ids"]) for f in features)
+        m = self.pad_to_multiple_of
+        length = -(-longest // m) * m if m else longest
+        batch = len(features)
+        input_ids = torch.full((batch, length), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((batch, length), -100, dtype=torch.long)
+        position_ids = torch.zeros((batch, length), dtype=torch.long)
+        blocked = torch.finfo(self.dtype).min
+        mask = torch.full((batch, 1, length, length), blocked, dtype=self.dtype)
+        causal = torch.tril(torch.ones(length, length, dtype=torch.bool))
+        for row, f in enumerate(features):
+            ids = torch.as_tensor(f["input_ids"], dtype=torch.long)
+            input_ids[row, :len(ids)] = ids
+            labels[row, :len(ids)] = ids
+            start = 0
+            for n in f["seq_lens"]:
+                end = start + n
+                labels[row, start] = -100  # do not predict a sample from the previous one
+                position_ids[row, start:end] = torch.arange(n)
+                block = mask[row, 0, start:end, start:end]
+                block.masked_fill_(causal[:n, :n], 0.0)
+                start = end
+        return {"input_ids": input_ids, "labels": labels, "position_ids": position_ids, "attention_mask": mask}
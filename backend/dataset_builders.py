@@ -1,24 +1,84 @@
-from datasets import Dataset
-from typing import List
+import os
+import shutil
+from typing import Iterable, List, Union
+
+import pyarrow as pa
+from datasets import Dataset, concatenate_datasets
 
 
 SYSTEM_DEFAULT = "You are a helpful AI assistant. Use the given context if provided."
+SFT_COLUMNS = ["instruction", "input", "output"]
+
+
+def _sft_table(rows) -> pa.Table:
+    """DataFrame columns -> Arrow table, without going through per-row Python dicts."""
+    table = pa.Table.from_pandas(rows[SFT_COLUMNS], preserve_index=False)
+    table = table.cast(pa.schema([(c, pa.string()) for c in SFT_COLUMNS]))
+    return table.append_column("system", pa.array([SYSTEM_DEFAULT] * table.num_rows, pa.string()))
 
 
 def build_sft_from_qa(rows) -> Dataset:
     """rows: pandas DataFrame with instruction,input,output"""
-    recs = []
-    for r in rows.itertuples(index=False):
-        recs.append({
-        "instruction": getattr(r, "instruction"),
-        "input": getattr(r, "input"),
-        "output": getattr(r, "output"),
-        "system": SYSTEM_DEFAULT,
-        })
-    return Dataset.from_list(recs)
-
-
-def build_cpt_from_chunks(chunks: List[str]) -> Dataset:
+    return Dataset(_sft_table(rows))
+
+
+def build_cpt_from_chunks(chunks: Union[List[str], Iterable[str]]) -> Dataset:
     """Continued pretraining: model learns the domain distribution by predicting next tokens.
-    We store plain text examples."""
-    return Dataset.from_list([{"text": c} for c in chunks])
\ No newline at end of file
+    We store plain text examples. Lists are converted column-wise; other iterables
+    (e.g. ingest.iter_token_chunks output) are streamed into an on-disk Arrow cache."""
+    if isinstance(chunks, list):
+        return Dataset(pa.table({"text": pa.array(chunks, pa.string())}))
+
+    def gen():
+        for c in chunks:
+            yield {"text": c["text"] if isinstance(c, dict) else c}
+    return Dataset.from_generator(gen)
+
+
+def _write_shard(table: pa.Table, path: str):
+    # Arrow IPC stream format is what Dataset.from_file memory-maps
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def _save_from_shards(tables: Iterable[pa.Table], out_dir: str, max_shard_size: str) -> str:
+    parts_dir = out_dir.rstrip("/\\") + ".parts"
+    os.makedirs(parts_dir, exist_ok=True)
+    try:
+        shards = []
+        for i, table in enumerate(tables):
+            path = os.path.join(parts_dir, f"part-{i:05d}.arrow")
+            _write_shard(table, path)
+            shards.append(Dataset.from_file(path))  # memory-mapped, not loaded
+        if not shards:
+            raise ValueError("No rows to save")
+        concatenate_datasets(shards).save_to_disk(out_dir, max_shard_size=max_shard_size)
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+    return out_dir
+
+
+def build_sft_sharded(frames: Iterable, out_dir: str, max_shard_size: str = "500MB") -> str:
+    """Build an SFT dataset from an iterable of DataFrames (e.g. ingest.iter_csv_qa)
+    without holding all rows in memory; the result is saved for load_from_disk."""
+    return _save_from_shards((_sft_table(df) for df in frames), out_dir, max_shard_size)
+
+
+def build_cpt_sharded(chunks: Iterable, out_dir: str, rows_per_shard: int = 100_000,
+                      max_shard_size: str = "500MB") -> str:
+    """Streaming counterpart of build_cpt_from_chunks, saved for load_from_disk."""
+    def tables():
+        batch = []
+        for c in chunks:
+            batch.append(c["text"] if isinstance(c, dict) else c)
+            if len(batch) >= rows_per_shard:
+                yield pa.table({"text": pa.array(batch, pa.string())})
+                batch = []
+        if batch:
+            yield pa.table({"text": pa.array(batch, pa.string())})
+    return _save_from_shards(tables(), out_dir, max_shard_size)
+
+
+def save_dataset(ds: Dataset, out_dir: str, max_shard_size: str = "500MB") -> str:
+    ds.save_to_disk(out_dir, max_shard_size=max_shard_size)
+    return out_dir
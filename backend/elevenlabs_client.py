@@ -0,0 +1,161 @@
+# backend/elevenlabs_client.py
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+from lazy_imports import LazyModule
+
+httpx = LazyModule("httpx", "tts")
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ElevenLabsError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _error_detail(response) -> str:
+    try:
+        detail = response.json().get("detail", "Unknown error")
+    except ValueError:
+        return response.text or "Unknown error"
+    if isinstance(detail, dict):
+        return detail.get("message") or str(detail)
+    return str(detail)
+
+
+class ElevenLabsClient:
+    """Async ElevenLabs API client over a persistent keep-alive connection pool.
+
+    At most `max_concurrency` requests wait for a response at a time; a TTS stream
+    gives its slot back once the headers arrive, so a slow reader does not hold it
+    (open streams stay bounded by `max_connections`). Requests are retried with
+    exponential backoff (plus jitter) on connection errors, 429 and 5xx, honouring
+    Retry-After up to `timeout` seconds; a longer Retry-After fails at once. TTS audio
+    is streamed: chunks are handed to the caller as they arrive, and a streamed
+    request is only retried if it failed before the first byte.
+    `base_url` can point at a local stand-in server for tests."""
+
+    def __init__(self, api_key: str, base_url: str = "https://api.elevenlabs.io", max_connections: int = 10,
+                 max_concurrency: int = 4, retries: int = 3, backoff: float = 0.5, timeout: float = 30.0):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._client = None
+        self._slots = None
+        self.stats = {"requests": 0, "retries": 0, "errors": 0, "bytes_streamed": 0}
+
+    def _http(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"xi-api-key": self.api_key},
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                timeout=httpx.Timeout(self.timeout, read=max(self.timeout, 60.0)),
+            )
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _delay(self, attempt: int, response=None) -> float:
+        """Seconds to wait before retrying; raises if the server asks for longer than `timeout`."""
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                if delay > self.timeout:
+                    self.stats["errors"] += 1
+                    raise ElevenLabsError(response.status_code,
+                                          f"ElevenLabs asked to retry after {delay:.0f}s: {_error_detail(response)}")
+                return max(delay, 0.0)
+        return self.backoff * (2 ** attempt) * (0.5 + random.random())
+
+    async def _request(self, method: str, path: str, **kwargs):
+        client = self._http()
+        for attempt in range(self.retries + 1):
+            self.stats["requests"] += 1
+            try:
+                async with self._slots:
+                    response = await client.request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                if attempt == self.retries:
+                    self.stats["errors"] += 1
+                    raise ElevenLabsError(502, f"ElevenLabs unreachable: {e}")
+                response = None
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    if response.status_code != 200:
+                        self.stats["errors"] += 1
+                        raise ElevenLabsError(response.status_code, _error_detail(response))
+                    return response
+            delay = self._delay(attempt, response)
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+    async def get_voices(self) -> dict:
+        response = await self._request("GET", "/v1/voices")
+        return response.json()
+
+    async def stream_tts(self, text: str, voice_id: str, model_id: str = "eleven_multilingual_v2",
+                         voice_settings: dict = None):
+        """Async iterator over MP3 chunks as ElevenLabs produces them (no re-buffering)."""
+        client = self._http()
+        body = {
+            "text": text,
+            "model_id": model_id,
+            "voice_settings": voice_settings or {"stability": 0.5, "similarity_boost": 0.75},
+        }
+        headers = {"Accept": "audio/mpeg"}
+        for attempt in range(self.retries + 1):
+            self.stats["requests"] += 1
+            started = False
+            retry_response = None
+            try:
+                request = client.build_request("POST", f"/v1/text-to-speech/{voice_id}/stream",
+                                               json=body, headers=headers)
+                async with self._slots:
+                    response = await client.send(request, stream=True)
+                try:
+                    if response.status_code != 200:
+                        await response.aread()
+                        if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                            self.stats["errors"] += 1
+                            raise ElevenLabsError(response.status_code, _error_detail(response))
+                        retry_response = response
+                    else:
+                        async for chunk in response.aiter_bytes():
+                            started = True
+                            self.stats["bytes_streamed"] += len(chunk)
+                            yield chunk
+                        return
+                finally:
+                    await response.aclose()
+            except httpx.TransportError as e:
+                if started or attempt == self.retries:
+                    self.stats["errors"] += 1
+                    raise ElevenLabsError(502, f"ElevenLabs stream failed: {e}")
+            delay = self._delay(attempt, retry_response)
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+    def metrics(self) -> dict:
+        return {**self.stats, "max_connections": self.max_connections, "max_concurrency": self.max_concurrency}
@@ -0,0 +1,46 @@
+# backend/event_queue.py
+import asyncio
+import threading
+from collections import deque
+
+
+class EventQueue:
+    """Events from a worker thread to a single consumer.
+
+    Threads block in `get()`. Async handlers `await get_async()`, which binds the
+    queue to the running loop: from then on `put()` hands events over with
+    `call_soon_threadsafe`, so waiting for the next event does not hold a thread
+    from the default executor."""
+
+    def __init__(self):
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._loop = None
+        self._async = None  # asyncio.Queue, once a coroutine consumes the events
+
+    def put(self, item):
+        with self._cond:
+            if self._loop is None:
+                self._items.append(item)
+                self._cond.notify()
+                return
+            loop, target = self._loop, self._async
+        try:
+            loop.call_soon_threadsafe(target.put_nowait, item)
+        except RuntimeError:
+            pass  # event loop closed; nobody is listening any more
+
+    def get(self):
+        with self._cond:
+            while not self._items:
+                self._cond.wait()
+            return self._items.popleft()
+
+    async def get_async(self):
+        if self._async is None:
+            with self._cond:
+                self._loop = asyncio.get_running_loop()
+                self._async = asyncio.Queue()
+                while self._items:
+                    self._async.put_nowait(self._items.popleft())
+        return await self._async.get()
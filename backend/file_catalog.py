@@ -0,0 +1,188 @@
+# backend/file_catalog.py
+import os
+import threading
+import time
+import uuid
+
+from lazy_imports import LazyModule
+
+sqlalchemy = LazyModule("sqlalchemy", "catalog")
+
+CREATE_FILES_TABLE = """
+CREATE TABLE IF NOT EXISTS files (
+    file_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    filename TEXT,
+    size INTEGER,
+    sha256 TEXT,
+    owner TEXT,
+    created_at REAL NOT NULL,
+    expires_at REAL
+)
+"""
+
+
+class FileCatalog:
+    """SQLite-backed index of stored files (uploads, voices, exports and other generated artifacts).
+
+    Lookups by file_id are primary-key reads instead of directory scans. A
+    background collector removes expired entries and blobs no file refers to."""
+
+    def __init__(self, engine_getter):
+        self._engine_getter = engine_getter
+        self._ready = False
+        self._lock = threading.Lock()
+        self._gc_thread = None
+        self._gc_stop = threading.Event()
+        self._expire_hooks = {}  # kind -> callback(record) run after an expired entry is removed
+
+    def _engine(self):
+        engine = self._engine_getter()
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    with engine.begin() as conn:
+                        conn.execute(sqlalchemy.text(CREATE_FILES_TABLE))
+                        conn.execute(sqlalchemy.text("CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files (sha256)"))
+                        conn.execute(sqlalchemy.text("CREATE INDEX IF NOT EXISTS idx_files_expires ON files (expires_at)"))
+                    self._ready = True
+        return engine
+
+    def add(self, kind: str, path: str, file_id: str = None, filename: str = None, size: int = None,
+            sha256: str = None, owner: str = None, ttl: float = None) -> dict:
+        now = time.time()
+        record = {
+            "file_id": file_id or str(uuid.uuid4()),
+            "kind": kind,
+            "path": path,
+            "filename": filename or os.path.basename(path),
+            "size": size if size is not None else os.path.getsize(path),
+            "sha256": sha256,
+            "owner": owner,
+            "created_at": now,
+            "expires_at": now + ttl if ttl else None,
+        }
+        with self._engine().begin() as conn:
+            conn.execute(sqlalchemy.text(
+                "INSERT OR REPLACE INTO files (file_id, kind, path, filename, size, sha256, owner, created_at, expires_at) "
+                "VALUES (:file_id, :kind, :path, :filename, :size, :sha256, :owner, :created_at, :expires_at)"
+            ), record)
+        return record
+
+    def get(self, file_id: str, kind: str = None):
+        query = "SELECT * FROM files WHERE file_id = :file_id"
+        params = {"file_id": file_id}
+        if kind:
+            query += " AND kind = :kind"
+            params["kind"] = kind
+        with self._engine().connect() as conn:
+            row = conn.execute(sqlalchemy.text(query), params).mappings().fetchone()
+        return dict(row) if row else None
+
+    def remove(self, file_id: str, delete_file: bool = True, kind: str = None):
+        """Drop an entry (and its file); with `kind`, only an entry of that kind."""
+        record = self.get(file_id, kind)
+        if record is None:
+            return None
+        with self._engine().begin() as conn:
+            conn.execute(sqlalchemy.text("DELETE FROM files WHERE file_id = :file_id"), {"file_id": file_id})
+        if delete_file:
+            try:
+                os.remove(record["path"])
+            except FileNotFoundError:
+                pass
+        return record
+
+    def backfill(self, kind: str, directory: str, parse_name) -> int:
+        """Register files in `directory` that were stored before the catalog existed.
+
+        `parse_name(name)` returns (file_id, filename) for a file name, or None to skip
+        it. Files already in the catalog are left alone. Backfilled entries do not
+        expire, as the files never did before. Returns the number of files added."""
+        if not os.path.isdir(directory):
+            return 0
+        with self._engine().connect() as conn:
+            known = {row[0] for row in conn.execute(sqlalchemy.text("SELECT path FROM files"))}
+        records = []
+        for entry in os.scandir(directory):
+            path = os.path.join(directory, entry.name).replace("\\", "/")
+            if path in known or entry.name.startswith(".") or not entry.is_file():
+                continue
+            parsed = parse_name(entry.name)
+            if parsed is None:
+                continue
+            st = entry.stat()
+            records.append({"file_id": parsed[0], "kind": kind, "path": path, "filename": parsed[1],
+                            "size": st.st_size, "sha256": None, "owner": None,
+                            "created_at": st.st_mtime, "expires_at": None})
+        if records:
+            with self._engine().begin() as conn:
+                conn.execute(sqlalchemy.text(
+                    "INSERT OR IGNORE INTO files (file_id, kind, path, filename, size, sha256, owner, created_at, expires_at) "
+                    "VALUES (:file_id, :kind, :path, :filename, :size, :sha256, :owner, :created_at, :expires_at)"
+                ), records)
+        return len(records)
+
+    def resolve_path(self, file_ref: str) -> str:
+        """Accept either a file_id or a stored path (as returned by /upload)."""
+        record = self.get(file_ref)
+        return record["path"] if record else file_ref
+
+    def on_expire(self, kind: str, callback):
+        """Run `callback(record)` when GC removes an expired entry of `kind`, so other
+        stores that index the same file can drop it too."""
+        self._expire_hooks[kind] = callback
+
+    def collect_garbage(self, blob_dir: str = None, part_max_age: float = 3600) -> dict:
+        now = time.time()
+        removed = {"expired": 0, "orphaned_blobs": 0, "stale_parts": 0}
+        with self._engine().connect() as conn:
+            expired = conn.execute(
+                sqlalchemy.text("SELECT file_id FROM files WHERE expires_at IS NOT NULL AND expires_at < :now"),
+                {"now": now},
+            ).fetchall()
+        for (file_id,) in expired:
+            record = self.remove(file_id)
+            if record is None:
+                continue
+            removed["expired"] += 1
+            hook = self._expire_hooks.get(record["kind"])
+            if hook is not None:
+                hook(record)
+
+        if blob_dir and os.path.isdir(blob_dir):
+            for root, _, names in os.walk(blob_dir):
+                for name in names:
+                    path = os.path.join(root, name)
+                    st = os.stat(path)
+                    if name.endswith(".part"):
+                        if now - st.st_mtime > part_max_age:
+                            os.remove(path)
+                            removed["stale_parts"] += 1
+                        continue
+                    # Only the blob itself links to this inode, so no upload path refers to it.
+                    # ctime changes whenever a link is added, which skips blobs mid-upload.
+                    if st.st_nlink <= 1 and now - st.st_ctime > part_max_age:
+                        os.remove(path)
+                        removed["orphaned_blobs"] += 1
+        if any(removed.values()):
+            print(f"File GC removed: {removed}")
+        return removed
+
+    def start_gc(self, interval: float, blob_dir: str = None):
+        if self._gc_thread is not None:
+            return
+
+        def loop():
+            while not self._gc_stop.wait(interval):
+                try:
+                    self.collect_garbage(blob_dir)
+                except Exception as e:
+                    print(f"File GC error: {e}")
+
+        self._gc_thread = threading.Thread(target=loop, name="file-gc", daemon=True)
+        self._gc_thread.start()
+
+    def stop_gc(self):
+        self._gc_stop.set()
@@ -0,0 +1,105 @@
+# backend/file_store.py
+import asyncio
+import hashlib
+import os
+import uuid
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    pass
+
+
+def _blob_path(blob_dir: str, digest: str) -> str:
+    return os.path.join(blob_dir, digest[:2], digest).replace("\\", "/")
+
+
+def _link(src: str, dst: str):
+    # Hard links keep one copy on disk while every file_id keeps its own path. There is
+    # no copy fallback: a copy would leave the blob with nlink 1, so it would neither
+    # deduplicate nor survive the collector, which treats such blobs as orphans.
+    try:
+        os.link(src, dst)
+    except FileNotFoundError:
+        raise
+    except OSError as e:
+        raise OSError(e.errno, f"Cannot hard-link {dst} to its blob ({e.strerror}); the upload directory and "
+                               f"{os.path.dirname(os.path.dirname(src))} must be on one filesystem "
+                               f"that supports hard links") from e
+
+
+class RequestSizeLimitMiddleware:
+    """ASGI middleware answering 413 to requests whose Content-Length exceeds `max_bytes`
+    before any of the body is read (multipart bodies are otherwise spooled to disk in
+    full before the endpoint runs). Bodies sent without a length still stop at
+    save_upload's per-file limit."""
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            length = dict(scope["headers"]).get(b"content-length", b"")
+            if length.isdigit() and int(length) > self.max_bytes:
+                from starlette.responses import JSONResponse
+
+                response = JSONResponse({"detail": f"Request body exceeds the {self.max_bytes} byte limit"},
+                                        status_code=413)
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+async def save_upload(upload, dest_dir: str, blob_dir: str, max_bytes: int, chunk_size: int = CHUNK_SIZE) -> dict:
+    """Stream an UploadFile to a content-addressed blob without holding it in memory.
+
+    The SHA-256 is computed while writing; identical content is stored once under
+    blob_dir and `dest_dir/<file_id>_<filename>` is hard-linked to it (both must be on
+    one filesystem). Raises UploadTooLargeError once more than `max_bytes` have been received."""
+    loop = asyncio.get_running_loop()
+    os.makedirs(blob_dir, exist_ok=True)
+    file_id = str(uuid.uuid4())
+    filename = os.path.basename(upload.filename or "upload")
+    tmp_path = os.path.join(blob_dir, f".{file_id}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as buffer:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"{filename} exceeds the {max_bytes} byte limit")
+                digest.update(chunk)
+                await loop.run_in_executor(None, buffer.write, chunk)
+
+        sha256 = digest.hexdigest()
+        blob_path = _blob_path(blob_dir, sha256)
+        file_path = os.path.join(dest_dir, f"{file_id}_{filename}").replace("\\", "/")
+        # Link first: once file_path links the blob the collector leaves it alone, whereas
+        # checking that the blob exists and linking afterwards could lose it in between
+        try:
+            _link(blob_path, file_path)
+            deduplicated = True
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(tmp_path, blob_path)
+            _link(blob_path, file_path)
+            deduplicated = False
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return {
+        "file_id": file_id,
+        "filename": filename,
+        "path": file_path,
+        "size": size,
+        "sha256": sha256,
+        "blob_path": blob_path,
+        "deduplicated": deduplicated,
+    }
@@ -1,6 +1,7 @@
 from transformers import AutoModelForCausalLM, AutoTokenizer, Trainer, TrainingArguments
 import sys
 import json
+from train_telemetry import instrument
 
 if __name__ == "__main__":
     model_id = sys.argv[1]  # e.g., "litebot-3b"
@@ -26,6 +27,7 @@ if __name__ == "__main__":
 
     # Train (placeholder)
     trainer = Trainer(model=model, args=training_args, train_dataset=data)
+    instrument(trainer, output_id)
     trainer.train()
 
     # Save the model
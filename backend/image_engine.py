@@ -0,0 +1,178 @@
+# backend/image_engine.py
+import threading
+import time
+import uuid
+from collections import deque
+
+from event_queue import EventQueue
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class ImageJob:
+    def __init__(self, prompt: str, num_steps: int = 50, width: int = 512, height: int = 512,
+                 seed: int = None):
+        self.id = str(uuid.uuid4())
+        self.prompt = prompt
+        self.seed = seed
+        self.num_steps = num_steps
+        self.width = width
+        self.height = height
+        self.submitted_at = time.perf_counter()
+        self.cancelled = False
+        # ("queue", position) | ("progress", pct) | ("done", PIL image) | ("error", msg)
+        self.events = EventQueue()
+
+    @property
+    def batch_key(self):
+        return (self.num_steps, self.width, self.height)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class ImageBatchScheduler:
+    """Collects prompts from every /ws/image-gen socket into micro-batches.
+
+    Jobs with the same (steps, width, height) are run as a single pipeline call;
+    progress and results are fanned back out to each job's event queue. Batches
+    run on replicas checked out of a PipelinePool, one worker thread per replica.
+    The pipeline is any callable following the diffusers call signature, so a
+    tiny stand-in can be used on CPU."""
+
+    def __init__(self, pool, max_batch_size: int = 4, max_queue: int = 32,
+                 batch_wait: float = 0.05, generator_factory=None):
+        self.pool = pool
+        # callable(seed or None) -> torch.Generator, used when any job in a batch is seeded
+        self.generator_factory = generator_factory
+        self.max_batch_size = max_batch_size
+        self.max_queue = max_queue
+        self.batch_wait = batch_wait
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopped = False
+        self.stats = {"batches": 0, "images": 0, "rejected": 0, "busy_seconds": 0.0}
+
+    def start(self):
+        with self._cond:
+            if not self._threads:
+                self._stopped = False
+                for i in range(self.pool.replicas):
+                    thread = threading.Thread(target=self._run, name=f"image-batch-worker-{i}", daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, prompt: str, num_steps: int = 50, width: int = 512, height: int = 512,
+               seed: int = None) -> ImageJob:
+        job = ImageJob(prompt, num_steps, width, height, seed)
+        with self._cond:
+            if len(self._pending) >= self.max_queue:
+                self.stats["rejected"] += 1
+                raise QueueFullError(f"Image queue is full ({self.max_queue} pending)")
+            self._pending.append(job)
+            job.events.put(("queue", len(self._pending)))
+            self._cond.notify_all()
+        return job
+
+    def cancel(self, job: ImageJob):
+        """Cancel a job: a queued job leaves the queue at once, a running one still finishes with its batch."""
+        job.cancel()
+        with self._cond:
+            if job in self._pending:
+                self._pending.remove(job)
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def metrics(self) -> dict:
+        with self._cond:
+            stats = {**self.stats, "queue_depth": len(self._pending),
+                     "max_batch_size": self.max_batch_size, "max_queue": self.max_queue}
+        return {**stats, "pool": self.pool.metrics()}
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._stopped:
+                self._pending = deque(j for j in self._pending if not j.cancelled)
+                if self._pending:
+                    break
+                self._cond.wait()
+            if self._stopped:
+                return None
+        # Give concurrent sockets a moment to join the batch
+        if self.batch_wait:
+            time.sleep(self.batch_wait)
+        with self._cond:
+            if not self._pending:
+                return []
+            head = self._pending[0]
+            batch, rest = [], deque()
+            for job in self._pending:
+                if job.cancelled:
+                    continue
+                if job.batch_key == head.batch_key and len(batch) < self.max_batch_size:
+                    batch.append(job)
+                else:
+                    rest.append(job)
+            self._pending = rest
+            for position, job in enumerate(self._pending, start=1):
+                job.events.put(("queue", position))
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if batch:
+                self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        num_steps, width, height = batch[0].batch_key
+
+        def callback(step: int, timestep, latents):
+            progress = int((step / num_steps) * 100)
+            for job in batch:
+                job.events.put(("progress", progress))
+
+        kwargs = {}
+        if self.generator_factory is not None and any(job.seed is not None for job in batch):
+            kwargs["generator"] = [self.generator_factory(job.seed) for job in batch]
+
+        start = time.perf_counter()
+        try:
+            with self.pool.acquire() as pipeline:
+                print(f"Running image batch of {len(batch)} ({num_steps} steps, {width}x{height})")
+                images = pipeline(
+                    prompt=[job.prompt for job in batch],
+                    num_inference_steps=num_steps,
+                    width=width,
+                    height=height,
+                    callback=callback,
+                    callback_steps=1,
+                    **kwargs,
+                ).images
+            for job, image in zip(batch, images):
+                job.events.put(("done", image))
+            with self._cond:
+                self.stats["images"] += len(batch)
+        except Exception as e:
+            for job in batch:
+                job.events.put(("error", str(e)))
+        finally:
+            with self._cond:
+                self.stats["batches"] += 1
+                self.stats["busy_seconds"] = round(self.stats["busy_seconds"] + time.perf_counter() - start, 3)
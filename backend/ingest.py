@@ -1,30 +1,134 @@
-import os, re
+import os, re, time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Iterable, Iterator
 import fitz # PyMuPDF
 import pandas as pd
 
 
 WHITESPACE_RE = re.compile(r"\s+")
+PARAGRAPH_RE = re.compile(r"\n\s*\n")
+PAGES_PER_TASK = 32
 
 
 def _clean(text: str) -> str:
-    text = text.replace("\r", " ")
-    text = WHITESPACE_RE.sub(" ", text)
-    return text.strip()
+    """Collapse whitespace within paragraphs; blank lines stay as "\n\n" paragraph breaks."""
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    paragraphs = (WHITESPACE_RE.sub(" ", p).strip() for p in PARAGRAPH_RE.split(text))
+    return "\n\n".join(p for p in paragraphs if p)
+
+
+def iter_pdf_pages(path: str, start: int = 0, stop: int = None) -> Iterator[str]:
+    """Yield cleaned text page by page (non-empty pages only)."""
+    with fitz.open(path) as doc:
+        stop = doc.page_count if stop is None else min(stop, doc.page_count)
+        for i in range(start, stop):
+            txt = doc.load_page(i).get_text("text") or ""
+            if txt.strip():
+                yield _clean(txt)
+
+
+def _extract_page_range(path: str, start: int, stop: int) -> list[str]:
+    # Runs in a worker process; each worker opens its own document handle
+    return list(iter_pdf_pages(path, start, stop))
+
+
+def pdf_page_count(path: str) -> int:
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+def _bounded(tasks: Iterable, submit, window: int) -> Iterator[tuple]:
+    """Yield (task, submit(task)) in task order, submitting at most `window` tasks
+    ahead of the consumer. `tasks` is consumed lazily."""
+    in_flight = deque()
+    for task in tasks:
+        in_flight.append((task, submit(task)))
+        if len(in_flight) >= window:
+            yield in_flight.popleft()
+    yield from in_flight
+
+
+def iter_pdf_pages_parallel(paths: list[str], max_workers: int = None, pages_per_task: int = PAGES_PER_TASK) -> Iterator[str]:
+    """Like iter_pdf_pages over several PDFs, with page ranges extracted across one process pool.
+
+    Pages are yielded in input and document order. At most 2 * max_workers ranges
+    are in flight across all documents, so memory stays bounded for very large PDFs."""
+    max_workers = max_workers or os.cpu_count() or 1
+
+    def ranges():
+        for path in paths:
+            for s in range(0, pdf_page_count(path), pages_per_task):
+                yield path, s, s + pages_per_task
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        for _, future in _bounded(ranges(), lambda task: pool.submit(_extract_page_range, *task), 2 * max_workers):
+            yield from future.result()
 
 
 def extract_pdf_text(path: str) -> str:
-    doc = fitz.open(path)
-    chunks = []
-    for page in doc:
-        txt = page.get_text("text") or ""
-        if txt.strip():
-            chunks.append(txt)
-        return _clean("\n".join(chunks))
+    return " ".join(iter_pdf_pages(path))
 
 
-def extract_csv_qa(path: str) -> pd.DataFrame:
-    df = pd.read_csv(path)
+def ingest_pdfs(paths: list[str], max_workers: int = None, pages_per_task: int = PAGES_PER_TASK) -> Iterator[tuple[str, list[str], dict]]:
+    """Extract a batch of PDFs concurrently.
+
+    Every document is split into page ranges that share one process pool, so a
+    single huge manual and thousands of small ones both keep all cores busy.
+    Yields (path, page_texts, metrics) in input order as each document completes;
+    at most 2 * max_workers ranges are in flight, across documents and within one."""
+    max_workers = max_workers or os.cpu_count() or 1
+    docs = []  # [path, start_time, page_count, error] per input document
+
+    def ranges():
+        for i, path in enumerate(paths):
+            docs.append([path, time.perf_counter(), 0, None])
+            try:
+                docs[i][2] = pdf_page_count(path)
+            except Exception as e:
+                docs[i][3] = e
+            # A document with no pages still gets one (empty) task, so it is reported
+            for s in range(0, docs[i][2], pages_per_task) or range(1):
+                yield i, s
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        def submit(task):
+            i, s = task
+            path, _, page_count, error = docs[i]
+            if error is not None or not page_count:
+                return None
+            return pool.submit(_extract_page_range, path, s, s + pages_per_task)
+
+        current, pages = None, []
+        for (i, _), future in _bounded(ranges(), submit, 2 * max_workers):
+            if i != current:
+                if current is not None:
+                    yield _collect(*docs[current], pages)
+                current, pages = i, []
+            if future is not None and docs[i][3] is None:
+                try:
+                    pages.extend(future.result())
+                except Exception as e:
+                    docs[i][3] = e
+        if current is not None:
+            yield _collect(*docs[current], pages)
+
+
+def _collect(path: str, start_time: float, page_count: int, error, pages: list[str]) -> tuple[str, list[str], dict]:
+    if error is not None:
+        return path, [], {"error": str(error)}
+    seconds = time.perf_counter() - start_time
+    return path, pages, {
+        "pages": page_count,
+        "text_pages": len(pages),
+        "chars": sum(len(p) for p in pages),
+        "seconds": round(seconds, 3),
+        "pages_per_sec": round(page_count / seconds, 1) if seconds else None,
+    }
+
+
+def _normalize_qa(df: pd.DataFrame) -> pd.DataFrame:
     cols = {c.lower(): c for c in df.columns}
     if {"instruction","input","output"}.issubset(cols):
         return df.rename(columns={cols["instruction"]:"instruction", cols["input"]:"input", cols["output"]:"output"})
@@ -39,14 +143,108 @@ def extract_csv_qa(path: str) -> pd.DataFrame:
         raise ValueError("CSV must contain instruction/input/output or question/answer columns")
 
 
-def chunk_text(text: str, max_tokens: int = 512) -> list[str]:
-    """Token-approximate chunking by words; swap with tiktoken if desired."""
+def extract_csv_qa(path: str) -> pd.DataFrame:
+    return _normalize_qa(pd.read_csv(path))
+
+
+def iter_csv_qa(path: str, chunksize: int = 200_000) -> Iterator[pd.DataFrame]:
+    """extract_csv_qa for CSVs larger than RAM: yields normalized frames of `chunksize` rows."""
+    for df in pd.read_csv(path, chunksize=chunksize):
+        yield _normalize_qa(df)
+
+
+SENTENCE_END = ".!?"
+
+
+def _boundary_score(text: str, end: int) -> int:
+    """2 = paragraph break after char `end`, 1 = sentence end, 0 = mid-sentence."""
+    if text.startswith("\n\n", end):
+        return 2
+    if end > 0 and text[end - 1] in SENTENCE_END and (end == len(text) or text[end].isspace()):
+        return 1
+    return 0
+
+
+def iter_token_chunks(texts: Iterable[str], tokenizer, max_tokens: int = 512, overlap: int = 64,
+                      batch_size: int = 64, min_chars: int = 50, min_fill: float = 0.5) -> Iterator[dict]:
+    """Chunk a stream of texts (e.g. PDF pages) into exact token-budget windows.
+
+    Texts are tokenized in batches with the model's fast tokenizer. Each chunk holds
+    at most `max_tokens` tokens and ends on a paragraph or sentence boundary when one
+    exists past `min_fill` of the budget. Consecutive chunks share `overlap` tokens,
+    which must be less than `min_fill * max_tokens` so every chunk advances.
+    Yields {"text", "input_ids", "start_token", "end_token"} with token offsets
+    counted over the whole stream."""
+    if overlap >= min_fill * max_tokens:
+        # A chunk may end as early as min_fill of the budget; the next must still start after it
+        raise ValueError("overlap must be smaller than min_fill * max_tokens")
+    buf_text = ""
+    ids, spans = [], []  # token ids and their (start, end) char spans in buf_text
+    consumed = 0  # stream position of ids[0]
+
+    def emit(final: bool):
+        nonlocal buf_text, ids, spans, consumed
+        while len(ids) > max_tokens or (final and ids):
+            cut = min(len(ids), max_tokens)
+            if cut == max_tokens and len(ids) > max_tokens:
+                best, best_score = cut, 0
+                for i in range(cut, int(max_tokens * min_fill), -1):
+                    score = _boundary_score(buf_text, spans[i - 1][1])
+                    if score > best_score:
+                        best, best_score = i, score
+                        if score == 2:
+                            break
+                cut = best
+            text = buf_text[spans[0][0]:spans[cut - 1][1]]
+            if len(text) >= min_chars:
+                yield {"text": text, "input_ids": ids[:cut],
+                       "start_token": consumed, "end_token": consumed + cut}
+            if cut == len(ids):
+                consumed += cut
+                buf_text, ids, spans = "", [], []
+                return
+            keep = cut - overlap
+            consumed += keep
+            base = spans[keep][0]
+            buf_text = buf_text[base:]
+            ids = ids[keep:]
+            spans = [(s - base, e - base) for s, e in spans[keep:]]
+
+    def add_batch(batch):
+        nonlocal buf_text
+        enc = tokenizer(batch, add_special_tokens=False, return_offsets_mapping=True)
+        for text, text_ids, offsets in zip(batch, enc["input_ids"], enc["offset_mapping"]):
+            if not text_ids:
+                continue
+            sep = "\n\n" if buf_text else ""
+            base = len(buf_text) + len(sep)
+            buf_text = buf_text + sep + text
+            ids.extend(text_ids)
+            spans.extend((s + base, e + base) for s, e in offsets)
+            yield from emit(final=False)
+
+    batch = []
+    for text in texts:
+        if text and text.strip():
+            batch.append(text)
+        if len(batch) >= batch_size:
+            yield from add_batch(batch)
+            batch = []
+    if batch:
+        yield from add_batch(batch)
+    yield from emit(final=True)
+
+
+def chunk_text(text: str, max_tokens: int = 512, tokenizer=None, overlap: int = 0) -> list[str]:
+    """Chunk text to a token budget; exact when a tokenizer is given, word-approximate otherwise."""
+    if tokenizer is not None:
+        return [c["text"] for c in iter_token_chunks([text], tokenizer, max_tokens, overlap)]
     words = text.split()
     approx_tok_per_word = 1.3
     step = int(max_tokens / approx_tok_per_word)
     out = []
     for i in range(0, len(words), step):
         chunk = " ".join(words[i:i+step])
-    if len(chunk) > 50:
-        out.append(chunk)
-    return out
\ No newline at end of file
+        if len(chunk) > 50:
+            out.append(chunk)
+    return out
@@ -0,0 +1,97 @@
+# backend/lazy_imports.py
+import importlib
+import resource
+import sys
+import threading
+import time
+
+_PROCESS_START = time.perf_counter()
+_lock = threading.Lock()
+_import_log = {}  # module name -> {"capability": ..., "seconds": ...}
+
+
+class LazyModule:
+    """Module proxy that imports `name` on first attribute access.
+
+    Heavy ML stacks (torch, diffusers, sklearn, cv2, ...) are wrapped in this so a
+    worker only pays for the capabilities it actually serves."""
+
+    def __init__(self, name: str, capability: str = "core"):
+        self.__dict__["_name"] = name
+        self.__dict__["_capability"] = capability
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            module = timed_import(self._name, self._capability)
+            self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_module"] is not None else "not loaded"
+        return f"<LazyModule {self._name} ({state})>"
+
+
+def timed_import(name: str, capability: str = "core"):
+    """Import a module, recording how long the first import took."""
+    with _lock:
+        if name in sys.modules and name in _import_log:
+            return sys.modules[name]
+        already_loaded = name in sys.modules
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        elapsed = time.perf_counter() - start
+        if name not in _import_log:
+            _import_log[name] = {
+                "capability": capability,
+                "seconds": 0.0 if already_loaded else round(elapsed, 4),
+                "loaded_at": round(time.perf_counter() - _PROCESS_START, 4),
+            }
+            print(f"Imported {name} for {capability} in {elapsed:.2f}s")
+        return module
+
+
+def resolve(module):
+    """Return the real module behind a LazyModule (or the module itself)."""
+    if isinstance(module, LazyModule):
+        return module._load()
+    return module
+
+
+def is_loaded(module) -> bool:
+    if isinstance(module, LazyModule):
+        return module.__dict__["_module"] is not None
+    return True
+
+
+def _rss_mb() -> float:
+    # ru_maxrss is KB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss /= 1024
+    return round(rss / 1024, 1)
+
+
+def import_report(startup_seconds: float = None) -> dict:
+    """Per-module and per-capability import cost for this worker."""
+    with _lock:
+        modules = [{"module": name, **info} for name, info in _import_log.items()]
+    capabilities = {}
+    for m in modules:
+        cap = capabilities.setdefault(m["capability"], {"modules": [], "seconds": 0.0})
+        cap["modules"].append(m["module"])
+        cap["seconds"] = round(cap["seconds"] + m["seconds"], 4)
+    return {
+        "startup_seconds": startup_seconds,
+        "uptime_seconds": round(time.perf_counter() - _PROCESS_START, 2),
+        "peak_rss_mb": _rss_mb(),
+        "modules": sorted(modules, key=lambda m: m["seconds"], reverse=True),
+        "capabilities": capabilities,
+    }
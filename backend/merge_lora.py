@@ -1,8 +1,15 @@
+import json
+import math
+import os
+import re
+import shutil
+
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from peft import PeftModel
+from safetensors import safe_open
+from safetensors.torch import load_file, save_file
+from transformers import AutoTokenizer
 
-# Base model (Hugging Face repo)
+# Base model (Hugging Face repo or local directory with *.safetensors shards)
 BASE_MODEL = "meta-llama/Llama-3.1-8B-Instruct"
 
 # Path to your fine-tuned LoRA adapter (must contain adapter_config.json + adapter_model.bin/safetensors)
@@ -11,32 +18,140 @@ ADAPTER_PATH = "./fine_tuned_model"
 # Output path where merged model will be saved
 MERGED_MODEL_PATH = "./merged_model"
 
-def merge_lora():
-    # Load base model on CPU
-    print("🔹 Loading base model... (this may take a while)")
-    base_model = AutoModelForCausalLM.from_pretrained(
-        BASE_MODEL,
-        torch_dtype=torch.float32,   # safer for CPU
-        device_map=None              # disable accelerate offloading
-    )
+# Non-weight files copied from the base model next to the merged shards
+CONFIG_FILES = ["config.json", "generation_config.json"]
+
+
+def _base_model_dir(base_model: str) -> str:
+    if os.path.isdir(base_model):
+        return base_model
+    from huggingface_hub import snapshot_download
+    return snapshot_download(base_model, allow_patterns=["*.safetensors", "*.json"])
+
+
+def _pattern_value(pattern: dict, module: str, default):
+    """Per-module override from rank_pattern/alpha_pattern, matched the way peft matches them."""
+    for key, value in pattern.items():
+        if re.match(rf"(.*\.)?({key})$", module):
+            return value
+    return default
+
+
+def _load_adapter(adapter_path: str):
+    """Read an adapter into (pairs, replacements, fan_in_fan_out).
+
+    pairs maps base weight names to {"A", "B", "scale", "embedding"}; replacements maps
+    base weight names to full tensors saved with the adapter (modules_to_save, resized
+    embeddings). Raises ValueError for anything else, which a merge would silently drop."""
+    with open(os.path.join(adapter_path, "adapter_config.json")) as f:
+        config = json.load(f)
+    if config.get("use_dora"):
+        # DoRA rescales each merged column by its magnitude vector; W + scale * (B @ A) would be wrong
+        raise ValueError(f"{adapter_path} is a DoRA adapter; merge it with peft's merge_and_unload() instead")
+    st_path = os.path.join(adapter_path, "adapter_model.safetensors")
+    if os.path.exists(st_path):
+        weights = load_file(st_path)
+    else:
+        weights = torch.load(os.path.join(adapter_path, "adapter_model.bin"), map_location="cpu")
 
-    # Load tokenizer
-    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL)
+    # "base_model.model.<module>.lora_A.weight" -> {"<module>.weight": {"A": ..., "B": ...}}
+    pairs, replacements, unknown = {}, {}, []
+    for key, tensor in weights.items():
+        if "lora_magnitude_vector" in key:
+            raise ValueError(f"{adapter_path} has DoRA magnitude vectors ({key}); cannot merge it as plain LoRA")
+        match = re.match(r"base_model\.model\.(.+)\.lora_(embedding_)?([AB])(\.weight)?$", key)
+        if match:
+            module, embedding, part, _ = match.groups()
+            pair = pairs.setdefault(f"{module}.weight", {"module": module, "embedding": bool(embedding)})
+            pair[part] = tensor
+        elif key.startswith("base_model.model.") and "lora_" not in key:
+            # Saved whole: modules_to_save copies ("<module>.weight") and embeddings ("<module>.base_layer.weight")
+            name = key[len("base_model.model."):].replace(".modules_to_save.", ".").replace(".base_layer.", ".")
+            replacements[name] = tensor
+        else:
+            unknown.append(key)
+    if unknown:
+        raise ValueError(f"{adapter_path} has tensors that are neither LoRA A/B nor saved modules: "
+                         f"{unknown[:5]}{'...' if len(unknown) > 5 else ''}")
 
-    # Load and attach LoRA adapter
+    for name, pair in pairs.items():
+        if "A" not in pair or "B" not in pair:
+            raise ValueError(f"{adapter_path} has an incomplete LoRA pair for {name}")
+        module = pair.pop("module")
+        r = _pattern_value(config.get("rank_pattern") or {}, module, config["r"])
+        alpha = _pattern_value(config.get("alpha_pattern") or {}, module, config["lora_alpha"])
+        pair["scale"] = alpha / (math.sqrt(r) if config.get("use_rslora") else r)
+    return pairs, replacements, config.get("fan_in_fan_out", False)
+
+
+def _base_keys(base_dir: str, shards) -> dict:
+    keys = {}
+    for shard in shards:
+        with safe_open(os.path.join(base_dir, shard), framework="pt", device="cpu") as f:
+            for key in f.keys():
+                keys[key] = tuple(f.get_slice(key).get_shape())
+    return keys
+
+
+def merge_lora(base_model: str = BASE_MODEL, adapter_path: str = ADAPTER_PATH,
+               merged_model_path: str = MERGED_MODEL_PATH):
+    """Merge LoRA deltas into the base weights one shard at a time.
+
+    Each base shard is read tensor by tensor; targeted weights get W + scale * (B @ A)
+    (scale per module, from rank_pattern/alpha_pattern) computed in fp32 and cast back to the original dtype, and the shard is written
+    out before the next one is read. Peak memory is about one shard plus the adapter,
+    instead of the whole model in fp32."""
+    base_dir = _base_model_dir(base_model)
     print("🔹 Loading LoRA adapter...")
-    model = PeftModel.from_pretrained(base_model, ADAPTER_PATH)
+    pairs, replacements, fan_in_fan_out = _load_adapter(adapter_path)
+    scales = sorted({pair["scale"] for pair in pairs.values()})
+    print(f"🔹 {len(pairs)} LoRA-targeted weights (scale {', '.join(map(str, scales))}), "
+          f"{len(replacements)} saved modules")
+
+    shards = sorted(f for f in os.listdir(base_dir) if f.endswith(".safetensors"))
+    if not shards:
+        raise FileNotFoundError(f"No .safetensors shards in {base_dir}")
+    # Checked before writing anything, so a mismatched adapter never leaves a half-merged model
+    base_keys = _base_keys(base_dir, shards)
+    missing = sorted((set(pairs) | set(replacements)) - set(base_keys))
+    if missing:
+        raise ValueError(f"Adapter weights with no matching base tensor: {missing[:5]}"
+                         f"{'...' if len(missing) > 5 else ''}")
+    resized = sorted(k for k, t in replacements.items() if tuple(t.shape) != base_keys[k])
+    if resized:
+        raise ValueError(f"Saved modules do not match the base shapes (resized vocabulary?): {resized[:5]}")
+    os.makedirs(merged_model_path, exist_ok=True)
+
+    for shard in shards:
+        print(f"🔹 Merging shard {shard}...")
+        tensors = {}
+        with safe_open(os.path.join(base_dir, shard), framework="pt", device="cpu") as f:
+            metadata = f.metadata() or {"format": "pt"}
+            for key in f.keys():
+                tensor = f.get_tensor(key)
+                if key in replacements:
+                    tensor = replacements[key].to(tensor.dtype)
+                lora = pairs.get(key)
+                if lora is not None:
+                    delta = lora["B"].float() @ lora["A"].float()
+                    if fan_in_fan_out or lora["embedding"]:
+                        delta = delta.T
+                    tensor = (tensor.float() + lora["scale"] * delta).to(tensor.dtype)
+                tensors[key] = tensor.contiguous()
+        # Same file names as the base, so model.safetensors.index.json stays valid
+        save_file(tensors, os.path.join(merged_model_path, shard), metadata=metadata)
+        del tensors
+
+    for name in CONFIG_FILES + ["model.safetensors.index.json"]:
+        src = os.path.join(base_dir, name)
+        if os.path.exists(src):
+            shutil.copy(src, os.path.join(merged_model_path, name))
 
-    # Merge LoRA weights into base model
-    print("🔹 Merging LoRA weights into base model...")
-    model = model.merge_and_unload()
+    tokenizer = AutoTokenizer.from_pretrained(base_model)
+    tokenizer.save_pretrained(merged_model_path)
 
-    # Save final merged model
-    print(f"🔹 Saving merged model to {MERGED_MODEL_PATH}...")
-    model.save_pretrained(MERGED_MODEL_PATH)
-    tokenizer.save_pretrained(MERGED_MODEL_PATH)
+    print("✅ Merge complete! Merged model is ready at:", merged_model_path)
 
-    print("✅ Merge complete! Merged model is ready at:", MERGED_MODEL_PATH)
 
 if __name__ == "__main__":
     merge_lora()
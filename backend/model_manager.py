@@ -0,0 +1,96 @@
+# backend/model_manager.py
+import threading
+import time
+from contextlib import contextmanager
+from queue import Queue
+
+
+class PipelinePool:
+    """Loads a pipeline exactly once (per replica) and hands replicas out via checkout/checkin.
+
+    `loader` builds one pipeline; it is called `replicas` times under a load lock the
+    first time a pipeline is needed, so concurrent first requests wait for a
+    single load instead of each loading their own copy. The load lock is separate
+    from the one guarding the counters, so metrics() answers while a load runs."""
+
+    def __init__(self, loader, replicas: int = 1, warmup=None):
+        self.loader = loader
+        self.replicas = max(1, replicas)
+        self.warmup = warmup  # callable(pipeline) running one dummy inference
+        self._lock = threading.Lock()  # counters and _pipelines; never held while loading
+        self._load_lock = threading.Lock()
+        self._loading = False
+        self._available = Queue()
+        self._pipelines = []
+        self._in_use = 0
+        self._busy_seconds = 0.0
+        self._checkouts = 0
+        self._created_at = time.perf_counter()
+        self.load_seconds = None
+        self.warmup_seconds = None
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self._pipelines)
+
+    def load(self):
+        if self._pipelines:
+            return self._pipelines[0]
+        with self._load_lock:
+            if self._pipelines:
+                return self._pipelines[0]
+            self._loading = True
+            try:
+                start = time.perf_counter()
+                pipelines = [self.loader() for _ in range(self.replicas)]
+                self.load_seconds = round(time.perf_counter() - start, 3)
+                print(f"Loaded {self.replicas} pipeline replica(s) in {self.load_seconds}s")
+                if self.warmup is not None:
+                    start = time.perf_counter()
+                    for pipeline in pipelines:
+                        self.warmup(pipeline)
+                    self.warmup_seconds = round(time.perf_counter() - start, 3)
+                    print(f"Warmed up pipeline replica(s) in {self.warmup_seconds}s")
+            finally:
+                self._loading = False
+            for pipeline in pipelines:
+                self._available.put(pipeline)
+            with self._lock:
+                self._pipelines = pipelines
+            return pipelines[0]
+
+    def checkout(self, timeout: float = None):
+        self.load()
+        pipeline = self._available.get(timeout=timeout)
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+        return pipeline, time.perf_counter()
+
+    def checkin(self, pipeline, checked_out_at: float):
+        with self._lock:
+            self._in_use -= 1
+            self._busy_seconds += time.perf_counter() - checked_out_at
+        self._available.put(pipeline)
+
+    @contextmanager
+    def acquire(self, timeout: float = None):
+        pipeline, checked_out_at = self.checkout(timeout)
+        try:
+            yield pipeline
+        finally:
+            self.checkin(pipeline, checked_out_at)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            elapsed = time.perf_counter() - self._created_at
+            return {
+                "loaded": bool(self._pipelines),
+                "loading": self._loading,
+                "replicas": self.replicas,
+                "in_use": self._in_use,
+                "checkouts": self._checkouts,
+                "load_seconds": self.load_seconds,
+                "warmup_seconds": self.warmup_seconds,
+                "utilization": round(self._busy_seconds / (elapsed * self.replicas), 4) if elapsed else 0.0,
+            }
@@ -1,4 +1,20 @@
 # backend/model_registry.py
+
+# Hugging Face base checkpoints fine-tuned for each trainable registry entry
+BASE_MODELS = {
+    "1": "meta-llama/Llama-3.2-3B-Instruct",
+    "2": "meta-llama/Llama-3.1-8B-Instruct",
+    "3": "meta-llama/Llama-2-13b-chat-hf",
+    "4": "Qwen/Qwen2.5-32B-Instruct",
+}
+# Slugs used by the frontend builder (src/pages/Builder.tsx)
+BASE_MODELS.update({
+    "litebot-3b": BASE_MODELS["1"],
+    "midrange-7b": BASE_MODELS["2"],
+    "powerbot-13b": BASE_MODELS["3"],
+    "ultra-30b": BASE_MODELS["4"],
+})
+
 def list_models():
     return [
         {
@@ -72,3 +88,11 @@ def get_model(model_id: str):
         if model["id"] == model_id:
             return model
     return None
+
+
+def resolve_base_model(model_id: str):
+    """Registry id or builder slug -> Hugging Face repo id; None for anything else.
+
+    Client-supplied repo ids and local paths are not accepted, so /train and /chat
+    can only make a worker download or load the checkpoints listed here."""
+    return BASE_MODELS.get(str(model_id))
@@ -0,0 +1,125 @@
+# backend/pack_cache.py
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import torch
+
+SFT_TEMPLATE = "<s>[INST] {instruction}\n{input} [/INST]\n{output}</s>"
+CPT_TEMPLATE = "{text}"
+CACHE_DIR = "cache/packed"
+
+
+def _tokenizer_id(tokenizer) -> dict:
+    return {
+        "class": type(tokenizer).__name__,
+        "name_or_path": tokenizer.name_or_path,
+        "vocab_size": len(tokenizer),
+        "eos_token_id": tokenizer.eos_token_id,
+    }
+
+
+def _dataset_hash(ds) -> str:
+    # load_from_disk restores the fingerprint saved with the dataset, so it is stable across runs
+    fingerprint = getattr(ds, "_fingerprint", None)
+    if fingerprint:
+        return fingerprint
+    h = hashlib.sha256()
+    for f in ds.cache_files:
+        st = os.stat(f["filename"])
+        h.update(f"{f['filename']}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+def cache_key(ds, tokenizer, template: str, max_seq_length: int, add_eos: bool = False) -> str:
+    payload = json.dumps({
+        "dataset": _dataset_hash(ds),
+        "tokenizer": _tokenizer_id(tokenizer),
+        "template": template,
+        "max_seq_length": max_seq_length,
+        "add_eos": add_eos,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def build_packed(ds, tokenizer, template: str, max_seq_length: int, out_dir: str,
+                 batch_size: int = 1000, add_eos: bool = False) -> dict:
+    """Tokenize `ds` once and pack all tokens into fixed-length blocks.
+
+    Token ids are appended to a flat binary file batch by batch (bounded memory),
+    then exposed as a (num_blocks, max_seq_length) memory-mapped array. The tail
+    that does not fill a whole block is dropped, as with SFTTrainer packing."""
+    dtype = np.uint16 if len(tokenizer) < 2 ** 16 else np.uint32
+    # A private build directory per call: concurrent builds of the same key never share files
+    parent = os.path.dirname(os.path.abspath(out_dir))
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix=f".{os.path.basename(out_dir)}.", suffix=".tmp")
+    try:
+        total = 0
+        with open(os.path.join(tmp_dir, "tokens.bin"), "wb") as f:
+            for start in range(0, len(ds), batch_size):
+                batch = ds[start:start + batch_size]
+                rows = [dict(zip(batch, values)) for values in zip(*batch.values())]
+                texts = [template.format(**row) for row in rows]
+                ids = tokenizer(texts, add_special_tokens=False)["input_ids"]
+                if add_eos and tokenizer.eos_token_id is not None:
+                    ids = [seq + [tokenizer.eos_token_id] for seq in ids]
+                flat = np.fromiter((t for seq in ids for t in seq), dtype=dtype)
+                flat.tofile(f)
+                total += flat.size
+        num_blocks = total // max_seq_length
+        meta = {
+            "num_blocks": num_blocks,
+            "max_seq_length": max_seq_length,
+            "dtype": np.dtype(dtype).name,
+            "total_tokens": total,
+            "dropped_tokens": total - num_blocks * max_seq_length,
+            "num_examples": len(ds),
+        }
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+        if not os.path.exists(os.path.join(out_dir, "meta.json")):
+            shutil.rmtree(out_dir, ignore_errors=True)  # leftover without meta.json: incomplete
+        try:
+            os.replace(tmp_dir, out_dir)
+        except OSError:
+            # Another build of the same key finished first; its blocks are identical
+            if not os.path.exists(os.path.join(out_dir, "meta.json")):
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return meta
+
+
+class PackedDataset(torch.utils.data.Dataset):
+    """Memory-mapped blocks of `max_seq_length` tokens, ready for the causal LM Trainer."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        length = self.meta["num_blocks"] * self.meta["max_seq_length"]
+        tokens = np.memmap(os.path.join(path, "tokens.bin"), dtype=self.meta["dtype"], mode="r")
+        self.blocks = tokens[:length].reshape(self.meta["num_blocks"], self.meta["max_seq_length"])
+
+    def __len__(self):
+        return self.meta["num_blocks"]
+
+    def __getitem__(self, i):
+        input_ids = torch.from_numpy(self.blocks[i].astype(np.int64))
+        return {"input_ids": input_ids, "labels": input_ids.clone(), "attention_mask": torch.ones_like(input_ids)}
+
+
+def load_or_build(ds, tokenizer, template: str, max_seq_length: int, cache_dir: str = CACHE_DIR,
+                  add_eos: bool = False) -> PackedDataset:
+    key = cache_key(ds, tokenizer, template, max_seq_length, add_eos)
+    path = os.path.join(cache_dir, key)
+    if os.path.exists(os.path.join(path, "meta.json")):
+        print(f"Using packed dataset cache {path}")
+    else:
+        print(f"Tokenizing and packing dataset into {path}...")
+        os.makedirs(cache_dir, exist_ok=True)
+        meta = build_packed(ds, tokenizer, template, max_seq_length, path, add_eos=add_eos)
+        print(f"Packed {meta['total_tokens']} tokens into {meta['num_blocks']} blocks")
+    return PackedDataset(path)
@@ -0,0 +1,94 @@
+# backend/prefix_cache.py
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+
+
+def shared_prefix_length(a, b) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def prefix_key(namespace, token_ids) -> str:
+    h = hashlib.sha256((namespace or "").encode("utf-8") + b"\0")
+    h.update(array("q", token_ids).tobytes())
+    return h.hexdigest()
+
+
+def _nbytes(past) -> int:
+    return sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in past)
+
+
+class PrefixCache:
+    """LRU of prompt-prefix KV states keyed by a hash of their token ids.
+
+    `namespace` separates adapters: a LoRA on the attention projections changes
+    the keys/values, so the same tokens under another adapter are a different entry.
+    Entries are legacy (key, value) tuples covering exactly the hashed tokens; they
+    are never modified, since appending to a cache creates new tensors."""
+
+    def __init__(self, max_bytes: int, min_tokens: int = 16):
+        self.max_bytes = max_bytes
+        self.min_tokens = min_tokens  # shorter prefixes are cheaper to recompute than to look up
+        self._entries = OrderedDict()  # key -> (length, past, nbytes)
+        self._lengths = {}  # length -> number of entries, to know which prefixes to try
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "reused_tokens": 0, "stores": 0, "evictions": 0}
+
+    def lookup(self, namespace, token_ids):
+        """Longest cached prefix of `token_ids` (leaving at least one token to run): (length, past)."""
+        with self._lock:
+            lengths = sorted((n for n in self._lengths if n < len(token_ids)), reverse=True)
+        for n in lengths:
+            key = prefix_key(namespace, token_ids[:n])
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    self.stats["reused_tokens"] += n
+                    return n, entry[1]
+        with self._lock:
+            self.stats["misses"] += 1
+        return 0, None
+
+    def put(self, namespace, token_ids, past):
+        n = len(token_ids)
+        if n < self.min_tokens:
+            return
+        size = _nbytes(past)
+        if size > self.max_bytes:
+            return
+        key = prefix_key(namespace, token_ids)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = (n, past, size)
+            self._lengths[n] = self._lengths.get(n, 0) + 1
+            self._bytes += size
+            self.stats["stores"] += 1
+            while self._bytes > self.max_bytes:
+                _, (length, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._lengths[length] -= 1
+                if not self._lengths[length]:
+                    del self._lengths[length]
+                self.stats["evictions"] += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else None,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
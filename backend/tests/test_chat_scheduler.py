@@ -0,0 +1,134 @@
+# backend/tests/test_chat_scheduler.py
+import random
+import string
+import time
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+tokenizers = pytest.importorskip("tokenizers")
+
+from chat_engine import ChatEngine, RequestTooLargeError, _Resident
+from chat_scheduler import kv_bytes_per_token
+
+SYSTEM = {"role": "system", "content": "You are a terse assistant for tests."}
+
+
+def _tokenizer():
+    """One token per printable character, so any generated id decodes to text."""
+    chars = sorted(set(string.printable) - set("\x0b\x0c\r"))
+    vocab = {"<eos>": 0, "<unk>": 1, **{c: i + 2 for i, c in enumerate(chars)}}
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.Split(tokenizers.Regex("."), "isolated")
+    tokenizer.decoder = tokenizers.decoders.Fuse()
+    return transformers.PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<eos>", unk_token="<unk>",
+                                                pad_token="<eos>")
+
+
+def _model(arch):
+    torch.manual_seed(0)
+    if arch == "gpt2":
+        config = transformers.GPT2Config(n_layer=2, n_embd=64, n_head=4, vocab_size=99, n_positions=512,
+                                         eos_token_id=0, bos_token_id=0)
+        model = transformers.GPT2LMHeadModel(config)
+    else:
+        config = transformers.LlamaConfig(hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+                                          num_attention_heads=4, num_key_value_heads=2, vocab_size=99,
+                                          eos_token_id=0, bos_token_id=0, pad_token_id=0)
+        model = transformers.LlamaForCausalLM(config)
+    return model.eval()
+
+
+@pytest.fixture(params=["gpt2", "llama"])
+def engine(request):
+    resident = _Resident(_model(request.param), _tokenizer())
+    engine = ChatEngine(request.param, loader=lambda _: resident)
+    yield engine
+    if engine.scheduler is not None:
+        engine.scheduler.stop()
+
+
+def _conversation(rnd, i):
+    messages = [SYSTEM] if i % 3 else []
+    for turn in range(rnd.randint(0, 2) * 2 + 1):
+        words = " ".join(rnd.choice(["cats", "dogs", "why", "ok", "tell", "me"]) for _ in range(rnd.randint(1, 6)))
+        messages.append({"role": "user" if turn % 2 == 0 else "assistant", "content": f"{words} {i}"})
+    return messages
+
+
+def _reference(engine, messages, max_new_tokens):
+    """Sequential greedy generate() for one request, cut at EOS like the scheduler."""
+    model = engine.load().model
+    input_ids = torch.tensor([engine.encoder().prompt_ids(messages)])
+    with torch.no_grad():
+        output = model.generate(input_ids, attention_mask=torch.ones_like(input_ids), do_sample=False,
+                                max_new_tokens=max_new_tokens, min_new_tokens=max_new_tokens,
+                                eos_token_id=None, pad_token_id=0)
+    tokens = output[0, input_ids.shape[1]:].tolist()
+    if 0 in tokens:
+        tokens = tokens[:tokens.index(0) + 1]
+    return engine.load().tokenizer.decode(tokens, skip_special_tokens=True)
+
+
+def _collect(stream):
+    text = ""
+    while True:
+        kind, value = stream.events.get()
+        if kind == "token":
+            text += value
+        elif kind == "done":
+            return text
+        else:
+            raise value
+
+
+def _run_staggered(engine, requests):
+    rnd = random.Random(1)
+    streams = []
+    for messages, max_new_tokens in requests:
+        streams.append(engine.stream(messages, max_new_tokens=max_new_tokens, temperature=0))
+        time.sleep(rnd.random() * 0.01)  # join a batch that is already decoding
+    return [_collect(stream) for stream in streams]
+
+
+def test_batched_decode_matches_sequential_generate(engine):
+    engine.enable_batching(max_batch_size=4, kv_budget_bytes=10 ** 8)
+    rnd = random.Random(0)
+    requests = [(_conversation(rnd, i), rnd.randint(1, 24)) for i in range(10)]
+
+    texts = _run_staggered(engine, requests)
+
+    assert texts == [_reference(engine, messages, n) for messages, n in requests]
+    metrics = engine.scheduler.metrics()
+    assert metrics["finished"] == len(requests)
+    assert metrics["batch_occupancy"] > 1 / 4  # requests really shared decode steps
+    assert metrics["active_sequences"] == 0
+
+
+def test_prefix_cache_hits_match_sequential_generate(engine):
+    engine.enable_prefix_cache(max_bytes=10 ** 8, min_tokens=4, cache_full_prompts=True)
+    engine.enable_batching(max_batch_size=4, kv_budget_bytes=10 ** 8)
+    first = [SYSTEM, {"role": "user", "content": "tell me about cats"}]
+    reply = _run_staggered(engine, [(first, 8)])[0]
+    followup = first + [{"role": "assistant", "content": reply}, {"role": "user", "content": "and dogs?"}]
+    other = [SYSTEM, {"role": "user", "content": "why"}]
+
+    texts = _run_staggered(engine, [(followup, 8), (other, 8)])
+
+    assert texts == [_reference(engine, followup, 8), _reference(engine, other, 8)]
+    stats = engine.prefix_cache.metrics()
+    assert stats["hits"] == 2
+    prefill = engine.scheduler.metrics()["prefill_tokens"]
+    full = sum(len(engine.encoder().prompt_ids(m)) for m in (first, followup, other))
+    assert prefill == full - stats["reused_tokens"]
+
+
+def test_request_over_kv_budget_is_rejected(engine):
+    model = engine.load().model
+    engine.enable_batching(max_batch_size=2, kv_budget_bytes=40 * kv_bytes_per_token(model))
+    stream = engine.stream([{"role": "user", "content": "x" * 50}], max_new_tokens=4, temperature=0)
+    with pytest.raises(RequestTooLargeError):
+        _collect(stream)
+    assert _collect(engine.stream([{"role": "user", "content": "hi"}], max_new_tokens=4, temperature=0)) == \
+        _reference(engine, [{"role": "user", "content": "hi"}], 4)
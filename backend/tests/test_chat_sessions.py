@@ -0,0 +1,60 @@
+# backend/tests/test_chat_sessions.py
+import pytest
+
+from chat_sessions import SUMMARY, SessionNotFoundError, SessionStore
+
+
+def _encode(role, content):
+    return [ord(c) for c in f"{role}: {content}\n"]
+
+
+def _exchange(store, session, i, budget=10 ** 6):
+    user = store.turn("user", f"question {i}")
+    messages, message_ids = store.window(session, budget, "Be brief.", pending=user)
+    store.append(session, user, store.turn("assistant", f"answer {i}"))
+    return messages, message_ids
+
+
+def test_window_keeps_ids_alongside_messages():
+    store = SessionStore(_encode)
+    session = store.create("bot")
+    _exchange(store, session, 0)
+
+    messages, message_ids = _exchange(store, session, 1)
+
+    assert [m["role"] for m in messages] == ["system", "user", "assistant", "user"]
+    assert message_ids[0] is None
+    assert [list(ids) for ids in message_ids[1:]] == [_encode(m["role"], m["content"]) for m in messages[1:]]
+
+
+def test_trimming_drops_oldest_turns_down_to_low_water():
+    store = SessionStore(_encode, low_water=0.5, policy=SUMMARY)
+    session = store.create("bot")
+    for i in range(10):
+        _exchange(store, session, i)
+    budget = session.tokens
+
+    messages, _ = _exchange(store, session, 10, budget=budget)
+
+    assert session.tokens <= budget  # trimmed once, with room left for the next turns
+    assert messages[0]["content"].startswith("Be brief.\n\nEarlier in this conversation:\nuser: question 0")
+    assert store.metrics()["trimmed_turns"] > 0
+
+
+def test_evicted_session_does_not_skew_the_byte_total():
+    store = SessionStore(_encode)
+    old, new = store.create("bot"), store.create("bot")
+    for i in range(3):
+        _exchange(store, old, i)
+    store.max_bytes = old.bytes + 1
+    for i in range(3):
+        _exchange(store, new, i)  # pushes `old` out
+    assert store.metrics()["evicted"] == 1
+    with pytest.raises(SessionNotFoundError):
+        store.get(old.id)
+
+    # A request that was already holding the evicted session still trims and appends to it
+    _exchange(store, old, 3, budget=10)
+
+    assert store.metrics()["bytes"] == new.bytes == sum(
+        len(t["content"].encode()) + t["ids"].itemsize * len(t["ids"]) for t in new.turns)
@@ -0,0 +1,170 @@
+# backend/tests/test_elevenlabs_client.py
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("httpx")
+fastapi = pytest.importorskip("fastapi")
+uvicorn = pytest.importorskip("uvicorn")
+
+from elevenlabs_client import ElevenLabsClient, ElevenLabsError
+
+
+class StandIn:
+    """Local stand-in for the ElevenLabs API. `failures` holds (status, headers) replies
+    to give before succeeding; `gate` holds a TTS stream open after its first chunk."""
+
+    def __init__(self):
+        self.failures = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.client_ports = set()
+        self.requests = 0
+        self.app = fastapi.FastAPI()
+        self.app.get("/v1/voices")(self.voices)
+        self.app.post("/v1/text-to-speech/{voice_id}/stream")(self.tts)
+
+    def _failure(self, request):
+        self.requests += 1
+        self.client_ports.add(request.client.port)
+        if request.headers.get("xi-api-key") != "test-key":
+            return fastapi.responses.JSONResponse({"detail": {"message": "bad key"}}, status_code=401)
+        if self.failures:
+            status, headers = self.failures.pop(0)
+            return fastapi.responses.JSONResponse({"detail": "try later"}, status_code=status, headers=headers)
+        return None
+
+    async def voices(self, request: fastapi.Request):
+        return self._failure(request) or {"voices": [{"voice_id": "v1"}]}
+
+    async def tts(self, voice_id: str, request: fastapi.Request):
+        failure = self._failure(request)
+        if failure is not None:
+            return failure
+        body = await request.json()
+
+        async def audio():
+            yield f"{voice_id}:".encode()
+            await asyncio.to_thread(self.gate.wait, 5)
+            for word in body["text"].split():
+                yield word.encode()
+
+        return fastapi.responses.StreamingResponse(audio(), media_type="audio/mpeg")
+
+
+@pytest.fixture
+def server():
+    stand_in = StandIn()
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    config = uvicorn.Config(stand_in.app, log_level="warning", lifespan="off")
+    uv = uvicorn.Server(config)
+    thread = threading.Thread(target=uv.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    deadline = time.time() + 10
+    while not uv.started and time.time() < deadline:
+        time.sleep(0.01)
+    stand_in.base_url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+    yield stand_in
+    stand_in.gate.set()
+    uv.should_exit = True
+    thread.join(5)
+
+
+def _client(server, **kwargs):
+    return ElevenLabsClient("test-key", base_url=server.base_url, backoff=0.01, **kwargs)
+
+
+async def _collect(client, text="hello there world", voice_id="v1"):
+    return b"".join([chunk async for chunk in client.stream_tts(text, voice_id)])
+
+
+def test_requests_reuse_one_connection(server):
+    async def main():
+        client = _client(server)
+        try:
+            for _ in range(5):
+                assert await client.get_voices() == {"voices": [{"voice_id": "v1"}]}
+            assert await _collect(client) == b"v1:hellothereworld"
+        finally:
+            await client.aclose()
+        return client
+
+    client = asyncio.run(main())
+    assert server.requests == 6
+    assert len(server.client_ports) == 1  # keep-alive, not a new TCP connection per call
+    assert client.metrics()["bytes_streamed"] == len(b"v1:hellothereworld")
+
+
+def test_retries_transient_errors_then_succeeds(server):
+    server.failures = [(503, {}), (429, {"Retry-After": "0"})]
+
+    async def main():
+        client = _client(server)
+        try:
+            return await _collect(client), client.metrics()
+        finally:
+            await client.aclose()
+
+    audio, metrics = asyncio.run(main())
+    assert audio == b"v1:hellothereworld"
+    assert metrics["retries"] == 2 and metrics["errors"] == 0
+
+
+def test_long_retry_after_fails_at_once(server):
+    server.failures = [(429, {"Retry-After": "3600"})]
+
+    async def main():
+        client = _client(server, timeout=5)
+        try:
+            started = time.perf_counter()
+            with pytest.raises(ElevenLabsError) as info:
+                await asyncio.wait_for(client.get_voices(), 5)
+            return info.value, time.perf_counter() - started, client.metrics()
+        finally:
+            await client.aclose()
+
+    error, elapsed, metrics = asyncio.run(main())
+    assert error.status_code == 429 and "3600" in error.detail
+    assert elapsed < 2
+    assert metrics["retries"] == 0 and metrics["errors"] == 1
+
+
+def test_client_errors_are_not_retried(server):
+    async def main():
+        client = ElevenLabsClient("wrong-key", base_url=server.base_url, backoff=0.01)
+        try:
+            with pytest.raises(ElevenLabsError) as info:
+                await _collect(client)
+            return info.value
+        finally:
+            await client.aclose()
+
+    error = asyncio.run(main())
+    assert (error.status_code, error.detail) == (401, "bad key")
+    assert server.requests == 1
+
+
+def test_stream_yields_before_synthesis_finishes_and_frees_its_slot(server):
+    server.gate.clear()
+
+    async def main():
+        client = _client(server, max_concurrency=1)
+        try:
+            stream = client.stream_tts("slow reader", "v1")
+            first = await asyncio.wait_for(stream.__anext__(), 5)  # the rest is still held by the server
+            # The open stream does not hold the only request slot
+            voices = await asyncio.wait_for(client.get_voices(), 5)
+            server.gate.set()
+            rest = b"".join([chunk async for chunk in stream])
+            return first, voices, rest
+        finally:
+            await client.aclose()
+
+    first, voices, rest = asyncio.run(main())
+    assert first == b"v1:"
+    assert voices["voices"][0]["voice_id"] == "v1"
+    assert rest == b"slowreader"
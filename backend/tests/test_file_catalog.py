@@ -0,0 +1,48 @@
+# backend/tests/test_file_catalog.py
+import os
+
+import pytest
+
+sqlalchemy = pytest.importorskip("sqlalchemy")
+
+from file_catalog import FileCatalog
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'files.db'}")
+    return FileCatalog(lambda: engine)
+
+
+def _write(tmp_path, name):
+    path = str(tmp_path / name)
+    with open(path, "wb") as f:
+        f.write(b"data")
+    return path
+
+
+def test_remove_with_kind_leaves_other_kinds_alone(catalog, tmp_path):
+    export = catalog.add("export", _write(tmp_path, "job.zip"), file_id="job")
+    upload = catalog.add("upload", _write(tmp_path, "a.csv"))
+
+    assert catalog.remove("job", kind="upload") is None
+    assert os.path.exists(export["path"]) and catalog.get("job") is not None
+    assert catalog.remove(upload["file_id"], kind="upload")["kind"] == "upload"
+    assert not os.path.exists(upload["path"])
+
+
+def test_expired_entries_are_collected_and_hooks_run(catalog, tmp_path):
+    expired = catalog.add("automl_model", _write(tmp_path, "model.joblib"), file_id="m1", ttl=1)
+    kept = catalog.add("chart", _write(tmp_path, "chart.png"), ttl=3600)
+    catalog.add("upload", _write(tmp_path, "b.csv"))  # no TTL: never expires
+    seen = []
+    catalog.on_expire("automl_model", seen.append)
+
+    with catalog._engine().begin() as conn:
+        conn.execute(sqlalchemy.text("UPDATE files SET expires_at = 0 WHERE file_id = 'm1'"))
+    removed = catalog.collect_garbage()
+
+    assert removed["expired"] == 1
+    assert [record["file_id"] for record in seen] == ["m1"]
+    assert not os.path.exists(expired["path"]) and catalog.get("m1") is None
+    assert catalog.get(kept["file_id"]) is not None
@@ -0,0 +1,56 @@
+# backend/tests/test_file_store.py
+import asyncio
+import io
+import os
+
+import pytest
+
+import file_store
+from file_store import UploadTooLargeError, save_upload
+
+
+class StandInUpload:
+    """The part of fastapi.UploadFile that save_upload reads."""
+
+    def __init__(self, filename, data):
+        self.filename = filename
+        self._body = io.BytesIO(data)
+
+    async def read(self, size):
+        return self._body.read(size)
+
+
+def _save(tmp_path, data, name="a.txt", max_bytes=1024):
+    upload = StandInUpload(name, data)
+    return asyncio.run(save_upload(upload, str(tmp_path), str(tmp_path / "blobs"), max_bytes, chunk_size=4))
+
+
+def test_identical_uploads_share_one_blob(tmp_path):
+    first = _save(tmp_path, b"same bytes")
+    second = _save(tmp_path, b"same bytes", name="b.txt")
+
+    assert (first["deduplicated"], second["deduplicated"]) == (False, True)
+    assert first["blob_path"] == second["blob_path"]
+    assert os.stat(first["blob_path"]).st_nlink == 3  # the blob plus one path per upload
+    assert [name for name in os.listdir(tmp_path / "blobs" / first["sha256"][:2])] == [first["sha256"]]
+
+
+def test_oversized_upload_leaves_nothing_behind(tmp_path):
+    with pytest.raises(UploadTooLargeError):
+        _save(tmp_path, b"x" * 20, max_bytes=10)
+
+    assert os.listdir(tmp_path / "blobs") == []
+    assert [name for name in os.listdir(tmp_path) if name != "blobs"] == []
+
+
+def test_failed_hard_link_is_refused_not_copied(tmp_path, monkeypatch):
+    def no_links(src, dst):
+        if os.path.exists(src):
+            raise OSError(18, "Invalid cross-device link")
+        raise FileNotFoundError(src)
+
+    monkeypatch.setattr(file_store.os, "link", no_links)
+
+    with pytest.raises(OSError, match="one filesystem"):
+        _save(tmp_path, b"data")
+    assert [name for name in os.listdir(tmp_path) if name != "blobs"] == []
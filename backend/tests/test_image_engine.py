@@ -0,0 +1,122 @@
+# backend/tests/test_image_engine.py
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from image_engine import ImageBatchScheduler, QueueFullError
+from model_manager import PipelinePool
+
+
+class StandInPipeline:
+    """diffusers-style callable: returns one "image" (its prompt) per prompt, after `num_inference_steps` callbacks."""
+
+    def __init__(self, gate=None, fail=False):
+        self.calls = []
+        self.gate = gate
+        self.fail = fail
+        self.started = threading.Event()
+
+    def __call__(self, prompt, num_inference_steps, width, height, callback, callback_steps, **kwargs):
+        self.calls.append((list(prompt), num_inference_steps, width, height))
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.fail:
+            raise RuntimeError("out of memory")
+        for step in range(num_inference_steps):
+            callback(step, None, None)
+        return SimpleNamespace(images=[f"{p}@{width}x{height}" for p in prompt])
+
+
+def _scheduler(pipeline, **kwargs):
+    return ImageBatchScheduler(PipelinePool(lambda: pipeline), **kwargs)
+
+
+def _events(job):
+    events = []
+    while not events or events[-1][0] not in ("done", "error"):
+        events.append(job.events.get())
+    return events
+
+
+def test_same_shape_jobs_share_one_pipeline_call():
+    gate = threading.Event()
+    pipeline = StandInPipeline(gate)
+    scheduler = _scheduler(pipeline, max_batch_size=3, batch_wait=0).start()
+    try:
+        first = scheduler.submit("warmup", num_steps=2)
+        pipeline.started.wait(5)
+        # Queued while the first batch runs, so they are collected together
+        jobs = [scheduler.submit(f"cat {i}", num_steps=4) for i in range(4)]
+        odd = scheduler.submit("wide", num_steps=4, width=768)
+        gate.set()
+        results = {job.prompt: _events(job) for job in [first, *jobs, odd]}
+    finally:
+        scheduler.stop()
+
+    assert [call[0] for call in pipeline.calls] == [["warmup"], ["cat 0", "cat 1", "cat 2"], ["cat 3"], ["wide"]]
+    for job in jobs:
+        events = results[job.prompt]
+        assert events[0][0] == "queue"
+        assert [pct for kind, pct in events if kind == "progress"] == [0, 25, 50, 75]
+        assert events[-1] == ("done", f"{job.prompt}@512x512")
+    assert results["wide"][-1] == ("done", "wide@768x512")
+    assert scheduler.metrics()["images"] == 6
+
+
+def test_queue_is_bounded_and_reports_positions():
+    gate = threading.Event()
+    pipeline = StandInPipeline(gate)
+    scheduler = _scheduler(pipeline, max_batch_size=1, max_queue=2, batch_wait=0).start()
+    try:
+        running = scheduler.submit("running", num_steps=1)
+        pipeline.started.wait(5)
+        queued = [scheduler.submit(f"queued {i}", num_steps=1) for i in range(2)]
+        assert [job.events.get() for job in queued] == [("queue", 1), ("queue", 2)]
+        with pytest.raises(QueueFullError):
+            scheduler.submit("one too many", num_steps=1)
+        assert scheduler.metrics()["rejected"] == 1
+        gate.set()
+        events = _events(queued[1])
+        assert ("queue", 1) in events  # moved up once "queued 0" started
+        assert events[-1] == ("done", "queued 1@512x512")
+        assert _events(queued[0])[-1] == ("done", "queued 0@512x512")
+        assert _events(running)[-1][0] == "done"
+    finally:
+        gate.set()
+        scheduler.stop()
+
+
+def test_cancelled_job_leaves_the_queue():
+    gate = threading.Event()
+    pipeline = StandInPipeline(gate)
+    scheduler = _scheduler(pipeline, max_batch_size=4, batch_wait=0).start()
+    try:
+        scheduler.submit("running", num_steps=1)
+        pipeline.started.wait(5)
+        kept, dropped = scheduler.submit("kept", num_steps=1), scheduler.submit("dropped", num_steps=1)
+        scheduler.cancel(dropped)
+        assert scheduler.queue_depth() == 1
+        gate.set()
+        assert _events(kept)[-1][0] == "done"
+    finally:
+        gate.set()
+        scheduler.stop()
+    assert all("dropped" not in call[0] for call in pipeline.calls)
+
+
+def test_pipeline_error_reaches_every_job_in_the_batch():
+    gate = threading.Event()
+    pipeline = StandInPipeline(gate, fail=True)
+    scheduler = _scheduler(pipeline, max_batch_size=4, batch_wait=0).start()
+    try:
+        first = scheduler.submit("a", num_steps=1)
+        pipeline.started.wait(5)
+        rest = [scheduler.submit(p, num_steps=1) for p in ("b", "c")]
+        gate.set()
+        for job in [first, *rest]:
+            assert _events(job)[-1] == ("error", "out of memory")
+    finally:
+        scheduler.stop()
+    assert scheduler.metrics()["batches"] == 2
@@ -0,0 +1,55 @@
+# backend/tests/test_ingest.py
+import pytest
+
+fitz = pytest.importorskip("fitz")
+pytest.importorskip("pandas")
+
+from ingest import _bounded, ingest_pdfs, iter_pdf_pages, iter_pdf_pages_parallel
+
+
+def _pdf(tmp_path, name, pages):
+    doc = fitz.open()
+    for i in range(pages):
+        doc.new_page().insert_text((72, 72), f"{name} page {i}")
+    path = str(tmp_path / name)
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def test_bounded_keeps_a_fixed_window_in_flight():
+    submitted, ahead = [], []
+
+    def tasks():
+        for i in range(20):
+            yield i
+
+    for task, result in _bounded(tasks(), lambda t: submitted.append(t) or t * 10, 4):
+        assert result == task * 10
+        ahead.append(len(submitted) - task)
+
+    assert submitted == list(range(20))
+    assert max(ahead) == 4
+
+
+def test_parallel_pages_match_serial_across_documents(tmp_path):
+    paths = [_pdf(tmp_path, "big.pdf", 21), _pdf(tmp_path, "small.pdf", 2)]
+
+    pages = list(iter_pdf_pages_parallel(paths, max_workers=2, pages_per_task=4))
+
+    assert pages == [page for path in paths for page in iter_pdf_pages(path)]
+    assert pages[0] == "big.pdf page 0" and pages[-1] == "small.pdf page 1"
+
+
+def test_ingest_reports_each_document_in_input_order(tmp_path):
+    broken = tmp_path / "broken.pdf"
+    broken.write_bytes(b"not a pdf")
+    paths = [_pdf(tmp_path, "a.pdf", 9), str(broken), _pdf(tmp_path, "b.pdf", 1)]
+
+    results = list(ingest_pdfs(paths, max_workers=2, pages_per_task=2))
+
+    assert [path for path, _, _ in results] == paths
+    (_, a_pages, a_metrics), (_, broken_pages, broken_metrics), (_, b_pages, _) = results
+    assert a_pages == [f"a.pdf page {i}" for i in range(9)] and a_metrics["pages"] == 9
+    assert broken_pages == [] and "error" in broken_metrics
+    assert b_pages == ["b.pdf page 0"]
@@ -0,0 +1,80 @@
+# backend/tests/test_merge_lora.py
+import json
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+peft = pytest.importorskip("peft")
+tokenizers = pytest.importorskip("tokenizers")
+
+from merge_lora import merge_lora
+
+
+def _base_model(path):
+    torch.manual_seed(0)
+    config = transformers.LlamaConfig(hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                                      num_attention_heads=4, num_key_value_heads=2, vocab_size=64,
+                                      tie_word_embeddings=False)
+    model = transformers.LlamaForCausalLM(config)
+    model.save_pretrained(path, max_shard_size="20KB")
+    vocab = {"<unk>": 0, **{f"t{i}": i + 1 for i in range(63)}}
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="<unk>"))
+    transformers.PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="<unk>").save_pretrained(path)
+    return model
+
+
+def _adapter(base, path, **config):
+    torch.manual_seed(1)
+    model = peft.get_peft_model(base, peft.LoraConfig(init_lora_weights=False, **config))
+    for name, param in model.named_parameters():
+        if "modules_to_save" in name:
+            param.data.normal_()
+    model.save_pretrained(path)
+    return model.merge_and_unload().state_dict()
+
+
+@pytest.mark.parametrize("config", [
+    {"r": 4, "lora_alpha": 8, "target_modules": ["q_proj", "v_proj"], "rank_pattern": {"v_proj": 2}},
+    {"r": 4, "lora_alpha": 8, "target_modules": ["q_proj", "v_proj", "o_proj"],
+     "alpha_pattern": {"layers.1.self_attn.o_proj": 32}, "modules_to_save": ["lm_head"]},
+    {"r": 8, "lora_alpha": 16, "target_modules": ["v_proj", "embed_tokens"], "use_rslora": True},
+])
+def test_merge_matches_peft(tmp_path, config):
+    base = _base_model(tmp_path / "base")
+    assert len([f for f in os.listdir(tmp_path / "base") if f.endswith(".safetensors")]) > 1
+    expected = _adapter(base, tmp_path / "adapter", **config)
+
+    merge_lora(str(tmp_path / "base"), str(tmp_path / "adapter"), str(tmp_path / "merged"))
+
+    merged = transformers.LlamaForCausalLM.from_pretrained(tmp_path / "merged").state_dict()
+    assert merged.keys() == expected.keys()
+    for key, tensor in expected.items():
+        torch.testing.assert_close(merged[key], tensor, msg=key)
+
+
+def test_unknown_adapter_tensors_are_refused(tmp_path):
+    base = _base_model(tmp_path / "base")
+    _adapter(base, tmp_path / "adapter", r=4, lora_alpha=8, target_modules=["q_proj"])
+    from safetensors.torch import load_file, save_file
+    st_path = tmp_path / "adapter" / "adapter_model.safetensors"
+    weights = load_file(st_path)
+    weights["base_model.model.score.lora_A.weight"] = torch.zeros(4, 32)
+    weights["base_model.model.score.lora_B.weight"] = torch.zeros(2, 4)
+    save_file(weights, st_path)
+
+    with pytest.raises(ValueError, match="no matching base tensor"):
+        merge_lora(str(tmp_path / "base"), str(tmp_path / "adapter"), str(tmp_path / "merged"))
+    assert not (tmp_path / "merged").exists()
+
+
+def test_dora_is_refused(tmp_path):
+    base = _base_model(tmp_path / "base")
+    _adapter(base, tmp_path / "adapter", r=4, lora_alpha=8, target_modules=["q_proj"])
+    config_path = tmp_path / "adapter" / "adapter_config.json"
+    config = json.loads(config_path.read_text())
+    config_path.write_text(json.dumps({**config, "use_dora": True}))
+
+    with pytest.raises(ValueError, match="DoRA"):
+        merge_lora(str(tmp_path / "base"), str(tmp_path / "adapter"), str(tmp_path / "merged"))
@@ -0,0 +1,15 @@
+# backend/tests/test_model_registry.py
+import pytest
+
+from model_registry import BASE_MODELS, resolve_base_model
+
+
+@pytest.mark.parametrize("model_id", ["2", 2, "midrange-7b"])
+def test_registry_ids_and_slugs_resolve(model_id):
+    assert resolve_base_model(model_id) == BASE_MODELS["2"]
+
+
+@pytest.mark.parametrize("model_id", ["meta-llama/Llama-3.1-8B-Instruct", "evil/model", "/srv/models/llama",
+                                      "../uploads", "7", ""])
+def test_other_ids_are_refused(model_id):
+    assert resolve_base_model(model_id) is None
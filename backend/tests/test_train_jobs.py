@@ -0,0 +1,90 @@
+# backend/tests/test_train_jobs.py
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import train_jobs
+from train_jobs import CANCELLED, FAILED, QUEUED, RUNNING, JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"))
+
+
+def _age_heartbeat(queue, job_id, seconds):
+    conn = sqlite3.connect(queue.db_path)
+    conn.execute("UPDATE train_jobs SET heartbeat_at = ? WHERE job_id = ?", (time.time() - seconds, job_id))
+    conn.commit()
+    conn.close()
+
+
+def test_jobs_are_claimed_oldest_first(queue):
+    ids = [queue.enqueue({"n": i}) for i in range(3)]
+
+    claimed = [queue.claim("w1")["job_id"] for _ in range(3)]
+
+    assert claimed == ids
+    assert queue.claim("w1") is None
+    job = queue.get(ids[0])
+    assert (job["status"], job["worker_id"], job["attempts"]) == (RUNNING, "w1", 1)
+    assert job["params"] == {"n": 0}
+
+
+def test_concurrent_workers_never_claim_the_same_job(queue):
+    ids = {queue.enqueue({"n": i}) for i in range(40)}
+    claims, lock = [], threading.Lock()
+
+    def work(worker_id):
+        while True:
+            job = queue.claim(worker_id)
+            if job is None:
+                return
+            with lock:
+                claims.append(job["job_id"])
+
+    workers = [threading.Thread(target=work, args=(f"w{i}",)) for i in range(6)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert sorted(claims) == sorted(ids)
+
+
+def test_job_without_heartbeat_is_reclaimed(queue):
+    job_id = queue.enqueue({})
+    started_at = queue.claim("dead-worker")["started_at"]
+
+    queue.heartbeat(job_id, {"step": 3})
+    assert queue.claim("w2") is None  # fresh heartbeat: still owned
+
+    _age_heartbeat(queue, job_id, train_jobs.STALE_AFTER + 1)
+    job = queue.claim("w2")
+
+    assert job["job_id"] == job_id
+    assert (job["worker_id"], job["attempts"]) == ("w2", 2)
+    assert job["started_at"] == started_at
+    assert job["progress"] == {"step": 3}
+
+
+def test_cancel_and_resume(queue):
+    failed, running = queue.enqueue({}), queue.enqueue({})
+    queue.claim("w1")
+    queue.claim("w1")
+    queue.finish(failed, FAILED, "boom")
+    waiting = queue.enqueue({})
+
+    assert queue.request_cancel(waiting)
+    assert queue.get(waiting)["status"] == CANCELLED  # never started: cancelled at once
+    assert queue.request_cancel(running)
+    assert queue.get(running)["status"] == RUNNING and queue.cancel_requested(running)
+    assert not queue.request_cancel(failed)  # already finished
+
+    assert queue.resume(failed)
+    job = queue.get(failed)
+    assert (job["status"], job["error"], job["cancel_requested"]) == (QUEUED, None, False)
+    assert not queue.resume(running)
+    assert queue.claim("w2")["job_id"] == failed
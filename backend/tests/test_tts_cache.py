@@ -0,0 +1,113 @@
+# backend/tests/test_tts_cache.py
+import asyncio
+import os
+
+import pytest
+
+from tts_cache import TTSCache, tts_cache_key
+
+
+def _producer(chunks, started=None, release=None, fail_after=None):
+    calls = []
+
+    def produce():
+        calls.append(1)
+
+        async def stream():
+            for i, chunk in enumerate(chunks):
+                if i == fail_after:
+                    raise RuntimeError("upstream dropped")
+                yield chunk
+                if i == 0 and release is not None:
+                    started.set()
+                    await release.wait()
+
+        return stream()
+
+    return produce, calls
+
+
+def test_concurrent_requests_share_one_synthesis(tmp_path):
+    cache = TTSCache(str(tmp_path))
+    key = tts_cache_key("hello", "v1", "en", "m", {})
+
+    async def main():
+        started, release = asyncio.Event(), asyncio.Event()
+        produce, calls = _producer([b"a", b"b", b"c"], started, release)
+        heard = [[] for _ in range(3)]
+
+        async def listen(i):
+            async def on_chunk(chunk):
+                heard[i].append(chunk)
+            return await cache.get_or_create(key, produce, on_chunk)
+
+        first = asyncio.ensure_future(listen(0))
+        await started.wait()  # the first chunk is out; later listeners join mid-stream
+        late = [asyncio.ensure_future(listen(i)) for i in (1, 2)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(first, *late)
+        hit = await listen(0)
+        return results, hit, heard, calls
+
+    results, hit, heard, calls = asyncio.run(main())
+    assert len(calls) == 1
+    assert [cached for _, cached in results] == [False, True, True]
+    assert len({path for path, _ in results}) == 1
+    assert heard[1] == heard[2] == [b"a", b"b", b"c"]  # late joiners still get the chunks they missed
+    assert heard[0] == [b"a", b"b", b"c", b"abc"]  # then replayed from disk on the hit
+    assert hit == (results[0][0], True)
+    with open(results[0][0], "rb") as f:
+        assert f.read() == b"abc"
+    assert cache.metrics()["hits"] == 1 and cache.metrics()["shared"] == 2 and cache.metrics()["misses"] == 1
+
+
+def test_failed_synthesis_is_not_cached_and_reaches_every_listener(tmp_path):
+    cache = TTSCache(str(tmp_path))
+    key = tts_cache_key("boom", "v1", "en", "m", {})
+
+    async def main():
+        produce, calls = _producer([b"a", b"b"], fail_after=1)
+        results = await asyncio.gather(*[cache.get_or_create(key, produce) for _ in range(2)],
+                                       return_exceptions=True)
+        return results, calls
+
+    results, calls = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert cache.get(key) is None
+    assert os.listdir(tmp_path) == []  # no .part file left behind
+
+
+def test_a_failing_listener_does_not_stop_the_synthesis(tmp_path):
+    cache = TTSCache(str(tmp_path))
+    key = tts_cache_key("bye", "v1", "en", "m", {})
+
+    async def main():
+        produce, calls = _producer([b"a", b"b"])
+
+        async def disconnect(chunk):
+            raise ConnectionError("socket closed")
+
+        with pytest.raises(ConnectionError):
+            await cache.get_or_create(key, produce, disconnect)
+        path, _ = await cache.get_or_create(key, produce)  # joins (or hits) the synthesis that kept going
+        return path, calls
+
+    path, calls = asyncio.run(main())
+    assert len(calls) == 1
+    with open(path, "rb") as f:
+        assert f.read() == b"ab"
+
+
+def test_index_is_rebuilt_and_evicts_to_budget(tmp_path):
+    for name, size in (("old", 6), ("new", 6)):
+        with open(tmp_path / f"{name}.mp3", "wb") as f:
+            f.write(b"x" * size)
+        os.utime(tmp_path / f"{name}.mp3", (1, 1 if name == "old" else 2))
+    (tmp_path / ".k.123.part").write_bytes(b"half")
+
+    cache = TTSCache(str(tmp_path), max_bytes=10)
+
+    assert cache.get("old") is None and cache.get("new") is not None
+    assert sorted(os.listdir(tmp_path)) == ["new.mp3"]
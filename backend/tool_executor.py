@@ -0,0 +1,233 @@
+# backend/tool_executor.py
+import asyncio
+import multiprocessing as mp
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ToolTimeoutError(Exception):
+    pass
+
+
+class ToolBusyError(Exception):
+    pass
+
+
+def _worker_main(conn):
+    """Child process loop: run (fn, args) calls until the pipe closes."""
+    while True:
+        try:
+            call = conn.recv()
+        except (EOFError, OSError):
+            return
+        if call is None:
+            return
+        fn, args, kwargs = call
+        try:
+            conn.send((True, fn(*args, **kwargs)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), name="tool-worker", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def run(self, fn, args, kwargs, timeout):
+        """Blocking: send one call and wait for its result; None on timeout."""
+        self.tasks += 1
+        try:
+            self.conn.send((fn, args, kwargs))
+            if not self.conn.poll(timeout):
+                return None
+            return self.conn.recv()
+        except (EOFError, OSError):
+            return False, f"Tool worker exited with code {self.process.exitcode}"
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.kill()
+
+
+class ToolExecutor:
+    """Runs blocking tools off the event loop.
+
+    CPU-heavy tools go to a bounded set of persistent worker processes (so a model
+    fit cannot hold the GIL of the server process); I/O-bound ones go to a thread
+    pool. Each tool has its own concurrency limit and queue bound, and calls that
+    exceed their timeout have their worker process killed and replaced. Thread tools
+    cannot be killed, so their timeout only stops the wait. Tools run in processes
+    must be module-level functions of a module workers can import on their own, like
+    tools.py (they are sent to the worker by reference). Under `uvicorn app:app`
+    workers never import app.py; started as `python app.py`, multiprocessing also
+    imports the script in each worker, as with any spawned process."""
+
+    def __init__(self, process_workers: int = 2, thread_workers: int = 8, max_tasks_per_worker: int = 100,
+                 limits: dict = None, default_limit: int = 2, max_queue: int = 16):
+        self.process_workers = max(1, process_workers)
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.limits = limits or {}
+        self.default_limit = default_limit
+        self.max_queue = max_queue
+        # Not fork: a forked worker would inherit the server's threads, locks and loaded
+        # models. The fork server imports tools.py once and forks fresh workers from it.
+        if "forkserver" in mp.get_all_start_methods():
+            self._ctx = mp.get_context("forkserver")
+            self._ctx.set_forkserver_preload(["tools"])
+        else:
+            self._ctx = mp.get_context("spawn")
+        self._threads = ThreadPoolExecutor(max_workers=thread_workers, thread_name_prefix="tool-io")
+        # Threads that wait on worker pipes, one per process slot
+        self._waiters = ThreadPoolExecutor(max_workers=self.process_workers, thread_name_prefix="tool-wait")
+        self._idle = []
+        self._lock = threading.Lock()
+        self._process_slots = None
+        self._tool_slots = {}
+        self._stats = {}
+
+    def _tool_stats(self, tool: str) -> dict:
+        stats = self._stats.get(tool)
+        if stats is None:
+            stats = self._stats[tool] = {"submitted": 0, "completed": 0, "failed": 0, "timed_out": 0,
+                                         "rejected": 0, "queued": 0, "running": 0,
+                                         "queue_seconds": 0.0, "max_queue_seconds": 0.0,
+                                         "run_seconds": 0.0, "max_run_seconds": 0.0}
+        return stats
+
+    def _slots(self, tool: str):
+        # Created lazily so they bind to the running event loop
+        if self._process_slots is None:
+            self._process_slots = asyncio.Semaphore(self.process_workers)
+        if tool not in self._tool_slots:
+            self._tool_slots[tool] = asyncio.Semaphore(self.limits.get(tool, self.default_limit))
+        return self._tool_slots[tool]
+
+    def _checkout_worker(self) -> _Worker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.process.is_alive():
+                    return worker
+        return _Worker(self._ctx)
+
+    def _checkin_worker(self, worker: _Worker):
+        if worker.tasks >= self.max_tasks_per_worker:
+            worker.close()  # recycle: matplotlib/pandas leak across many calls
+            return
+        with self._lock:
+            self._idle.append(worker)
+
+    async def run(self, tool: str, fn, *args, cpu: bool = True, timeout: float = 60.0, **kwargs):
+        """Run fn(*args, **kwargs) for `tool`; raises ToolBusyError or ToolTimeoutError."""
+        slots = self._slots(tool)
+        with self._lock:
+            stats = self._tool_stats(tool)
+            if stats["queued"] >= self.max_queue:
+                stats["rejected"] += 1
+                raise ToolBusyError(f"Too many {tool} requests queued, try again later")
+            stats["submitted"] += 1
+            stats["queued"] += 1
+        submitted = time.perf_counter()
+        acquired = False
+        try:
+            await slots.acquire()
+            acquired = True
+            if cpu:
+                await self._process_slots.acquire()
+        except BaseException:
+            if acquired:
+                slots.release()
+            with self._lock:
+                stats["queued"] -= 1
+            raise
+        started = time.perf_counter()
+        with self._lock:
+            stats["queued"] -= 1
+            stats["running"] += 1
+            waited = started - submitted
+            stats["queue_seconds"] += waited
+            stats["max_queue_seconds"] = max(stats["max_queue_seconds"], waited)
+        outcome = "failed"
+        try:
+            if cpu:
+                result = await self._run_in_process(fn, args, kwargs, timeout)
+            else:
+                loop = asyncio.get_running_loop()
+                try:
+                    result = await asyncio.wait_for(loop.run_in_executor(self._threads, lambda: fn(*args, **kwargs)),
+                                                    timeout)
+                except asyncio.TimeoutError:
+                    raise ToolTimeoutError(f"{tool} timed out after {timeout}s")
+            outcome = "completed"
+            return result
+        except ToolTimeoutError:
+            outcome = "timed_out"
+            raise
+        finally:
+            if cpu:
+                self._process_slots.release()
+            slots.release()
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                stats["running"] -= 1
+                stats[outcome] += 1
+                stats["run_seconds"] += elapsed
+                stats["max_run_seconds"] = max(stats["max_run_seconds"], elapsed)
+
+    async def _run_in_process(self, fn, args, kwargs, timeout):
+        loop = asyncio.get_running_loop()
+        worker = await loop.run_in_executor(self._waiters, self._checkout_worker)
+        future = loop.run_in_executor(self._waiters, worker.run, fn, args, kwargs, timeout)
+        try:
+            reply = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Caller went away (client disconnected): stop the work instead of letting it run on
+            worker.kill()
+            raise
+        if reply is None:
+            worker.kill()
+            raise ToolTimeoutError(f"Tool call timed out after {timeout}s; worker killed")
+        if worker.process.is_alive():
+            self._checkin_worker(worker)
+        ok, value = reply
+        if not ok:
+            raise RuntimeError(value)
+        return value
+
+    def metrics(self) -> dict:
+        with self._lock:
+            tools = {}
+            for tool, s in self._stats.items():
+                finished = s["completed"] + s["failed"] + s["timed_out"]
+                started = finished + s["running"]
+                tools[tool] = {
+                    **{k: v for k, v in s.items() if not k.endswith("seconds")},
+                    "mean_queue_seconds": round(s["queue_seconds"] / started, 4) if started else None,
+                    "max_queue_seconds": round(s["max_queue_seconds"], 4),
+                    "mean_run_seconds": round(s["run_seconds"] / finished, 4) if finished else None,
+                    "max_run_seconds": round(s["max_run_seconds"], 4),
+                    "limit": self.limits.get(tool, self.default_limit),
+                }
+            return {"process_workers": self.process_workers, "idle_workers": len(self._idle), "tools": tools}
+
+    def shutdown(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.close()
+        self._threads.shutdown(wait=False)
+        self._waiters.shutdown(wait=False)
@@ -0,0 +1,119 @@
+# backend/tools.py
+"""CPU-bound tools run by the tool executor, in worker processes.
+
+Kept out of app.py so worker processes only import what these need."""
+import base64
+import os
+import uuid
+
+from lazy_imports import LazyModule, resolve
+
+# Charts are rendered off-screen in worker processes
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+pd = LazyModule("pandas", "data")
+sk_model_selection = LazyModule("sklearn.model_selection", "automl")
+sk_ensemble = LazyModule("sklearn.ensemble", "automl")
+sk_metrics = LazyModule("sklearn.metrics", "automl")
+joblib = LazyModule("joblib", "automl")
+plt = LazyModule("matplotlib.pyplot", "charts")
+restricted = LazyModule("RestrictedPython", "code_exec")
+
+EXPORT_DIR = "exports"
+
+# Code Interpreter
+def execute_code(code: str):
+    try:
+        restricted_globals = restricted.safe_globals.copy()
+        restricted_globals.update(restricted.limited_builtins)
+        restricted_globals["pd"] = resolve(pd)
+        restricted_globals["plt"] = resolve(plt)
+        compiled_code = restricted.compile_restricted(code, "<string>", "exec")
+        local_vars = {}
+        exec(compiled_code, restricted_globals, local_vars)
+        result = local_vars.get("result", "Code executed successfully")
+        if isinstance(result, pd.DataFrame):
+            return result.to_string()
+        return str(result)
+    except NameError as e:
+        if "__import__" in str(e):
+            return "Error: Imports are restricted. Use 'pd' for pandas and 'plt' for matplotlib, which are pre-imported."
+        return f"Error: {str(e)}"
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+# AutoML
+def run_automl(dataset_path: str, task: str, target_column: str):
+    """Train a random forest; returns the model path, metrics and the feature encoding
+    the model store needs to score new data."""
+    try:
+        df = pd.read_csv(dataset_path)
+        if target_column not in df.columns:
+            raise ValueError(f"Target column '{target_column}' not found")
+        categorical_cols = [col for col in df.select_dtypes(include=['object', 'category']).columns if col != target_column]
+        df_encoded = pd.get_dummies(df, columns=categorical_cols, drop_first=True)
+        X = df_encoded.drop(columns=[target_column])
+        y = df[target_column]
+        X_train, X_test, y_train, y_test = sk_model_selection.train_test_split(X, y, test_size=0.2, random_state=42)
+        
+        if task == "classification":
+            model = sk_ensemble.RandomForestClassifier(n_estimators=100, random_state=42)
+            model.fit(X_train, y_train)
+            y_pred = model.predict(X_test)
+            score = sk_metrics.accuracy_score(y_test, y_pred)
+            metrics = {"accuracy": score}
+        elif task == "regression":
+            model = sk_ensemble.RandomForestRegressor(n_estimators=100, random_state=42)
+            model.fit(X_train, y_train)
+            y_pred = model.predict(X_test)
+            score = sk_metrics.mean_squared_error(y_test, y_pred, squared=False)
+            metrics = {"rmse": score}
+        else:
+            raise ValueError("Task must be 'classification' or 'regression'")
+        
+        model_id = str(uuid.uuid4())
+        model_path = os.path.join(EXPORT_DIR, f"model_{model_id}.joblib").replace("\\", "/")
+        # Uncompressed, so the model store can memory-map the tree arrays
+        joblib.dump(model, model_path)
+        return {
+            "score": score,
+            "model_path": model_path,
+            "model_id": model_id,
+            "task": task,
+            "target_column": target_column,
+            "input_columns": [col for col in df.columns if col != target_column],
+            "categorical_columns": categorical_cols,
+            "feature_columns": list(X.columns),
+            "metrics": {**metrics, "train_rows": len(X_train), "test_rows": len(X_test)},
+        }
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+# Chart Generation
+def generate_chart(data_path: str, chart_type: str, x_column: str, y_column: str, title: str, encode: bool = True):
+    try:
+        df = pd.read_csv(data_path)
+        if x_column not in df.columns or y_column not in df.columns:
+            raise ValueError(f"Columns '{x_column}' or '{y_column}' not found")
+        
+        plt.figure(figsize=(8, 6))
+        if chart_type == "bar":
+            df.groupby(x_column)[y_column].sum().plot(kind="bar")
+        elif chart_type == "line":
+            df.plot(x=x_column, y=y_column, kind="line")
+        elif chart_type == "pie":
+            df.groupby(x_column)[y_column].sum().plot(kind="pie")
+        else:
+            raise ValueError("Unsupported chart type")
+        
+        plt.title(title or f"{y_column} by {x_column}")
+        chart_path = os.path.join(EXPORT_DIR, f"chart_{uuid.uuid4()}.png").replace("\\", "/")
+        plt.savefig(chart_path)
+        plt.close()
+        if not encode:
+            return chart_path, None
+        with open(chart_path, "rb") as f:
+            chart_data = base64.b64encode(f.read()).decode()
+        return chart_path, chart_data
+    except Exception as e:
+        return f"Error: {str(e)}"
@@ -0,0 +1,145 @@
+# backend/train_jobs.py
+import json
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+
+DB_PATH = "uploads/forgebot.db"
+STALE_AFTER = 300  # seconds without a heartbeat before a running job is reclaimed
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+CREATE_JOBS_TABLE = """
+CREATE TABLE IF NOT EXISTS train_jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    model_id TEXT,
+    params TEXT NOT NULL,
+    progress TEXT,
+    error TEXT,
+    worker_id TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat_at REAL
+)
+"""
+
+
+class JobQueue:
+    """SQLite-backed training job queue shared by the API and train_worker processes.
+
+    Every worker points at the same database file; claiming a job happens in a
+    write transaction so each job runs on exactly one worker."""
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(CREATE_JOBS_TABLE)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_train_jobs_status ON train_jobs (status, created_at)")
+
+    @contextmanager
+    def _connect(self):
+        # Autocommit; claim() opens its own write transaction
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, params: dict, model_id: str = None, job_id: str = None) -> str:
+        job_id = job_id or str(uuid.uuid4())
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO train_jobs (job_id, status, model_id, params, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, model_id, json.dumps(params), time.time()),
+            )
+        return job_id
+
+    def claim(self, worker_id: str):
+        """Take the oldest queued job (or a running job whose worker stopped heartbeating)."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT job_id FROM train_jobs WHERE status = ? OR (status = ? AND heartbeat_at < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (QUEUED, RUNNING, now - STALE_AFTER),
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE train_jobs SET status = ?, worker_id = ?, attempts = attempts + 1, "
+                        "started_at = COALESCE(started_at, ?), heartbeat_at = ? WHERE job_id = ?",
+                        (RUNNING, worker_id, now, now, row["job_id"]),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return self.get(row["job_id"]) if row is not None else None
+
+    def heartbeat(self, job_id: str, progress: dict = None):
+        with self._connect() as conn:
+            if progress is None:
+                conn.execute("UPDATE train_jobs SET heartbeat_at = ? WHERE job_id = ?", (time.time(), job_id))
+            else:
+                conn.execute("UPDATE train_jobs SET heartbeat_at = ?, progress = ? WHERE job_id = ?",
+                             (time.time(), json.dumps(progress), job_id))
+
+    def finish(self, job_id: str, status: str, error: str = None):
+        with self._connect() as conn:
+            conn.execute("UPDATE train_jobs SET status = ?, error = ?, finished_at = ? WHERE job_id = ?",
+                         (status, error, time.time(), job_id))
+
+    def request_cancel(self, job_id: str) -> bool:
+        # Queued jobs are cancelled immediately; running ones stop at the next training step
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE train_jobs SET cancel_requested = 1, "
+                "status = CASE WHEN status = ? THEN ? ELSE status END, "
+                "finished_at = CASE WHEN status = ? THEN ? ELSE finished_at END "
+                "WHERE job_id = ? AND status IN (?, ?)",
+                (QUEUED, CANCELLED, QUEUED, time.time(), job_id, QUEUED, RUNNING),
+            )
+            return cur.rowcount > 0
+
+    def cancel_requested(self, job_id: str) -> bool:
+        with self._connect() as conn:
+            row = conn.execute("SELECT cancel_requested FROM train_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def resume(self, job_id: str) -> bool:
+        """Re-queue a failed or cancelled job; the worker continues from its latest checkpoint."""
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE train_jobs SET status = ?, cancel_requested = 0, error = NULL, finished_at = NULL "
+                "WHERE job_id = ? AND status IN (?, ?)",
+                (QUEUED, job_id, FAILED, CANCELLED),
+            )
+            return cur.rowcount > 0
+
+    def get(self, job_id: str):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM train_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["progress"] = json.loads(job["progress"]) if job["progress"] else None
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def list(self, status: str = None, limit: int = 100):
+        query, args = "SELECT job_id FROM train_jobs", ()
+        if status:
+            query, args = query + " WHERE status = ?", (status,)
+        with self._connect() as conn:
+            ids = [r["job_id"] for r in conn.execute(query + " ORDER BY created_at DESC LIMIT ?", args + (limit,))]
+        return [self.get(job_id) for job_id in ids]
@@ -2,10 +2,14 @@ import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer, Trainer, TrainingArguments, DataCollatorForLanguageModeling
 from peft import LoraConfig, get_peft_model
 from datasets import load_dataset
+from collators import PackedCausalCollator, pack_dataset, token_utilization
+from train_telemetry import instrument
 
 # -------- SETTINGS --------
 BASE_MODEL = "meta-llama/Llama-3.1-8B-Instruct"
 OUTPUT_DIR = "./fine_tuned_model"
+MAX_LENGTH = 128
+PACKING = False  # True: pack several reviews per sequence; False: length-bucketed dynamic padding
 
 # -------- LOAD MODEL + TOKENIZER --------
 tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL, use_fast=True)
@@ -30,19 +34,28 @@ model = get_peft_model(model, lora_config)
 # -------- LOAD DATASET --------
 dataset = load_dataset("imdb", split="train[:1%]")  # demo small dataset
 
+# No padding here: batches are padded to their own longest sample by the collator
 def tokenize(batch):
-    return tokenizer(batch["text"], truncation=True, padding="max_length", max_length=128)
+    enc = tokenizer(batch["text"], truncation=True, max_length=MAX_LENGTH)
+    enc["length"] = [len(ids) for ids in enc["input_ids"]]
+    return enc
 
-dataset = dataset.map(tokenize, batched=True)
-
-# Remove unnecessary columns and set torch tensors
-dataset.set_format(type="torch", columns=["input_ids", "attention_mask"])
+dataset = dataset.map(tokenize, batched=True, remove_columns=dataset.column_names)
+lengths = dataset["length"]
+print(f"Token utilization with max_length padding: {token_utilization(lengths, MAX_LENGTH):.1%}")
 
 # -------- DATA COLLATOR --------
-data_collator = DataCollatorForLanguageModeling(
-    tokenizer=tokenizer,
-    mlm=False  # Causal LM
-)
+if PACKING:
+    dataset = pack_dataset(dataset, MAX_LENGTH)
+    print(f"Packed {len(lengths)} samples into {len(dataset)} sequences, "
+          f"token utilization {sum(lengths) / (len(dataset) * MAX_LENGTH):.1%}")
+    data_collator = PackedCausalCollator(tokenizer.pad_token_id, dtype=model.dtype)
+else:
+    data_collator = DataCollatorForLanguageModeling(
+        tokenizer=tokenizer,
+        mlm=False,  # Causal LM
+        pad_to_multiple_of=8,
+    )
 
 # -------- TRAINING ARGS --------
 training_args = TrainingArguments(
@@ -52,6 +65,9 @@ training_args = TrainingArguments(
     num_train_epochs=1,
     logging_steps=10,
     save_strategy="epoch",
+    group_by_length=not PACKING,  # batch similar lengths together to minimise padding
+    length_column_name="length",
+    remove_unused_columns=not PACKING,  # the packing collator needs seq_lens
     fp16=False,  # CPU cannot use fp16
     report_to="none"
 )
@@ -64,6 +80,9 @@ trainer = Trainer(
     data_collator=data_collator,
 )
 
+# -------- TELEMETRY --------
+instrument(trainer, OUTPUT_DIR)
+
 # -------- TRAIN --------
 trainer.train()
 
@@ -1,17 +1,97 @@
 import os
 import json
 import time
+from dataclasses import dataclass, asdict
 import torch
 from datasets import load_from_disk
+from peft import LoraConfig, get_peft_model
+from transformers import AutoModelForCausalLM, AutoTokenizer, Trainer, TrainingArguments, default_data_collator
+from transformers.trainer_utils import get_last_checkpoint
 from trl import SFTTrainer, SFTConfig
 
+from pack_cache import SFT_TEMPLATE, CPT_TEMPLATE, CACHE_DIR, load_or_build
+from train_telemetry import instrument
 
-def train(args):
-    if args.dataset_type == "sft":
-        formatting_func = lambda ex: f"<s>[INST] {ex['instruction']}\n{ex['input']} [/INST]\n{ex['output']}</s>"
+
+@dataclass
+class TrainArgs:
+    base_model: str
+    dataset_type: str  # "sft" | "cpt"
+    dataset_path: str
+    run_dir: str
+    max_steps: int = 200
+    per_device_train_batch_size: int = 1
+    gradient_accumulation_steps: int = 8
+    lr: float = 2e-4
+    bf16: bool = True
+    max_seq_length: int = 2048
+    lora_r: int = 16
+    lora_alpha: int = 32
+    lora_dropout: float = 0.05
+    # Tokenize + pack once into a memory-mapped cache and train from it
+    use_packed_cache: bool = True
+    cache_dir: str = CACHE_DIR
+
+
+def load_model_and_tokenizer(args):
+    tokenizer = AutoTokenizer.from_pretrained(args.base_model, use_fast=True)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    model = AutoModelForCausalLM.from_pretrained(
+        args.base_model,
+        torch_dtype=torch.bfloat16 if args.bf16 and torch.cuda.is_available() else torch.float32,
+    )
+    lora_config = LoraConfig(
+        r=args.lora_r,
+        lora_alpha=args.lora_alpha,
+        target_modules=["q_proj", "v_proj"],
+        lora_dropout=args.lora_dropout,
+        bias="none",
+        task_type="CAUSAL_LM",
+    )
+    return get_peft_model(model, lora_config), tokenizer
+
+
+def _packed_trainer(args, model, tokenizer, ds):
+    template = SFT_TEMPLATE if args.dataset_type == "sft" else CPT_TEMPLATE
+    start = time.time()
+    train_dataset = load_or_build(ds, tokenizer, template, args.max_seq_length, args.cache_dir,
+                                  add_eos=args.dataset_type == "cpt")
+    print(f"Packed dataset ready in {time.time() - start:.1f}s ({len(train_dataset)} blocks)")
+
+    training_args = TrainingArguments(
+        output_dir=args.run_dir,
+        per_device_train_batch_size=args.per_device_train_batch_size,
+        gradient_accumulation_steps=args.gradient_accumulation_steps,
+        learning_rate=args.lr,
+        num_train_epochs=1.0,
+        max_steps=args.max_steps,
+        logging_steps=5,
+        save_steps=50,
+        bf16=args.bf16 and torch.cuda.is_available(),
+        report_to=[],
+    )
+    return Trainer(
+        model=model,
+        args=training_args,
+        train_dataset=train_dataset,
+        data_collator=default_data_collator,
+    )
+
+
+def train(args, callbacks=None):
+    model, tokenizer = load_model_and_tokenizer(args)
+    # Arrow shards written by dataset_builders are memory-mapped, not loaded into RAM
+    ds = load_from_disk(args.dataset_path)
+
+    if args.use_packed_cache:
+        trainer = _packed_trainer(args, model, tokenizer, ds)
+
+    elif args.dataset_type == "sft":
+        formatting_func = lambda ex: SFT_TEMPLATE.format(**ex)
 
         sft_cfg = SFTConfig(
-            max_seq_length=2048,
+            max_seq_length=args.max_seq_length,
             packing=True,
             output_dir=args.run_dir,
             per_device_train_batch_size=args.per_device_train_batch_size,
@@ -34,10 +114,8 @@ def train(args):
         )
 
     else:  # CPT
-        ds = load_from_disk(args.dataset_path)
-
         sft_cfg = SFTConfig(
-            max_seq_length=2048,
+            max_seq_length=args.max_seq_length,
             packing=True,
             output_dir=args.run_dir,
             per_device_train_batch_size=args.per_device_train_batch_size,
@@ -59,12 +137,21 @@ def train(args):
             args=sft_cfg,
         )
 
-    trainer.train()
+    # tokens/sec, step time split and memory -> run_dir/telemetry.jsonl
+    instrument(trainer, args.run_dir)
+    for callback in callbacks or []:
+        trainer.add_callback(callback)
+
+    # Continue from the latest checkpoint in run_dir (resumed or restarted jobs)
+    last_checkpoint = get_last_checkpoint(args.run_dir) if os.path.isdir(args.run_dir) else None
+    if last_checkpoint:
+        print(f"Resuming from {last_checkpoint}")
+    trainer.train(resume_from_checkpoint=last_checkpoint)
     model.save_pretrained(os.path.join(args.run_dir, "lora_adapter"))
     tokenizer.save_pretrained(os.path.join(args.run_dir, "lora_adapter"))
 
     with open(os.path.join(args.run_dir, "train_args.json"), "w") as f:
-        json.dump(args.__dict__, f, indent=2)
+        json.dump(asdict(args), f, indent=2)
 
     return args.run_dir
 
@@ -78,6 +165,9 @@ if __name__ == "__main__":
     p.add_argument("--dataset_path", required=True)
     p.add_argument("--run_dir", required=True)
     p.add_argument("--max_steps", type=int, default=200)
+    p.add_argument("--max_seq_length", type=int, default=2048)
+    p.add_argument("--cache_dir", default=CACHE_DIR)
+    p.add_argument("--no_packed_cache", action="store_true", help="let SFTTrainer tokenize and pack on every run")
     args = p.parse_args()
 
     ta = TrainArgs(
@@ -85,6 +175,10 @@ if __name__ == "__main__":
         dataset_type=args.dataset_type,
         dataset_path=args.dataset_path,
         run_dir=args.run_dir,
+        max_steps=args.max_steps,
+        max_seq_length=args.max_seq_length,
+        use_packed_cache=not args.no_packed_cache,
+        cache_dir=args.cache_dir,
     )
 
     train(ta)
@@ -0,0 +1,169 @@
+# backend/train_telemetry.py
+import json
+import os
+import resource
+import sys
+import time
+
+import torch
+from transformers import TrainerCallback
+
+TELEMETRY_FILE = "telemetry.jsonl"
+SUMMARY_FILE = "telemetry_summary.json"
+
+
+def _peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss /= 1024
+    return round(rss / 1024, 1)
+
+
+class ThroughputCallback(TrainerCallback):
+    """Per-step throughput telemetry written as JSONL next to train_args.json.
+
+    Records tokens/sec, samples/sec, a step time split (data loading, forward/backward,
+    optimizer), peak RSS / CUDA memory and the padding waste ratio. Token counts come
+    from the data collator, so wrap it with `wrap_collator` (dataloader_num_workers=0,
+    the default, keeps the counters in this process)."""
+
+    def __init__(self, run_dir: str, log_every: int = 1):
+        self.run_dir = run_dir
+        self.log_every = log_every
+        self._reset_step()
+        self._last_step_end = None
+        self._step_begin = None
+        self._in_step = False
+        self._optimizer_begin = None
+        self.totals = {"tokens": 0, "padded_tokens": 0, "samples": 0, "steps": 0,
+                       "data_seconds": 0.0, "compute_seconds": 0.0, "optimizer_seconds": 0.0, "step_seconds": 0.0}
+        self._train_start = None
+        self._file = None
+
+    def _reset_step(self):
+        self._step = {"tokens": 0, "padded_tokens": 0, "samples": 0, "data_seconds": 0.0}
+        self._in_step_data = 0.0  # collation of gradient-accumulation micro-batches inside the step
+
+    def wrap_collator(self, collator):
+        def collate(features):
+            start = time.perf_counter()
+            batch = collator(features)
+            input_ids = batch["input_ids"]
+            mask = batch.get("attention_mask")
+            if mask is None:
+                real = input_ids.numel()
+            elif mask.dim() == 4:
+                # Additive block mask from PackedCausalCollator: padding rows cannot attend to themselves
+                real = int((mask.diagonal(dim1=-2, dim2=-1) == 0).sum())
+            else:
+                real = int(mask.sum())
+            self._step["tokens"] += real
+            self._step["padded_tokens"] += input_ids.numel()
+            self._step["samples"] += input_ids.shape[0]
+            if self._in_step:
+                self._in_step_data += time.perf_counter() - start
+            return batch
+        return collate
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        os.makedirs(self.run_dir, exist_ok=True)
+        self._file = open(os.path.join(self.run_dir, TELEMETRY_FILE), "a")
+        self._train_start = self._last_step_end = time.perf_counter()
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        # The first batch of this step was fetched between the previous step end and now
+        self._step_begin = time.perf_counter()
+        self._step["data_seconds"] = self._step_begin - self._last_step_end
+        self._in_step = True
+        self._optimizer_begin = None
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        self._optimizer_begin = time.perf_counter()
+
+    def on_optimizer_step(self, args, state, control, **kwargs):
+        # Older transformers only fire this (after optimizer.step); attribute the rest to compute
+        if self._optimizer_begin is None:
+            self._optimizer_begin = time.perf_counter()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        now = time.perf_counter()
+        step_seconds = now - self._last_step_end
+        optimizer_begin = self._optimizer_begin or now
+        step = self._step
+        step["data_seconds"] += self._in_step_data
+        compute = max(optimizer_begin - self._step_begin - self._in_step_data, 0.0)
+        optimizer = now - optimizer_begin
+        self._in_step = False
+        record = {
+            "step": state.global_step,
+            "step_seconds": round(step_seconds, 4),
+            "data_seconds": round(step["data_seconds"], 4),
+            "compute_seconds": round(compute, 4),
+            "optimizer_seconds": round(optimizer, 4),
+            "tokens": step["tokens"],
+            "samples": step["samples"],
+            "tokens_per_sec": round(step["tokens"] / step_seconds, 1) if step_seconds else None,
+            "samples_per_sec": round(step["samples"] / step_seconds, 2) if step_seconds else None,
+            "padding_waste": round(1 - step["tokens"] / step["padded_tokens"], 4) if step["padded_tokens"] else None,
+            "peak_rss_mb": _peak_rss_mb(),
+        }
+        if torch.cuda.is_available():
+            record["cuda_peak_mb"] = round(torch.cuda.max_memory_allocated() / 1024 ** 2, 1)
+
+        t = self.totals
+        t["steps"] += 1
+        for key in ("tokens", "padded_tokens", "samples", "data_seconds"):
+            t[key] += step[key]
+        t["compute_seconds"] += compute
+        t["optimizer_seconds"] += optimizer
+        t["step_seconds"] += step_seconds
+
+        if self._file and state.global_step % self.log_every == 0:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+        self._reset_step()
+        self._last_step_end = now
+
+    def summary(self) -> dict:
+        t = self.totals
+        steps = t["steps"] or 1
+        wall = t["step_seconds"] or 1e-9
+        summary = {
+            "steps": t["steps"],
+            "tokens": t["tokens"],
+            "samples": t["samples"],
+            "tokens_per_sec": round(t["tokens"] / wall, 1),
+            "samples_per_sec": round(t["samples"] / wall, 2),
+            "mean_step_seconds": round(t["step_seconds"] / steps, 4),
+            "mean_data_seconds": round(t["data_seconds"] / steps, 4),
+            "mean_compute_seconds": round(t["compute_seconds"] / steps, 4),
+            "mean_optimizer_seconds": round(t["optimizer_seconds"] / steps, 4),
+            "padding_waste": round(1 - t["tokens"] / t["padded_tokens"], 4) if t["padded_tokens"] else None,
+            "peak_rss_mb": _peak_rss_mb(),
+            "train_seconds": round(time.perf_counter() - self._train_start, 2) if self._train_start else None,
+        }
+        if torch.cuda.is_available():
+            summary["cuda_peak_mb"] = round(torch.cuda.max_memory_allocated() / 1024 ** 2, 1)
+        return summary
+
+    def on_train_end(self, args, state, control, **kwargs):
+        summary = self.summary()
+        with open(os.path.join(self.run_dir, SUMMARY_FILE), "w") as f:
+            json.dump(summary, f, indent=2)
+        if self._file:
+            self._file.close()
+            self._file = None
+        print(f"Throughput: {summary['tokens_per_sec']} tokens/s, {summary['samples_per_sec']} samples/s, "
+              f"step {summary['mean_step_seconds']}s (data {summary['mean_data_seconds']}s, "
+              f"fwd/bwd {summary['mean_compute_seconds']}s, optimizer {summary['mean_optimizer_seconds']}s), "
+              f"padding waste {summary['padding_waste']}, peak RSS {summary['peak_rss_mb']}MB")
+
+
+def instrument(trainer, run_dir: str, log_every: int = 1) -> ThroughputCallback:
+    """Attach a ThroughputCallback to `trainer` and wrap its data collator for token counts."""
+    telemetry = ThroughputCallback(run_dir, log_every)
+    trainer.data_collator = telemetry.wrap_collator(trainer.data_collator)
+    trainer.add_callback(telemetry)
+    return telemetry
@@ -0,0 +1,235 @@
+# backend/train_worker.py
+"""Training worker: claims jobs queued by /train and runs train_sft.train for each.
+
+    python train_worker.py --slots 2 --max-memory-gb 48 --cpu-threads 16
+
+Run any number of these (on any machine that sees the same database file and
+upload paths); each job runs in its own child process with resource limits."""
+import multiprocessing as mp
+import os
+import resource
+import socket
+import time
+import traceback
+import zipfile
+from itertools import groupby
+
+from train_jobs import JobQueue, DB_PATH, RUNNING, SUCCEEDED, FAILED, CANCELLED
+
+RUNS_DIR = "fine_tune/runs"
+EXPORT_DIR = "exports"
+EXPORT_TTL = float(os.getenv("EXPORT_TTL_HOURS", "168")) * 3600  # same setting as app.py
+HEARTBEAT_EVERY = 10  # seconds
+
+
+def _apply_limits(max_memory_gb: float, cpu_threads: int):
+    if max_memory_gb:
+        # Address-space limit; leave unset on CUDA workers (the driver reserves huge mappings)
+        limit = int(max_memory_gb * 1024 ** 3)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if cpu_threads:
+        for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ[var] = str(cpu_threads)
+        import torch
+        torch.set_num_threads(cpu_threads)
+
+
+def prepare_dataset(files: list, base_model: str, out_dir: str, max_workers: int = None) -> str:
+    """Build the training dataset for a job from uploaded files; returns "sft" or "cpt".
+
+    CSVs with question/answer or instruction/input/output columns become an SFT set;
+    PDFs and text files are chunked with the base model's tokenizer for CPT. PDF pages
+    are extracted on `max_workers` processes (default: all cores)."""
+    from dataset_builders import build_sft_sharded, build_cpt_sharded
+    from ingest import iter_csv_qa, iter_pdf_pages_parallel, iter_token_chunks
+
+    csvs = [f for f in files if f.lower().endswith(".csv")]
+    if csvs:
+        build_sft_sharded((df for path in csvs for df in iter_csv_qa(path)), out_dir)
+        return "sft"
+
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(base_model, use_fast=True)
+
+    def texts():
+        # Consecutive PDFs share one process pool; file order is kept
+        for is_pdf, group in groupby(files, key=lambda path: path.lower().endswith(".pdf")):
+            if is_pdf:
+                yield from iter_pdf_pages_parallel(list(group), max_workers)
+                continue
+            for path in group:
+                with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                    while True:
+                        block = f.read(64 * 1024)
+                        if not block:
+                            break
+                        yield block
+
+    build_cpt_sharded(iter_token_chunks(texts(), tokenizer), out_dir)
+    return "cpt"
+
+
+def _export_adapter(job_id: str, run_dir: str) -> str:
+    adapter_dir = os.path.join(run_dir, "lora_adapter")
+    export_path = os.path.join(EXPORT_DIR, f"{job_id}.zip").replace("\\", "/")
+    with zipfile.ZipFile(export_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for root, _, names in os.walk(adapter_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                zf.write(path, os.path.relpath(path, adapter_dir))
+    return export_path
+
+
+def run_job(db_path: str, job: dict, max_memory_gb: float = None, cpu_threads: int = None):
+    """Child-process entry point for one job."""
+    _apply_limits(max_memory_gb, cpu_threads)
+    from transformers import TrainerCallback
+    from train_sft import TrainArgs, train
+
+    queue = JobQueue(db_path)
+    job_id = job["job_id"]
+    params = job["params"]
+    run_dir = os.path.join(RUNS_DIR, job_id)
+    data_dir = os.path.join(run_dir, "dataset")
+
+    class JobProgressCallback(TrainerCallback):
+        def __init__(self):
+            self.cancelled = False
+            self.last_heartbeat = 0.0
+            self.progress = {}
+            self.started = None  # (time, global_step) when this run began; resumed jobs start mid-way
+
+        def on_train_begin(self, args, state, control, **kwargs):
+            self.started = (time.perf_counter(), state.global_step)
+
+        def _update(self, args, state):
+            self.progress.update({"step": state.global_step, "max_steps": state.max_steps})
+            if self.started is None:
+                return
+            elapsed = time.perf_counter() - self.started[0]
+            steps = state.global_step - self.started[1]
+            if elapsed > 0 and steps > 0:
+                samples_per_step = args.train_batch_size * args.gradient_accumulation_steps * args.world_size
+                self.progress.update({
+                    "steps_per_sec": round(steps / elapsed, 4),
+                    "samples_per_sec": round(steps * samples_per_step / elapsed, 2),
+                    "eta_seconds": round((state.max_steps - state.global_step) * elapsed / steps),
+                })
+
+        def on_log(self, args, state, control, logs=None, **kwargs):
+            self.progress.update({k: v for k, v in (logs or {}).items() if isinstance(v, (int, float))})
+            self._update(args, state)
+            queue.heartbeat(job_id, self.progress)
+
+        def on_step_end(self, args, state, control, **kwargs):
+            now = time.time()
+            if now - self.last_heartbeat < HEARTBEAT_EVERY:
+                return
+            self.last_heartbeat = now
+            self._update(args, state)
+            queue.heartbeat(job_id, self.progress)
+            if queue.cancel_requested(job_id):
+                # Stop at a step boundary and checkpoint so the job can be resumed
+                self.cancelled = True
+                control.should_save = True
+                control.should_training_stop = True
+
+    try:
+        os.makedirs(run_dir, exist_ok=True)
+        queue.heartbeat(job_id, {"stage": "preparing_dataset"})
+        # Written only after the dataset is complete, so resumed jobs skip preparation
+        type_file = os.path.join(run_dir, "dataset_type")
+        if os.path.exists(type_file):
+            with open(type_file) as f:
+                dataset_type = f.read().strip()
+        else:
+            dataset_type = prepare_dataset(params["files"], params["base_model"], data_dir, cpu_threads)
+            with open(type_file, "w") as f:
+                f.write(dataset_type)
+
+        callback = JobProgressCallback()
+        args = TrainArgs(
+            base_model=params["base_model"],
+            dataset_type=dataset_type,
+            dataset_path=data_dir,
+            run_dir=run_dir,
+            **params.get("train_args", {}),
+        )
+        train(args, callbacks=[callback])
+        if callback.cancelled:
+            queue.finish(job_id, CANCELLED)
+            return
+        export_path = _export_adapter(job_id, run_dir)
+        _record_export(db_path, job_id, export_path)
+        queue.finish(job_id, SUCCEEDED)
+    except Exception as e:
+        traceback.print_exc()
+        queue.finish(job_id, FAILED, f"{type(e).__name__}: {e}")
+
+
+def _record_export(db_path: str, job_id: str, export_path: str):
+    from sqlalchemy import create_engine
+    from file_catalog import FileCatalog
+    engine = create_engine(f"sqlite:///{db_path}")
+    FileCatalog(lambda: engine).add("export", export_path, file_id=job_id, ttl=EXPORT_TTL)
+
+
+def serve(db_path: str = DB_PATH, slots: int = 1, poll_interval: float = 5.0, max_memory_gb: float = None,
+          cpu_threads: int = None, max_hours: float = None, cancel_grace: float = 120.0):
+    """Supervisor loop: keep up to `slots` jobs running, enforce cancellation and timeouts."""
+    ctx = mp.get_context("spawn")  # fresh interpreter per job; no forked torch/CUDA state
+    queue = JobQueue(db_path)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    running = {}  # job_id -> (process, started_at, cancel_seen_at)
+    print(f"Training worker {worker_id} started with {slots} slot(s)")
+    while True:
+        for job_id, (proc, started_at, cancel_seen_at) in list(running.items()):
+            if not proc.is_alive():
+                proc.join()
+                job = queue.get(job_id)
+                if job and job["status"] == RUNNING:
+                    queue.finish(job_id, FAILED, f"Worker process exited with code {proc.exitcode}")
+                del running[job_id]
+                continue
+            queue.heartbeat(job_id)
+            now = time.time()
+            if max_hours and now - started_at > max_hours * 3600:
+                proc.terminate()
+                proc.join()
+                queue.finish(job_id, FAILED, f"Timed out after {max_hours}h")
+                del running[job_id]
+            elif queue.cancel_requested(job_id):
+                if cancel_seen_at is None:
+                    running[job_id] = (proc, started_at, now)
+                elif now - cancel_seen_at > cancel_grace:
+                    # The job did not reach a step boundary in time (e.g. still preparing data)
+                    proc.terminate()
+                    proc.join()
+                    queue.finish(job_id, CANCELLED)
+                    del running[job_id]
+
+        while len(running) < slots:
+            job = queue.claim(worker_id)
+            if job is None:
+                break
+            print(f"Starting training job {job['job_id']} (attempt {job['attempts']})")
+            proc = ctx.Process(target=run_job, args=(db_path, job, max_memory_gb, cpu_threads),
+                               name=f"train-{job['job_id']}")
+            proc.start()
+            running[job["job_id"]] = (proc, time.time(), None)
+
+        time.sleep(poll_interval)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    p = argparse.ArgumentParser()
+    p.add_argument("--db", default=DB_PATH)
+    p.add_argument("--slots", type=int, default=1, help="concurrent training jobs on this machine")
+    p.add_argument("--poll-interval", type=float, default=5.0)
+    p.add_argument("--max-memory-gb", type=float, default=None)
+    p.add_argument("--cpu-threads", type=int, default=None)
+    p.add_argument("--max-hours", type=float, default=None)
+    a = p.parse_args()
+    serve(a.db, a.slots, a.poll_interval, a.max_memory_gb, a.cpu_threads, a.max_hours)
@@ -0,0 +1,186 @@
+# backend/tts_cache.py
+import asyncio
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+from image_cache import cache_key
+
+
+def tts_cache_key(text: str, voice_id: str, language: str, model_id: str, voice_settings: dict) -> str:
+    text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return cache_key(text=text_hash, voice_id=voice_id, language=language, model_id=model_id,
+                     voice_settings=voice_settings)
+
+
+class _Synthesis:
+    """One upstream synthesis in flight: the chunks received so far, shared by all its listeners."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.path = None
+        self.error = None
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class TTSCache:
+    """Synthesized MP3s on disk (served from /uploads), with an in-memory LRU index and a byte budget.
+
+    The index is rebuilt from file mtimes on startup. `get_or_create` is single-flight:
+    concurrent requests for the same key share one upstream synthesis. That synthesis
+    runs in a task owned by the cache, which writes the file; every caller (the first
+    one included) follows its chunks as they arrive, so a listener that fails or
+    disconnects only stops its own copy of the stream."""
+
+    def __init__(self, cache_dir: str, max_bytes: int = 512 * 1024 ** 2):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # key -> size in bytes, least recently used first
+        self._bytes = 0
+        self._inflight = {}  # key -> _Synthesis being written
+        self.stats = {"hits": 0, "misses": 0, "shared": 0, "evictions": 0}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.mp3").replace("\\", "/")
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".part"):  # left by a synthesis interrupted by a restart
+                os.remove(os.path.join(self.cache_dir, name))
+                continue
+            if not name.endswith(".mp3"):
+                continue
+            st = os.stat(os.path.join(self.cache_dir, name))
+            entries.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._bytes += size
+        self._evict()
+
+    def get(self, key: str):
+        """Path of the cached audio, or None."""
+        with self._lock:
+            if key not in self._index:
+                return None
+            self._index.move_to_end(key)
+        path = self.path(key)
+        try:
+            os.utime(path)  # keep LRU order across restarts
+        except FileNotFoundError:
+            with self._lock:
+                self._bytes -= self._index.pop(key, 0)
+            return None
+        return path
+
+    def adopt(self, key: str, file_path: str) -> str:
+        """Move a finished audio file into the cache under `key`."""
+        path = self.path(key)
+        os.replace(file_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._bytes -= self._index.pop(key, 0)
+            self._index[key] = size
+            self._bytes += size
+            self._evict(keep=key)
+        return path
+
+    async def get_or_create(self, key: str, produce, on_chunk=None):
+        """Return (path, cached). `produce()` returns an async iterator of audio chunks and
+        is called once per key; `await on_chunk(bytes)` sees the audio as it arrives
+        (read back from disk on a hit). Errors raised by `on_chunk` reach only this caller."""
+        path = self.get(key)
+        if path is not None:
+            with self._lock:
+                self.stats["hits"] += 1
+            if on_chunk is not None:
+                await self._replay(path, on_chunk)
+            return path, True
+
+        synthesis = self._inflight.get(key)
+        shared = synthesis is not None
+        with self._lock:
+            self.stats["shared" if shared else "misses"] += 1
+        if not shared:
+            synthesis = self._inflight[key] = _Synthesis()
+            task = asyncio.ensure_future(self._synthesize(key, produce, synthesis))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+        sent = 0
+        while True:
+            while sent < len(synthesis.chunks):
+                chunk = synthesis.chunks[sent]
+                sent += 1
+                if on_chunk is not None:
+                    await on_chunk(chunk)
+            if synthesis.done:
+                break
+            await synthesis.changed.wait()
+        if synthesis.error is not None:
+            raise synthesis.error
+        return synthesis.path, shared
+
+    async def _synthesize(self, key: str, produce, synthesis: _Synthesis):
+        loop = asyncio.get_running_loop()
+        partial = os.path.join(self.cache_dir, f".{key}.{uuid.uuid4().hex}.part")
+        try:
+            with open(partial, "wb") as f:
+                async for chunk in produce():
+                    await loop.run_in_executor(None, f.write, chunk)
+                    synthesis.chunks.append(chunk)
+                    synthesis.notify()
+            synthesis.path = self.adopt(key, partial)
+        except Exception as e:
+            synthesis.error = e
+        except asyncio.CancelledError:  # server shutting down
+            synthesis.error = RuntimeError("TTS synthesis was cancelled")
+            raise
+        finally:
+            if synthesis.path is None and os.path.exists(partial):
+                os.remove(partial)
+            self._inflight.pop(key, None)
+            synthesis.done = True
+            synthesis.notify()
+
+    @staticmethod
+    async def _replay(path: str, on_chunk, chunk_size: int = 64 * 1024):
+        loop = asyncio.get_running_loop()
+        with open(path, "rb") as f:
+            while True:
+                chunk = await loop.run_in_executor(None, f.read, chunk_size)
+                if not chunk:
+                    break
+                await on_chunk(chunk)
+
+    def _evict(self, keep: str = None):
+        # `keep` (the entry just added, most recent) survives even if it alone exceeds the budget
+        while self._bytes > self.max_bytes and len(self._index) > (1 if keep else 0):
+            key, size = self._index.popitem(last=False)
+            self._bytes -= size
+            self.stats["evictions"] += 1
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+                "entries": len(self._index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "in_flight": len(self._inflight),
+            }
@@ -0,0 +1,116 @@
+# backend/voice_cache.py
+import asyncio
+import hashlib
+import json
+import time
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match check (weak comparison, as RFC 9110 requires for this header)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return etag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+
+class VoiceCache:
+    """In-memory copy of the ElevenLabs voice list, stored as serialized JSON plus its ETag.
+
+    Fresh for `ttl` seconds. A request in the last `refresh_ahead` seconds of that
+    window is answered from memory and starts a background refresh, so a steady
+    stream of requests never waits on the upstream. Once expired, the next request
+    refreshes inline; if the upstream fails, the stale copy is served for up to
+    `max_stale` seconds past expiry, and for `error_backoff` seconds after a failure
+    it is served without retrying, so an outage does not make every request wait
+    through the client's retries. Refreshes are single-flight."""
+
+    def __init__(self, fetch, ttl: float = 600, refresh_ahead: float = 60, max_stale: float = 86400,
+                 error_backoff: float = 30):
+        self.fetch = fetch  # async () -> JSON-serializable voice list
+        self.ttl = ttl
+        self.refresh_ahead = min(refresh_ahead, ttl)
+        self.max_stale = max_stale
+        self.error_backoff = error_backoff
+        self.body = None
+        self.etag = None
+        self.fetched_at = None
+        self._refresh = None  # in-flight asyncio.Task
+        self.last_error = None
+        self.failed_at = None
+        self.stats = {"hits": 0, "misses": 0, "refreshes": 0, "background_refreshes": 0, "errors": 0,
+                      "stale_served": 0, "not_modified": 0, "upstream_seconds": 0.0,
+                      "max_upstream_seconds": 0.0, "last_upstream_seconds": None}
+
+    def age(self) -> float:
+        return time.time() - self.fetched_at if self.fetched_at is not None else None
+
+    async def _fetch(self):
+        started = time.perf_counter()
+        try:
+            voices = await self.fetch()
+        except Exception as e:
+            self.stats["errors"] += 1
+            self.last_error = str(e)
+            self.failed_at = time.time()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stats["upstream_seconds"] += elapsed
+            self.stats["max_upstream_seconds"] = max(self.stats["max_upstream_seconds"], elapsed)
+            self.stats["last_upstream_seconds"] = round(elapsed, 4)
+        body = json.dumps(voices).encode("utf-8")
+        self.stats["refreshes"] += 1
+        self.last_error = self.failed_at = None
+        self.body, self.etag, self.fetched_at = body, _etag(body), time.time()
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.ensure_future(self._fetch())
+            # Retrieve background failures so they are not reported as never-retrieved
+            self._refresh.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return self._refresh
+
+    async def get(self):
+        """Return (body, etag, age); raises the upstream error only when nothing usable is cached."""
+        age = self.age()
+        if age is not None and age < self.ttl:
+            self.stats["hits"] += 1
+            if age >= self.ttl - self.refresh_ahead and (self._refresh is None or self._refresh.done()):
+                self.stats["background_refreshes"] += 1
+                self._start_refresh()
+            return self.body, self.etag, age
+        stale_ok = age is not None and age <= self.ttl + self.max_stale
+        if stale_ok and self.failed_at is not None and time.time() - self.failed_at < self.error_backoff:
+            self.stats["stale_served"] += 1
+            return self.body, self.etag, age
+        self.stats["misses"] += 1
+        try:
+            # shield: a client disconnecting must not cancel the refresh other requests wait on
+            await asyncio.shield(self._start_refresh())
+        except Exception:
+            if not stale_ok:
+                raise
+            self.stats["stale_served"] += 1
+            return self.body, self.etag, self.age()
+        return self.body, self.etag, self.age()
+
+    def metrics(self) -> dict:
+        refreshes = self.stats["refreshes"] + self.stats["errors"]
+        age = self.age()
+        return {
+            **{k: v for k, v in self.stats.items() if k != "upstream_seconds"},
+            "mean_upstream_seconds": round(self.stats["upstream_seconds"] / refreshes, 4) if refreshes else None,
+            "max_upstream_seconds": round(self.stats["max_upstream_seconds"], 4),
+            "age_seconds": round(age, 1) if age is not None else None,
+            "ttl_seconds": self.ttl,
+            "fresh": age is not None and age < self.ttl,
+            "bytes": len(self.body) if self.body else 0,
+            "etag": self.etag,
+            "last_error": self.last_error,
+        }
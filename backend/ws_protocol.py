@@ -0,0 +1,71 @@
+# backend/ws_protocol.py
+import asyncio
+import base64
+import json
+import os
+
+# Clients opt in by sending {"protocol": "binary", ...} in their first JSON message.
+# Binary mode: one JSON header text frame, then the raw payload in binary frames.
+# Legacy mode: a single text frame "<Label>: <base64>".
+# Streamed binary payloads of unknown size: header with "streaming": true, binary
+# frames as data arrives, then a {"type": "<kind>_end", "size": n} text frame.
+BINARY_PROTOCOL = "binary"
+CHUNK_SIZE = 64 * 1024
+
+
+def wants_binary(data: dict) -> bool:
+    return isinstance(data, dict) and data.get("protocol") == BINARY_PROTOCOL
+
+
+def _header(kind: str, mime: str, size: int, chunk_size: int, meta: dict = None) -> str:
+    chunks = (size + chunk_size - 1) // chunk_size if size else 0
+    header = {"type": kind, "mime": mime, "size": size, "chunk_size": chunk_size, "chunks": chunks}
+    if meta:
+        header.update(meta)
+    return json.dumps(header)
+
+
+async def send_bytes_payload(websocket, binary: bool, label: str, kind: str, mime: str, data: bytes,
+                             meta: dict = None, chunk_size: int = CHUNK_SIZE):
+    """Send an in-memory payload, sliced with memoryview so only one chunk is copied at a time."""
+    if not binary:
+        await websocket.send_text(f"{label}: {base64.b64encode(data).decode()}")
+        return
+    await websocket.send_text(_header(kind, mime, len(data), chunk_size, meta))
+    view = memoryview(data)
+    for offset in range(0, len(view), chunk_size):
+        await websocket.send_bytes(bytes(view[offset:offset + chunk_size]))
+
+
+async def send_file_payload(websocket, binary: bool, label: str, kind: str, mime: str, path: str,
+                            meta: dict = None, chunk_size: int = CHUNK_SIZE):
+    """Stream a file chunk by chunk (reads run off the event loop)."""
+    loop = asyncio.get_running_loop()
+    if not binary:
+        def encode():
+            with open(path, "rb") as f:
+                return base64.b64encode(f.read()).decode()
+        await websocket.send_text(f"{label}: {await loop.run_in_executor(None, encode)}")
+        return
+    size = os.path.getsize(path)
+    await websocket.send_text(_header(kind, mime, size, chunk_size, meta))
+    with open(path, "rb") as f:
+        while True:
+            chunk = await loop.run_in_executor(None, f.read, chunk_size)
+            if not chunk:
+                break
+            await websocket.send_bytes(chunk)
+
+
+async def send_stream_start(websocket, kind: str, mime: str, meta: dict = None):
+    header = {"type": kind, "mime": mime, "streaming": True}
+    if meta:
+        header.update(meta)
+    await websocket.send_text(json.dumps(header))
+
+
+async def send_stream_end(websocket, kind: str, size: int, meta: dict = None):
+    end = {"type": f"{kind}_end", "size": size}
+    if meta:
+        end.update(meta)
+    await websocket.send_text(json.dumps(end))
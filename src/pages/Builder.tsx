@@ -158,20 +158,35 @@ const startTraining = async () => {
     }
     
     const data = await trainResponse.json();
-    console.log("Training result:", data);
-    setTrainedModelId(data.trained_model_id || null);
-    setActiveStep(5); 
+    console.log("Training queued:", data);
+    const jobId = data.job_id;
 
-    const interval = setInterval(() => {
-      setTrainingProgress(prev => {
-        const newProgress = prev + 10;
-        if (newProgress >= 100) {
+    // Training runs in a background worker; poll the job until it finishes
+    const interval = setInterval(async () => {
+      try {
+        const statusResponse = await fetch(`http://localhost:8000/train/${jobId}`);
+        if (!statusResponse.ok) throw new Error(`Status check failed: ${statusResponse.status}`);
+        const job = await statusResponse.json();
+        const progress = job.progress || {};
+        if (progress.max_steps) {
+          setTrainingProgress(Math.min(99, Math.round((100 * progress.step) / progress.max_steps)));
+        }
+        if (job.status === "succeeded") {
+          clearInterval(interval);
+          setTrainingProgress(100);
+          setIsTraining(false);
+          setTrainedModelId(data.trained_model_id || jobId);
+          setActiveStep(5);
+        } else if (job.status === "failed" || job.status === "cancelled") {
           clearInterval(interval);
           setIsTraining(false);
+          setTrainingProgress(0);
+          alert(`Training ${job.status}${job.error ? `: ${job.error}` : ""}`);
         }
-        return Math.min(newProgress, 100);
-      });
-    }, 1000);
+      } catch (error) {
+        console.error("Training status error:", error);
+      }
+    }, 5000);
   } catch (error) {
     console.error("Training error:", error);
     setIsTraining(false);